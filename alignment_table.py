@@ -0,0 +1,241 @@
+import bisect
+import glob
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from paragraph_store import (STORE_EXTENSION, ParagraphStore, ensure_store, format_identity,
+                             format_reference, pack_key, parse_format_identity, parse_reference)
+from translation_stream import iter_object_array, read_header
+
+# Cross-translation alignment: one row per FormatTable paragraph, one column per translation
+# holding that paragraph's row in the translation's paragraph store (-1 when it is missing).
+#
+# Layout (little endian):
+#   header    MAGIC, uint32 rows, uint32 columns
+#   columns   columns x (uint32 language id, uint32 paragraph count of the store it was built from)
+#   keys      rows x uint64   packed keys of the FormatTable identities, sorted
+#   cells     columns x rows x int32, one contiguous run per column
+MAGIC = b"TUBALN01"
+HEADER = struct.Struct("<8sII")
+COLUMN = struct.Struct("<II")
+ALIGNMENT_FILENAME = "AlignmentTable.bin"
+FORMAT_TABLE_FILENAME = "FormatTable.gz"
+
+_TRANSLATION_FILE = re.compile(r"^TR(\d{3})\.")
+
+class AlignedParagraph(NamedTuple):
+    Reference: str
+    Key: int
+    Texts: Dict[int, Optional[str]]
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def read_format_keys(format_table_path: str = FORMAT_TABLE_FILENAME) -> array:
+    """
+    Packed keys of every FormatIdentity in the format table, sorted (duplicates kept).
+    Malformed identities (the table has a stray "119:-" entry) are skipped.
+    """
+    keys = []
+    for item in iter_object_array(format_table_path, "ParagraphsFormat"):
+        try:
+            keys.append(parse_format_identity(item.get("FormatIdentity", "")))
+        except ValueError:
+            continue
+    return array("Q", sorted(keys))
+
+def _compile_column(translation_path: str) -> Tuple[int, str]:
+    """Worker: one streaming pass over a translation (when its store is stale) -> (language id, store path)."""
+    store_path = ensure_store(translation_path)
+    language_id = read_header(translation_path).get("LanguageID")
+    if language_id is None:
+        # No LanguageID in the header: the TRnnn file name carries it
+        match = _TRANSLATION_FILE.match(os.path.basename(translation_path))
+        if not match:
+            raise ValueError(f"{translation_path} has no LanguageID and is not named TRnnn")
+        language_id = int(match.group(1))
+    return language_id, store_path
+
+def _align(keys: Sequence[int], store_keys: Sequence[int]) -> array:
+    """
+    Row in store_keys of every key, by merging the two sorted lists.
+    The n-th copy of a duplicated key maps to the n-th copy in the store.
+    """
+    rows = array("i", [-1]) * len(keys)
+    position, count = 0, len(store_keys)
+    for i, key in enumerate(keys):
+        while position < count and store_keys[position] < key:
+            position += 1
+        if position < count and store_keys[position] == key:
+            rows[i] = position
+            position += 1
+    return rows
+
+def build_alignment(translations: Optional[Iterable[str]] = None, format_table_path: str = FORMAT_TABLE_FILENAME,
+                    output_path: str = ALIGNMENT_FILENAME, max_workers: Optional[int] = None) -> str:
+    """
+    Builds the alignment table. Each translation is compiled to its paragraph store by a
+    separate process (a single streaming pass, skipped when the store is up to date), then
+    every column is filled by merging the store's sorted keys with the FormatTable keys.
+    """
+    translations = sorted(translations or glob.glob(os.path.join(os.path.dirname(output_path) or ".",
+                                                                 "TR[0-9][0-9][0-9].gz")))
+    keys = read_format_keys(format_table_path)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        compiled = list(executor.map(_compile_column, translations))
+
+    columns = []
+    for index, (language_id, store_path) in enumerate(sorted(compiled)):
+        if index and language_id == columns[-1][0]:
+            raise ValueError(f"two translations have LanguageID {language_id}; each column needs its own")
+        with ParagraphStore(store_path) as store:
+            columns.append((language_id, len(store), _align(keys, store.keys)))
+
+    temp_path = f"{output_path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(keys), len(columns)))
+        for language_id, store_count, _ in columns:
+            f.write(COLUMN.pack(language_id, store_count))
+        f.write(_little_endian(keys))
+        for _, _, rows in columns:
+            f.write(_little_endian(rows))
+    os.replace(temp_path, output_path)
+    return output_path
+
+class AlignmentTable:
+    """
+    Read-only, memory mapped alignment table.
+    Paragraph texts come from the paragraph stores (TRnnn.pstore) next to the table, opened on demand;
+    the stored rows are used directly, so no store is searched.
+    """
+
+    def __init__(self, path: str = ALIGNMENT_FILENAME, store_dir: Optional[str] = None):
+        self.path = path
+        self.store_dir = store_dir if store_dir is not None else (os.path.dirname(path) or ".")
+        self._stores: Dict[int, ParagraphStore] = {}
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, column_count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an alignment table")
+
+        position = HEADER.size
+        self.languages: List[int] = []
+        self._store_counts: Dict[int, int] = {}
+        for _ in range(column_count):
+            language_id, store_count = COLUMN.unpack_from(self._mmap, position)
+            self.languages.append(language_id)
+            self._store_counts[language_id] = store_count
+            position += COLUMN.size
+
+        view = memoryview(self._mmap)
+        keys_end = position + 8 * self.count
+        if sys.byteorder == "little":
+            self.keys = view[position:keys_end].cast("Q")
+            cells = view[keys_end:keys_end + 4 * self.count * column_count].cast("i")
+        else:
+            self.keys = array("Q", bytes(view[position:keys_end]))
+            self.keys.byteswap()
+            cells = array("i", bytes(view[keys_end:keys_end + 4 * self.count * column_count]))
+            cells.byteswap()
+        self._cells = cells
+        self._columns = {language_id: cells[i * self.count:(i + 1) * self.count]
+                         for i, language_id in enumerate(self.languages)}
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __enter__(self) -> 'AlignmentTable':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for store in self._stores.values():
+            store.close()
+        self._stores = {}
+        for column in self.__dict__.pop("_columns", {}).values():
+            if isinstance(column, memoryview):
+                column.release()
+        for name in ("keys", "_cells"):
+            view = self.__dict__.pop(name, None)
+            if isinstance(view, memoryview):
+                view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def column(self, language_id: int) -> Sequence[int]:
+        """Store rows of every table row for one translation (-1 = paragraph missing there)."""
+        return self._columns[language_id]
+
+    def row_range(self, start_paper: int, end_paper: Optional[int] = None) -> range:
+        """Table rows of papers start_paper..end_paper (inclusive)."""
+        lo = bisect.bisect_left(self.keys, pack_key(start_paper, 0, 0))
+        hi = self.count if end_paper is None else bisect.bisect_left(self.keys, pack_key(end_paper + 1, 0, 0), lo)
+        return range(lo, hi)
+
+    def locate(self, reference) -> Dict[int, int]:
+        """Store row of one paragraph ("146:1.1", "146:1-1" or packed key) in every translation."""
+        if isinstance(reference, str):
+            key = parse_format_identity(reference) if "-" in reference else parse_reference(reference)
+        else:
+            key = reference
+        row = bisect.bisect_left(self.keys, key)
+        if row >= self.count or self.keys[row] != key:
+            return {}
+        return {language_id: self._columns[language_id][row] for language_id in self.languages}
+
+    def store(self, language_id: int) -> ParagraphStore:
+        store = self._stores.get(language_id)
+        if store is None:
+            store = ParagraphStore(os.path.join(self.store_dir, f"TR{language_id:03d}{STORE_EXTENSION}"))
+            if len(store) != self._store_counts[language_id]:
+                store.close()
+                raise ValueError(f"TR{language_id:03d}{STORE_EXTENSION} changed since {self.path} was built")
+            self._stores[language_id] = store
+        return store
+
+    def paragraphs(self, languages: Iterable[int], start_paper: int,
+                   end_paper: Optional[int] = None) -> List[AlignedParagraph]:
+        """
+        Every paragraph of papers start_paper..end_paper (inclusive) with its text in each
+        requested translation (None where that translation lacks the paragraph), in one call.
+        """
+        languages = list(languages)
+        stores = [(language_id, self.store(language_id), self._columns[language_id]) for language_id in languages]
+        result = []
+        for row in self.row_range(start_paper, end_paper):
+            texts = {}
+            for language_id, store, column in stores:
+                store_row = column[row]
+                texts[language_id] = store.text_at(store_row) if store_row >= 0 else None
+            key = self.keys[row]
+            result.append(AlignedParagraph(format_reference(key), key, texts))
+        return result
+
+if __name__ == "__main__":
+    import time
+
+    start_time = time.time()
+    output = build_alignment(sys.argv[1:] or None)
+    with AlignmentTable(output) as table:
+        print(f"{output}: {len(table)} paragraphs x {len(table.languages)} translations "
+              f"in {time.time() - start_time:.2f}s")
+        for language_id in table.languages:
+            missing = sum(1 for row in table.column(language_id) if row < 0)
+            if missing:
+                print(f"  TR{language_id:03d}: {missing} paragraphs missing")
+        print(f"  e.g. {format_identity(table.keys[1])} -> {table.locate(table.keys[1])}")
@@ -0,0 +1,182 @@
+import json
+import os
+import struct
+import sys
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from paragraph_store import ParagraphStore, ensure_store, pack_key, parse_format_identity
+from translation_stream import open_translation
+
+# FormatTable.gz as typed columns, sorted by packed key (paper << 32 | section << 16 | paragraph).
+# The parsed table is cached next to the source so later loads skip the JSON entirely.
+#
+# Cache layout (little endian):
+#   header   MAGIC, uint32 rows, uint32 reserved
+#   keys     rows x uint64
+#   page     rows x uint16
+#   line     rows x uint16
+#   format   rows x uint8
+MAGIC = b"TUBFMT01"
+HEADER = struct.Struct("<8sII")
+FORMAT_TABLE_FILENAME = "FormatTable.gz"
+CACHE_EXTENSION = ".ftbl"
+
+def cache_path_for(source_path: str) -> str:
+    return os.path.splitext(source_path)[0] + CACHE_EXTENSION
+
+class FormatTable:
+    """Columns of the format table; row i of every column describes the paragraph keys[i]."""
+
+    def __init__(self, keys: np.ndarray, page: np.ndarray, line: np.ndarray, format: np.ndarray):
+        self.keys = keys
+        self.page = page
+        self.line = line
+        self.format = format
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def paper(self) -> np.ndarray:
+        return (self.keys >> np.uint64(32)).astype(np.uint16)
+
+    @property
+    def section(self) -> np.ndarray:
+        return ((self.keys >> np.uint64(16)) & np.uint64(0xFFFF)).astype(np.uint16)
+
+    @property
+    def paragraph(self) -> np.ndarray:
+        return (self.keys & np.uint64(0xFFFF)).astype(np.uint16)
+
+    def paper_rows(self, start_paper: int, end_paper: Optional[int] = None) -> slice:
+        """Rows of papers start_paper..end_paper (inclusive; None runs through the last paper)."""
+        lo = np.searchsorted(self.keys, np.uint64(pack_key(start_paper, 0, 0)))
+        hi = (len(self.keys) if end_paper is None
+              else np.searchsorted(self.keys, np.uint64(pack_key(end_paper + 1, 0, 0))))
+        return slice(int(lo), int(hi))
+
+    def join(self, keys: Sequence[int]) -> np.ndarray:
+        """
+        Table row of every key (-1 when absent), in one vectorized pass.
+        Repeated keys map to successive copies in the table, matching the stable order
+        paragraph stores use for the few duplicated paragraphs.
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        rows = np.searchsorted(self.keys, keys, side="left").astype(np.int64)
+        # n-th occurrence of each key within the request
+        order = np.argsort(keys, kind="stable")
+        ordered = keys[order]
+        first = np.searchsorted(ordered, ordered, side="left")
+        occurrence = np.empty(len(keys), dtype=np.int64)
+        occurrence[order] = np.arange(len(keys)) - first
+        rows += occurrence
+        found = rows < len(self.keys)
+        found[found] = self.keys[rows[found]] == keys[found]
+        rows[~found] = -1
+        return rows
+
+    def join_columns(self, keys: Sequence[int]) -> Dict[str, np.ndarray]:
+        """Page, Line and Format of every key, plus a 'found' mask; absent keys get zeros."""
+        rows = self.join(keys)
+        found = rows >= 0
+        safe = np.where(found, rows, 0)
+        columns = {"found": found}
+        for name in ("page", "line", "format"):
+            values = getattr(self, name)
+            columns[name] = np.where(found, values[safe] if len(values) else 0, 0).astype(values.dtype)
+        return columns
+
+    def join_translation(self, translation_path: str, start_paper: int = 0,
+                         end_paper: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """
+        Joins the table onto the paragraphs of a translation (optionally a paper range),
+        using the keys of its paragraph store. The result is aligned with the store rows
+        and also carries those rows under 'row'.
+        """
+        with ParagraphStore(ensure_store(translation_path)) as store:
+            keys = np.frombuffer(store.keys, dtype=np.uint64).copy()
+        lo, hi = np.searchsorted(keys, [pack_key(start_paper, 0, 0),
+                                        pack_key(end_paper + 1, 0, 0) if end_paper is not None else 2 ** 64 - 1])
+        columns = self.join_columns(keys[lo:hi])
+        columns["row"] = np.arange(lo, hi)
+        columns["keys"] = keys[lo:hi]
+        return columns
+
+    def save(self, path: str):
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(self.keys), 0))
+            for column, dtype in ((self.keys, "<u8"), (self.page, "<u2"), (self.line, "<u2"), (self.format, "u1")):
+                f.write(column.astype(dtype).tobytes())
+        os.replace(temp_path, path)
+
+    @classmethod
+    def read(cls, path: str) -> 'FormatTable':
+        with open(path, "rb") as f:
+            magic, rows, _ = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a format table cache")
+            keys = np.fromfile(f, dtype="<u8", count=rows).astype(np.uint64)
+            page = np.fromfile(f, dtype="<u2", count=rows).astype(np.uint16)
+            line = np.fromfile(f, dtype="<u2", count=rows).astype(np.uint16)
+            format = np.fromfile(f, dtype="u1", count=rows)
+        if len(format) != rows:
+            raise ValueError(f"{path} is truncated")
+        return cls(keys, page, line, format)
+
+def parse_format_table(source_path: str = FORMAT_TABLE_FILENAME) -> FormatTable:
+    """
+    Parses the JSON table into columns sorted by key (stable, duplicates kept).
+    Malformed identities (the table has a stray "119:-" entry) are skipped.
+    """
+    with open_translation(source_path) as stream:
+        items = json.load(stream)["ParagraphsFormat"]
+    keys, page, line, format = [], [], [], []
+    for item in items:
+        try:
+            key = parse_format_identity(item.get("FormatIdentity", ""))
+        except ValueError:
+            continue
+        keys.append(key)
+        page.append(item.get("Page", 0))
+        line.append(item.get("Line", 0))
+        format.append(item.get("Format", 0))
+    keys = np.array(keys, dtype=np.uint64)
+    order = np.argsort(keys, kind="stable")
+    return FormatTable(keys[order], np.array(page, dtype=np.uint16)[order],
+                       np.array(line, dtype=np.uint16)[order], np.array(format, dtype=np.uint8)[order])
+
+def load_format_table(source_path: str = FORMAT_TABLE_FILENAME, cache_path: Optional[str] = None) -> FormatTable:
+    """The format table from its binary cache, parsing (and caching) the JSON only when the cache is stale."""
+    cache_path = cache_path or cache_path_for(source_path)
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(source_path):
+        try:
+            return FormatTable.read(cache_path)
+        except ValueError:
+            pass
+    table = parse_format_table(source_path)
+    table.save(cache_path)
+    return table
+
+if __name__ == "__main__":
+    import time
+
+    source = sys.argv[1] if len(sys.argv) > 1 else FORMAT_TABLE_FILENAME
+    translation = sys.argv[2] if len(sys.argv) > 2 else "TR000.gz"
+
+    start_time = time.perf_counter()
+    table = parse_format_table(source)
+    parse_time = time.perf_counter() - start_time
+    table.save(cache_path_for(source))
+    start_time = time.perf_counter()
+    table = load_format_table(source)
+    print(f"{source}: {len(table)} rows; JSON parse {parse_time * 1000:.1f} ms, "
+          f"cached load {(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+    ensure_store(translation)
+    start_time = time.perf_counter()
+    joined = table.join_translation(translation)
+    print(f"{translation}: joined {len(joined['row'])} paragraphs ({int(joined['found'].sum())} found) "
+          f"in {(time.perf_counter() - start_time) * 1000:.1f} ms")
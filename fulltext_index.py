@@ -0,0 +1,406 @@
+import bisect
+import glob
+import mmap
+import os
+import re
+import struct
+import sys
+import unicodedata
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from paragraph_store import STORE_EXTENSION, ParagraphStore, ensure_store, format_reference
+from translation_stream import read_header
+
+# Positional inverted index over the paragraphs of one translation, row-aligned with its
+# paragraph store (document n is row n of the .pstore, so snippets come from the store).
+#
+# Layout (little endian):
+#   header     MAGIC, uint32 language id, uint32 rows, uint32 terms, uint32 reserved
+#   term_offs  (terms + 1) x uint32 into the term blob
+#   post_offs  (terms + 1) x uint64 into the postings blob
+#   doc_freq   terms x uint32
+#   positions  terms x uint32 (occurrences of the term)
+#   term blob  UTF-8 terms in sorted order, padded to 8 bytes
+#   postings   per term, one varint stream: doc gaps (doc_freq values), positions per doc
+#              (doc_freq values), then position gaps restarting at every doc
+MAGIC = b"TUBFTI01"
+HEADER = struct.Struct("<8sIIII")
+INDEX_EXTENSION = ".ftidx"
+
+# Prefix queries expanding to more terms than this use only the most frequent ones
+MAX_PREFIX_TERMS = 512
+SNIPPET_CHARS = 160
+
+_MARKUP = re.compile(r"<[^>]*>")
+_WORD = re.compile(r"\w+")
+# Scripts written without spaces are indexed as overlapping character bigrams
+_UNSPACED = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\u0e00-\u0e7f\uf900-\ufaff]")
+_QUERY = re.compile(r'"([^"]*)"|(\S+)')
+
+class SearchHit(NamedTuple):
+    Reference: str
+    Key: int
+    Score: int
+    Snippet: str
+
+def _fold(word: str) -> str:
+    """Case and diacritic folding: 'Urântia' and 'URANTIA' index as the same term."""
+    decomposed = unicodedata.normalize("NFKD", word.casefold())
+    # NFC afterwards recomposes scripts such as Hangul, whose jamo are not combining marks
+    return unicodedata.normalize("NFC", "".join(c for c in decomposed if not unicodedata.combining(c)))
+
+def tokenize(text: str) -> Iterator[Tuple[str, int, int]]:
+    """
+    Yields (term, start, end) for every token of a paragraph; start/end index the original text.
+    Markup such as <em> is skipped without shifting offsets.
+    """
+    masked = _MARKUP.sub(lambda m: " " * len(m.group()), text)
+    for match in _WORD.finditer(masked):
+        word = match.group()
+        if _UNSPACED.search(word) and len(word) > 1:
+            for i in range(len(word) - 1):
+                yield _fold(word[i:i + 2]), match.start() + i, match.start() + i + 2
+        else:
+            yield _fold(word), match.start(), match.end()
+
+def _varint_sizes(values: np.ndarray) -> np.ndarray:
+    sizes = np.ones(len(values), dtype=np.int64)
+    rest = values.astype(np.uint64) >> np.uint64(7)
+    while rest.any():
+        sizes += rest > 0
+        rest >>= np.uint64(7)
+    return sizes
+
+def _encode_varints(values: np.ndarray) -> np.ndarray:
+    """LEB128 encoding of non-negative integers, vectorized."""
+    values = values.astype(np.uint64)
+    sizes = _varint_sizes(values)
+    out = np.empty(int(sizes.sum()), dtype=np.uint8)
+    starts = np.cumsum(sizes) - sizes
+    for k in range(int(sizes.max()) if len(sizes) else 0):
+        selected = sizes > k
+        byte = (values[selected] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = (sizes[selected] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[selected] + k] = (byte | more).astype(np.uint8)
+    return out
+
+def _decode_varints(data: np.ndarray) -> np.ndarray:
+    """Inverse of _encode_varints for a byte array holding whole varints."""
+    if not len(data):
+        return np.empty(0, dtype=np.int64)
+    last = data < 0x80
+    group = np.concatenate(([0], np.cumsum(last[:-1])))
+    starts = np.flatnonzero(np.concatenate(([True], last[:-1])))
+    shift = np.arange(len(data)) - starts[group]
+    # Values stay far below 2**53, so float weights are exact
+    weights = (data & 0x7F).astype(np.float64) * np.exp2(7.0 * shift)
+    return np.bincount(group, weights=weights).astype(np.int64)
+
+def _index_path(translation_path: str) -> str:
+    return os.path.splitext(translation_path)[0] + INDEX_EXTENSION
+
+def build_index(translation_path: str, output_path: Optional[str] = None) -> str:
+    """
+    Builds the full-text index of a TR*.gz translation and returns its path.
+    The paragraph store is compiled first when missing or older than the translation.
+    """
+    store_path = ensure_store(translation_path)
+    if output_path is None:
+        output_path = _index_path(translation_path)
+    language_id = read_header(translation_path).get("LanguageID") or 0
+
+    term_ids = {}
+    occ_terms, occ_docs, occ_positions = array("I"), array("I"), array("I")
+    with ParagraphStore(store_path) as store:
+        rows = len(store)
+        for row in range(rows):
+            for position, (term, _, _) in enumerate(tokenize(store.text_at(row))):
+                occ_terms.append(term_ids.setdefault(term, len(term_ids)))
+                occ_docs.append(row)
+                occ_positions.append(position)
+
+    terms = sorted(term_ids)
+    rank = np.empty(len(terms), dtype=np.int64)
+    rank[[term_ids[t] for t in terms]] = np.arange(len(terms))
+    term = rank[np.frombuffer(occ_terms, dtype=np.uint32)]
+    doc = np.frombuffer(occ_docs, dtype=np.uint32).astype(np.int64)
+    position = np.frombuffer(occ_positions, dtype=np.uint32).astype(np.int64)
+    order = np.lexsort((position, doc, term))
+    term, doc, position = term[order], doc[order], position[order]
+
+    # One group per (term, doc) pair
+    new_group = np.ones(len(term), dtype=bool)
+    new_group[1:] = (term[1:] != term[:-1]) | (doc[1:] != doc[:-1])
+    group_start = np.flatnonzero(new_group)
+    group_term = term[group_start]
+    group_doc = doc[group_start]
+    group_count = np.diff(np.append(group_start, len(term)))
+    new_term = np.ones(len(group_term), dtype=bool)
+    new_term[1:] = group_term[1:] != group_term[:-1]
+    doc_gaps = group_doc - np.where(new_term, 0, np.concatenate(([0], group_doc[:-1])))
+    position_gaps = position - np.where(new_group, 0, np.concatenate(([0], position[:-1])))
+
+    # Streams of every term back to back: doc gaps, counts, position gaps
+    values = np.concatenate((doc_gaps, group_count, position_gaps))
+    value_term = np.concatenate((group_term, group_term, term))
+    section = np.repeat([0, 1, 2], [len(group_term), len(group_term), len(term)])
+    order = np.lexsort((np.arange(len(values)), section, value_term))
+    encoded = _encode_varints(values[order])
+    byte_sizes = np.bincount(value_term, weights=_varint_sizes(values), minlength=len(terms)).astype(np.uint64)
+
+    post_offsets = np.zeros(len(terms) + 1, dtype="<u8")
+    post_offsets[1:] = np.cumsum(byte_sizes)
+    doc_freq = np.bincount(group_term, minlength=len(terms)).astype("<u4")
+    occurrences = np.bincount(term, minlength=len(terms)).astype("<u4")
+    term_bytes = [t.encode("utf-8") for t in terms]
+    term_offsets = np.zeros(len(terms) + 1, dtype="<u4")
+    term_offsets[1:] = np.cumsum([len(b) for b in term_bytes])
+
+    temp_path = f"{output_path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, language_id, rows, len(terms), 0))
+        f.write(term_offsets.tobytes())
+        f.write(post_offsets.tobytes())
+        f.write(doc_freq.tobytes())
+        f.write(occurrences.tobytes())
+        f.writelines(term_bytes)
+        f.write(b"\0" * (-f.tell() % 8))
+        f.write(encoded.tobytes())
+    os.replace(temp_path, output_path)
+    return output_path
+
+class _TermTable:
+    """Sorted term list read straight from the mapping; supports bisect without building a list."""
+
+    def __init__(self, blob: memoryview, offsets: np.ndarray):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self._blob[self._offsets[i]:self._offsets[i + 1]]).decode("utf-8")
+
+class FullTextIndex:
+    """
+    Memory mapped full-text index of one translation.
+    Queries combine words (all required), "exact phrases" and prefix* terms, also inside phrases.
+    """
+
+    def __init__(self, path: str, store: Optional[ParagraphStore] = None):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.language_id, self.rows, self.term_count, _ = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a full-text index")
+
+        data = np.frombuffer(self._mmap, dtype=np.uint8)
+        position = HEADER.size
+        n = self.term_count
+        self._term_offsets = data[position:position + 4 * (n + 1)].view("<u4")
+        position += 4 * (n + 1)
+        self._post_offsets = data[position:position + 8 * (n + 1)].view("<u8")
+        position += 8 * (n + 1)
+        self.doc_freq = data[position:position + 4 * n].view("<u4")
+        position += 4 * n
+        self.occurrences = data[position:position + 4 * n].view("<u4")
+        position += 4 * n
+        blob_size = int(self._term_offsets[n])
+        self.terms = _TermTable(memoryview(self._mmap)[position:position + blob_size], self._term_offsets)
+        position += blob_size + (-(position + blob_size) % 8)
+        self._postings = data[position:]
+
+        self._own_store = store is None
+        self.store = store or ParagraphStore(os.path.splitext(path)[0] + STORE_EXTENSION)
+        if len(self.store) != self.rows:
+            self.close()
+            raise ValueError(f"{path} was built for a different paragraph store; rebuild it")
+
+    def __enter__(self) -> 'FullTextIndex':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for name in ("_term_offsets", "_post_offsets", "doc_freq", "occurrences", "_postings", "terms"):
+            self.__dict__.pop(name, None)
+        if getattr(self, "_own_store", False) and "store" in self.__dict__:
+            self.__dict__.pop("store").close()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # A caller still holds an array view; the mapping is released with it
+                pass
+            self._mmap = None
+        self._file.close()
+
+    def term_id(self, term: str) -> int:
+        i = bisect.bisect_left(self.terms, term)
+        return i if i < self.term_count and self.terms[i] == term else -1
+
+    def prefix_ids(self, prefix: str) -> List[int]:
+        """Ids of the terms starting with prefix, the most frequent first when over MAX_PREFIX_TERMS."""
+        lo = bisect.bisect_left(self.terms, prefix)
+        hi = bisect.bisect_left(self.terms, prefix + "\U0010ffff", lo)
+        ids = list(range(lo, hi))
+        if len(ids) > MAX_PREFIX_TERMS:
+            ids.sort(key=lambda i: -int(self.occurrences[i]))
+            ids = sorted(ids[:MAX_PREFIX_TERMS])
+        return ids
+
+    def postings(self, term_id: int) -> np.ndarray:
+        """Occurrences of a term as packed doc << 32 | position, sorted."""
+        values = _decode_varints(self._postings[int(self._post_offsets[term_id]):
+                                                int(self._post_offsets[term_id + 1])])
+        df = int(self.doc_freq[term_id])
+        docs = np.cumsum(values[:df])
+        counts = values[df:2 * df]
+        gaps = values[2 * df:]
+        # Position gaps restart at every doc: subtract the running total at each doc start
+        running = np.cumsum(gaps)
+        doc_starts = np.cumsum(counts) - counts
+        positions = running - np.repeat(running[doc_starts] - gaps[doc_starts], counts)
+        return (np.repeat(docs, counts) << 32) | positions
+
+    def _word_matches(self, word: str) -> np.ndarray:
+        if word.endswith("*"):
+            terms = [term for term, _, _ in tokenize(word[:-1])]
+            if len(terms) != 1:
+                return np.empty(0, dtype=np.int64)
+            ids = self.prefix_ids(terms[0])
+        else:
+            terms = [term for term, _, _ in tokenize(word)]
+            if len(terms) != 1:
+                return self._phrase_matches(word)
+            ids = [self.term_id(terms[0])]
+        arrays = [self.postings(i) for i in ids if i >= 0]
+        if not arrays:
+            return np.empty(0, dtype=np.int64)
+        return arrays[0] if len(arrays) == 1 else np.unique(np.concatenate(arrays))
+
+    def _phrase_matches(self, phrase: str) -> np.ndarray:
+        """Packed doc << 32 | position of the first word of every occurrence of the phrase."""
+        words = phrase.split()
+        # A word may tokenize into several terms (e.g. "god's"); each is one phrase slot
+        slots = []
+        for word in words:
+            if word.endswith("*"):
+                slots.append(word)
+            else:
+                slots.extend(term for term, _, _ in tokenize(word))
+        matches = None
+        for offset, slot in enumerate(slots):
+            occurrences = self._word_matches(slot) - offset
+            matches = occurrences if matches is None else np.intersect1d(matches, occurrences, assume_unique=True)
+            if not len(matches):
+                break
+        return matches if matches is not None else np.empty(0, dtype=np.int64)
+
+    def _parse(self, query: str) -> List[Tuple[str, int]]:
+        """Query clauses as (text, length in terms); quoted text is a phrase."""
+        clauses = []
+        for phrase, word in _QUERY.findall(query):
+            text = phrase or word
+            length = sum(1 if w.endswith("*") else len(list(tokenize(w))) for w in text.split())
+            if length:
+                clauses.append((text, length))
+        return clauses
+
+    def search(self, query: str, limit: int = 20, mark: Tuple[str, str] = ("<mark>", "</mark>")) -> List[SearchHit]:
+        """
+        Paragraphs matching every clause of the query, by number of matches, then in book order.
+        Each hit carries a snippet of the paragraph with the matches highlighted.
+        """
+        clauses = self._parse(query)
+        if not clauses:
+            return []
+        matched = []
+        docs = None
+        for text, length in clauses:
+            starts = self._phrase_matches(text)
+            matched.append((starts, length))
+            clause_docs = np.unique(starts >> 32)
+            docs = clause_docs if docs is None else np.intersect1d(docs, clause_docs, assume_unique=True)
+            if not len(docs):
+                return []
+
+        scores = np.zeros(len(docs), dtype=np.int64)
+        for starts, _ in matched:
+            start_docs = starts >> 32
+            start_docs = start_docs[np.isin(start_docs, docs)]
+            scores += np.bincount(np.searchsorted(docs, start_docs), minlength=len(docs))
+        order = np.lexsort((docs, -scores))[:limit]
+
+        hits = []
+        for i in order.tolist():
+            row = int(docs[i])
+            positions = set()
+            for starts, length in matched:
+                in_doc = starts[(starts >> 32) == row] & 0xFFFFFFFF
+                for start in in_doc.tolist():
+                    positions.update(range(start, start + length))
+            key = int(self.store.keys[row])
+            hits.append(SearchHit(format_reference(key), key, int(scores[i]),
+                                  _snippet(self.store.text_at(row), positions, mark)))
+        return hits
+
+def _snippet(text: str, positions: set, mark: Tuple[str, str]) -> str:
+    """Plain-text window around the first match, with matched tokens wrapped in mark."""
+    spans = [(start, end) for position, (_, start, end) in enumerate(tokenize(text)) if position in positions]
+    # Bigram tokens overlap: merge spans so every character is marked once
+    merged: List[List[int]] = []
+    for start, end in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    first = merged[0][0] if merged else 0
+    window_start = max(0, first - SNIPPET_CHARS // 3)
+    window_end = min(len(text), window_start + SNIPPET_CHARS)
+    # Markup is removed from the text pieces only, so marks that look like tags survive
+    clean = lambda piece: _MARKUP.sub(" ", piece)
+    pieces = []
+    cursor = window_start
+    for start, end in merged:
+        if end <= window_start or start >= window_end:
+            continue
+        pieces.append(clean(text[cursor:start]))
+        pieces.append(mark[0] + text[start:end] + mark[1])
+        cursor = end
+    pieces.append(clean(text[cursor:window_end]))
+    snippet = " ".join("".join(pieces).split())
+    return ("…" if window_start > 0 else "") + snippet + ("…" if window_end < len(text) else "")
+
+def open_index(translation: str) -> FullTextIndex:
+    """Index of a translation given as 'TR000', 'TR000.gz' or the index path itself."""
+    return FullTextIndex(_index_path(translation if os.path.splitext(translation)[1] else translation + ".gz"))
+
+if __name__ == "__main__":
+    import time
+
+    if len(sys.argv) >= 4 and sys.argv[1] == "search":
+        with open_index(sys.argv[2]) as index:
+            start_time = time.perf_counter()
+            hits = index.search(" ".join(sys.argv[3:]), mark=("[", "]"))
+            elapsed = time.perf_counter() - start_time
+            for hit in hits:
+                print(f"{hit.Reference:>12}  {hit.Snippet}")
+            print(f"{len(hits)} hits in {elapsed * 1000:.1f} ms")
+    else:
+        # python fulltext_index.py [build] [TR000.gz ...]
+        sources = [a for a in sys.argv[1:] if a != "build"] or sorted(glob.glob("TR[0-9][0-9][0-9].gz"))
+        start_time = time.time()
+        with ProcessPoolExecutor() as executor:
+            for source, output in zip(sources, executor.map(build_index, sources)):
+                with FullTextIndex(output) as index:
+                    print(f"{source} -> {output}: {index.term_count} terms, {index.rows} paragraphs")
+        print(f"Built {len(sources)} indexes in {time.time() - start_time:.2f}s")
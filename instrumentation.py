@@ -0,0 +1,343 @@
+import atexit
+import collections
+import http.server
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Lightweight spans, counters and peak RSS for the content pipeline, switched on by environment:
+#
+#   TUB_INSTRUMENT=1         collect in memory (implied by any of the variables below)
+#   TUB_TRACE=trace.jsonl    append one JSON line per span
+#   TUB_METRICS_PORT=9464    serve the aggregates as Prometheus text on http://127.0.0.1:PORT/metrics
+#   TUB_METRICS_FILE=x.prom  write the Prometheus text at exit (for batch scripts)
+#   TUB_PROFILE=out.folded   sample the stacks of profile() blocks (the search hot path) and
+#                            write them in collapsed format at exit; TUB_PROFILE_INTERVAL_MS sets the rate
+#
+# With everything unset, span() and profile() return a shared no-op object and record() returns
+# at once, so instrumented code pays one global lookup and one call.
+INSTRUMENT_ENV = "TUB_INSTRUMENT"
+TRACE_ENV = "TUB_TRACE"
+METRICS_PORT_ENV = "TUB_METRICS_PORT"
+METRICS_FILE_ENV = "TUB_METRICS_FILE"
+PROFILE_ENV = "TUB_PROFILE"
+PROFILE_INTERVAL_ENV = "TUB_PROFILE_INTERVAL_MS"
+DEFAULT_PROFILE_INTERVAL_MS = 5.0
+METRIC_PREFIX = "tub"
+
+TRACE_PATH = os.environ.get(TRACE_ENV)
+METRICS_PORT = os.environ.get(METRICS_PORT_ENV)
+METRICS_FILE = os.environ.get(METRICS_FILE_ENV)
+PROFILE_PATH = os.environ.get(PROFILE_ENV)
+ENABLED = bool(os.environ.get(INSTRUMENT_ENV) or TRACE_PATH or METRICS_PORT or METRICS_FILE)
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process so far (0 where the platform does not report it)."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+class _Totals:
+    __slots__ = ("calls", "seconds", "max_seconds", "rows")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+
+_lock = threading.Lock()
+_totals: Dict[str, _Totals] = collections.defaultdict(_Totals)
+_local = threading.local()
+_trace_file = None
+_server = None
+_server_failed = False
+
+def _emit(name: str, start: float, seconds: float, rows: int, attrs: dict):
+    global _trace_file
+    peak = peak_rss_bytes()
+    with _lock:
+        totals = _totals[name]
+        totals.calls += 1
+        totals.seconds += seconds
+        totals.max_seconds = max(totals.max_seconds, seconds)
+        totals.rows += rows
+        if TRACE_PATH:
+            if _trace_file is None:
+                _trace_file = open(TRACE_PATH, "a", encoding="utf-8")
+            stack = getattr(_local, "stack", None)
+            event = {"ts": round(start, 6), "span": name, "seconds": round(seconds, 6), "rows": rows,
+                     "peak_rss": peak, "pid": os.getpid(), "thread": threading.current_thread().name,
+                     "parent": stack[-1] if stack else None}
+            event.update(attrs)
+            _trace_file.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+            _trace_file.flush()
+
+class Span:
+    """An open span; update rows (or call add_rows) and attributes (set) before it closes."""
+    __slots__ = ("name", "rows", "attrs", "_start", "_wall")
+
+    def __init__(self, name: str, rows: int = 0, attrs: Optional[dict] = None):
+        self.name = name
+        self.rows = rows
+        self.attrs = attrs or {}
+
+    def add_rows(self, rows: int):
+        self.rows += rows
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> 'Span':
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self.name)
+        self._wall = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._start
+        stack = _local.stack
+        # Generator stages can close out of order; drop this span wherever it sits
+        if stack and stack[-1] == self.name:
+            stack.pop()
+        elif self.name in stack:
+            del stack[len(stack) - 1 - stack[::-1].index(self.name)]
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        _emit(self.name, self._wall, seconds, self.rows, self.attrs)
+
+class _NullSpan:
+    """What span() returns when instrumentation is off: accepts everything, records nothing."""
+    __slots__ = ()
+    rows = 0
+
+    def add_rows(self, rows: int):
+        pass
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+def span(name: str, rows: int = 0, **attrs):
+    """Context manager timing a block: with span("training.encode", rows=n): ..."""
+    return Span(name, rows, attrs) if ENABLED else _NULL_SPAN
+
+def record(name: str, seconds: float, rows: int = 0, **attrs):
+    """Records a span measured elsewhere (e.g. the phase timings MotorBusca already takes)."""
+    if ENABLED:
+        _emit(name, time.time() - seconds, seconds, rows, attrs)
+
+def iter_span(name: str, items: Iterable, **attrs) -> Iterable:
+    """
+    Wraps a generator pipeline stage: one span covering the whole iteration, counting the
+    items that come out. Returns items untouched when instrumentation is off.
+    """
+    if not ENABLED:
+        return items
+
+    def wrapped() -> Iterator:
+        with Span(name, 0, attrs) as current:
+            for item in items:
+                current.rows += 1
+                yield item
+    return wrapped()
+
+def traced(name: str):
+    """Decorator version of span()."""
+    def decorator(function):
+        if not ENABLED:
+            return function
+
+        def wrapper(*args, **kwargs):
+            with Span(name):
+                return function(*args, **kwargs)
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        wrapper.__wrapped__ = function
+        return wrapper
+    return decorator
+
+def snapshot() -> Dict[str, dict]:
+    """Aggregates per span name so far."""
+    with _lock:
+        return {name: {"calls": t.calls, "seconds": t.seconds, "max_seconds": t.max_seconds, "rows": t.rows}
+                for name, t in _totals.items()}
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def prometheus_text() -> str:
+    """The aggregates in the Prometheus text exposition format."""
+    totals = snapshot()
+    lines = []
+    for metric, kind, field, help_text in (
+            ("span_seconds_total", "counter", "seconds", "Time spent in each span"),
+            ("span_calls_total", "counter", "calls", "Times each span ran"),
+            ("span_rows_total", "counter", "rows", "Rows processed by each span"),
+            ("span_seconds_max", "gauge", "max_seconds", "Slowest run of each span")):
+        name = f"{METRIC_PREFIX}_{metric}"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for span_name in sorted(totals):
+            lines.append(f'{name}{{span="{_label(span_name)}"}} {totals[span_name][field]:.9g}')
+    name = f"{METRIC_PREFIX}_peak_rss_bytes"
+    lines.append(f"# HELP {name} Peak resident set size of the process")
+    lines.append(f"# TYPE {name} gauge")
+    lines.append(f"{name} {peak_rss_bytes()}")
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_metrics(port: int, host: str = "127.0.0.1") -> Optional[http.server.ThreadingHTTPServer]:
+    """
+    Starts (once) the /metrics endpoint on a daemon thread and returns the server.
+    If the port cannot be bound the failure is logged once and None is returned; it is not retried.
+    """
+    global _server, _server_failed
+    with _lock:
+        if _server is None and not _server_failed:
+            try:
+                _server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                _server_failed = True
+                print(f"instrumentation: metrics endpoint not started on {host}:{port}: {e}", file=sys.stderr)
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    return _server
+
+# Started here, not from the spans: a busy port must never surface inside measured code.
+# Pool workers re-import this module; only the parent process serves the endpoint.
+if METRICS_PORT and multiprocessing.parent_process() is None:
+    try:
+        serve_metrics(int(METRICS_PORT))
+    except ValueError:
+        print(f"instrumentation: ignoring invalid {METRICS_PORT_ENV}={METRICS_PORT!r}", file=sys.stderr)
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of the threads currently inside profile() blocks every interval
+    and counts them in collapsed format ("frame;frame;frame count"), ready for flame graphs.
+    Only registered threads are sampled, so the rest of the process costs nothing.
+    """
+
+    def __init__(self, interval_ms: float = DEFAULT_PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000.0
+        self.samples = collections.Counter()
+        self._targets: Dict[int, str] = {}
+        self._targets_lock = threading.Lock()
+        self._thread = None
+
+    def enter(self, name: str) -> int:
+        thread_id = threading.get_ident()
+        with self._targets_lock:
+            self._targets[thread_id] = name
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampler", daemon=True)
+                self._thread.start()
+        return thread_id
+
+    def leave(self, thread_id: int):
+        with self._targets_lock:
+            self._targets.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._targets_lock:
+                targets = dict(self._targets)
+            if not targets:
+                continue
+            frames = sys._current_frames()
+            for thread_id, name in targets.items():
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if stack:
+                    self.samples[";".join([name] + stack[::-1])] += 1
+
+    def write(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+_profiler = None
+if PROFILE_PATH:
+    _profiler = SamplingProfiler(float(os.environ.get(PROFILE_INTERVAL_ENV) or DEFAULT_PROFILE_INTERVAL_MS))
+
+@contextmanager
+def _profiled(name: str):
+    thread_id = _profiler.enter(name)
+    try:
+        yield
+    finally:
+        _profiler.leave(thread_id)
+
+def profile(name: str):
+    """Marks a hot path for the sampling profiler (TUB_PROFILE); a no-op context otherwise."""
+    return _profiled(name) if _profiler is not None else _NULL_SPAN
+
+@atexit.register
+def _flush():
+    if _profiler is not None and _profiler.samples:
+        _profiler.write(PROFILE_PATH)
+    if METRICS_FILE and ENABLED:
+        with open(METRICS_FILE, "w", encoding="utf-8") as f:
+            f.write(prometheus_text())
+    if _trace_file is not None:
+        _trace_file.close()
+
+if __name__ == "__main__":
+    # python instrumentation.py trace.jsonl    summary of a trace file, slowest spans first
+    per_span = collections.defaultdict(lambda: [0, 0.0, 0, 0])
+    with open(sys.argv[1] if len(sys.argv) > 1 else (TRACE_PATH or "trace.jsonl"), encoding="utf-8") as f:
+        for line in f:
+            event = json.loads(line)
+            entry = per_span[event["span"]]
+            entry[0] += 1
+            entry[1] += event["seconds"]
+            entry[2] += event.get("rows", 0)
+            entry[3] = max(entry[3], event.get("peak_rss", 0))
+    print(f"{'SPAN':<44} {'CALLS':>7} {'SECONDS':>10} {'ROWS':>10} {'PEAK RSS MB':>12}")
+    for name, (calls, seconds, rows, peak) in sorted(per_span.items(), key=lambda item: -item[1][1]):
+        print(f"{name:<44} {calls:>7} {seconds:>10.3f} {rows:>10} {peak / 2 ** 20:>12.1f}")
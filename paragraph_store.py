@@ -0,0 +1,227 @@
+import bisect
+import glob
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from translation_stream import iter_paragraphs
+
+# Layout (little endian):
+#   header   MAGIC, uint32 count, uint32 reserved
+#   keys     count x uint64   packed paper << 32 | section << 16 | paragraph, sorted
+#   offsets  (count + 1) x uint64 into the text blob
+#   formats  count x uint8, padded to 8 bytes
+#   blob     UTF-8 text of every paragraph, in key order
+MAGIC = b"TUBPST01"
+HEADER = struct.Struct("<8sII")
+STORE_EXTENSION = ".pstore"
+
+_REFERENCE = re.compile(r"^\s*(\d+):(\d+)\.(\d+)\s*$")
+_FORMAT_IDENTITY = re.compile(r"^\s*(\d+):(\d+)-(\d+)\s*$")
+
+def pack_key(paper: int, section: int, paragraph: int) -> int:
+    """Packs a paragraph identity into one integer: paper << 32 | section << 16 | paragraph."""
+    return (paper << 32) | (section << 16) | paragraph
+
+def unpack_key(key: int) -> Tuple[int, int, int]:
+    return key >> 32, (key >> 16) & 0xFFFF, key & 0xFFFF
+
+def parse_reference(reference: str) -> int:
+    """Converts a reference such as "146:1.1" (paper:section.paragraph) to its packed key."""
+    match = _REFERENCE.match(reference)
+    if not match:
+        raise ValueError(f"Invalid paragraph reference: {reference!r}")
+    return pack_key(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+
+def format_reference(key: int) -> str:
+    paper, section, paragraph = unpack_key(key)
+    return f"{paper}:{section}.{paragraph}"
+
+def parse_format_identity(identity: str) -> int:
+    """Converts a FormatTable identity such as "0:0-1" (paper:section-paragraph) to its packed key."""
+    match = _FORMAT_IDENTITY.match(identity)
+    if not match:
+        raise ValueError(f"Invalid format identity: {identity!r}")
+    return pack_key(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+
+def format_identity(key: int) -> str:
+    paper, section, paragraph = unpack_key(key)
+    return f"{paper}:{section}-{paragraph}"
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def compile_translation(source_path: str, output_path: Optional[str] = None) -> str:
+    """
+    Compiles a TR*.gz translation into a paragraph store file and returns its path.
+    Rows are ordered by key; paragraphs sharing a key keep their file order.
+    """
+    if output_path is None:
+        output_path = os.path.splitext(source_path)[0] + STORE_EXTENSION
+
+    rows = [(pack_key(r.Paper, r.Section, r.ParagraphNo), r.Format, r.Text.encode("utf-8"))
+            for r in iter_paragraphs(source_path)]
+    rows.sort(key=lambda row: row[0])  # stable
+
+    keys = array("Q", (row[0] for row in rows))
+    formats = bytes(row[1] & 0xFF for row in rows)
+    offsets = array("Q", [0])
+    for row in rows:
+        offsets.append(offsets[-1] + len(row[2]))
+
+    temp_path = f"{output_path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(rows), 0))
+        f.write(_little_endian(keys))
+        f.write(_little_endian(offsets))
+        f.write(formats)
+        f.write(b"\0" * (-len(formats) % 8))
+        for row in rows:
+            f.write(row[2])
+    os.replace(temp_path, output_path)
+    return output_path
+
+def ensure_store(source_path: str) -> str:
+    """Path of the translation's paragraph store, compiling it when missing or older than the source."""
+    store_path = os.path.splitext(source_path)[0] + STORE_EXTENSION
+    if not os.path.exists(store_path) or os.path.getmtime(store_path) < os.path.getmtime(source_path):
+        compile_translation(source_path, store_path)
+    return store_path
+
+class ParagraphStore:
+    """
+    Read-only view over a compiled paragraph store.
+    The file is memory mapped: a lookup is a binary search over the key table plus a slice of the blob.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, _ = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a paragraph store")
+
+        position = HEADER.size
+        keys_end = position + 8 * self.count
+        offsets_end = keys_end + 8 * (self.count + 1)
+        formats_end = offsets_end + self.count
+        self._blob_start = formats_end + (-self.count % 8)
+
+        view = memoryview(self._mmap)
+        if sys.byteorder == "little":
+            self.keys = view[position:keys_end].cast("Q")
+            self.offsets = view[keys_end:offsets_end].cast("Q")
+        else:
+            self.keys = array("Q", bytes(view[position:keys_end]))
+            self.offsets = array("Q", bytes(view[keys_end:offsets_end]))
+            self.keys.byteswap()
+            self.offsets.byteswap()
+        self.formats = view[offsets_end:formats_end]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __enter__(self) -> 'ParagraphStore':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for name in ("keys", "offsets", "formats"):
+            view = self.__dict__.pop(name, None)
+            if isinstance(view, memoryview):
+                view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def find(self, key: int, lo: int = 0) -> int:
+        """Row of the first paragraph with this key, or -1."""
+        row = bisect.bisect_left(self.keys, key, lo)
+        return row if row < self.count and self.keys[row] == key else -1
+
+    def text_at(self, row: int) -> str:
+        start = self._blob_start + self.offsets[row]
+        end = self._blob_start + self.offsets[row + 1]
+        return self._mmap[start:end].decode("utf-8")
+
+    def format_at(self, row: int) -> int:
+        return self.formats[row]
+
+    def get(self, reference) -> Optional[str]:
+        """Text of a paragraph given as "paper:section.paragraph" or packed key; None when absent."""
+        key = parse_reference(reference) if isinstance(reference, str) else reference
+        row = self.find(key)
+        return self.text_at(row) if row >= 0 else None
+
+    def get_many(self, references: Iterable) -> List[Optional[str]]:
+        """
+        Resolves many references in one call, keeping the input order.
+        Keys are looked up in sorted order so each binary search starts where the previous ended.
+        """
+        keys = [parse_reference(r) if isinstance(r, str) else r for r in references]
+        found: Dict[int, Optional[str]] = {}
+        lo = 0
+        for key in sorted(set(keys)):
+            row = bisect.bisect_left(self.keys, key, lo)
+            if row < self.count and self.keys[row] == key:
+                found[key] = self.text_at(row)
+            else:
+                found[key] = None
+            lo = row
+        return [found[key] for key in keys]
+
+def self_check(source_path: str) -> int:
+    """
+    Round trip of the store format: compiles source_path into a scratch file and checks every
+    paragraph of the translation reads back with the same key, text and format, through both
+    the row accessors and get/get_many. Raises ValueError on the first mismatch; returns the count.
+    """
+    rows = sorted(((pack_key(r.Paper, r.Section, r.ParagraphNo), r.Format & 0xFF, r.Text)
+                   for r in iter_paragraphs(source_path)), key=lambda row: row[0])
+    with tempfile.TemporaryDirectory() as work:
+        with ParagraphStore(compile_translation(source_path, os.path.join(work, "check" + STORE_EXTENSION))) as store:
+            if len(store) != len(rows):
+                raise ValueError(f"{source_path}: store has {len(store)} paragraphs, translation {len(rows)}")
+            for row, (key, paragraph_format, text) in enumerate(rows):
+                if (store.keys[row], store.format_at(row), store.text_at(row)) != (key, paragraph_format, text):
+                    raise ValueError(f"{source_path}: row {row} ({format_reference(key)}) does not round trip")
+            # Duplicated keys resolve to their first copy
+            first = {}
+            for key, _, text in rows:
+                first.setdefault(key, text)
+            references = [format_reference(key) for key in first]
+            if store.get_many(references) != list(first.values()):
+                raise ValueError(f"{source_path}: get_many does not match the translation")
+            if any(store.get(reference) != first[parse_reference(reference)] for reference in references[::97]):
+                raise ValueError(f"{source_path}: get does not match the translation")
+            if store.get("9999:0.0") is not None:
+                raise ValueError(f"{source_path}: absent reference resolved")
+    return len(rows)
+
+if __name__ == "__main__":
+    import time
+
+    if sys.argv[1:2] == ["check"]:
+        # python paragraph_store.py check [TRnnn.gz ...]   format round trip self-check
+        for source in sys.argv[2:] or sorted(glob.glob("TR[0-9][0-9][0-9].gz")):
+            print(f"{source}: round trip ok, {self_check(source)} paragraphs")
+        sys.exit(0)
+
+    for source in sys.argv[1:] or sorted(glob.glob("TR[0-9][0-9][0-9].gz")):
+        start_time = time.time()
+        output = compile_translation(source)
+        with ParagraphStore(output) as store:
+            print(f"{source} -> {output}: {len(store)} paragraphs in {time.time() - start_time:.2f}s")
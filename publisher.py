@@ -0,0 +1,142 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional, Sequence
+
+import instrumentation
+from rodam_manifest import (HASH_CACHE_FILENAME, MANIFEST_DELTA_FILENAME, MANIFEST_FILENAME, HashCache,
+                            update_manifest)
+from translation_patch import CONTAINER_EXTENSIONS, encode_containers, read_content
+
+# Publishes translations from their canonical JSON (TRnnn.json, or an existing .gz/.zip) as every
+# distribution format. Each source is read and decompressed once, deflated once (the .gz and the
+# .zip wrap the same stream, see translation_patch.encode_containers) and hashed as it is written;
+# sources are spread over a process pool. The written hashes seed the manifest hash cache, so the
+# manifest update that follows reads none of the published files again.
+#
+# Output is byte-identical for identical content (fixed timestamps, member name and attributes), and
+# an artifact whose bytes did not change is left untouched, keeping its mtime and the clients' caches.
+SOURCE_PATTERN = re.compile(r"^(TR\d{3})\.(json|gz|zip)$", re.IGNORECASE)
+# When several sources share a name, the canonical JSON wins over the containers
+SOURCE_PRIORITY = {".json": 0, ".gz": 1, ".zip": 2}
+WRITE_CHUNK_SIZE = 1024 * 1024
+
+class PublishedFile(NamedTuple):
+    FileName: str
+    Path: str
+    Hash256: str
+    Size: int
+    Changed: bool
+
+def find_sources(source_dir: str) -> List[str]:
+    """One source per translation in source_dir, sorted by name; plain JSON preferred over containers."""
+    chosen = {}
+    for path in sorted(glob.glob(os.path.join(glob.escape(source_dir), "TR*"))):
+        match = SOURCE_PATTERN.match(os.path.basename(path))
+        if not match or not os.path.isfile(path):
+            continue
+        stem, extension = match.group(1).upper(), "." + match.group(2).lower()
+        current = chosen.get(stem)
+        if current is None or SOURCE_PRIORITY[extension] < SOURCE_PRIORITY[os.path.splitext(current)[1].lower()]:
+            chosen[stem] = path
+    return [chosen[stem] for stem in sorted(chosen)]
+
+def _write_hashed(path: str, data: bytes, backup_dir: Optional[str]) -> PublishedFile:
+    """Writes data through a temp file, hashing each chunk as it goes; unchanged files are not rewritten."""
+    name = os.path.basename(path)
+    try:
+        with open(path, "rb") as f:
+            unchanged = os.fstat(f.fileno()).st_size == len(data) and f.read() == data
+    except FileNotFoundError:
+        unchanged = None
+    if unchanged:
+        return PublishedFile(name, path, hashlib.sha256(data).hexdigest(), len(data), False)
+    if unchanged is not None and backup_dir:
+        os.makedirs(backup_dir, exist_ok=True)
+        shutil.copy2(path, os.path.join(backup_dir, name))
+
+    sha = hashlib.sha256()
+    view = memoryview(data)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        for start in range(0, len(data), WRITE_CHUNK_SIZE):
+            chunk = view[start:start + WRITE_CHUNK_SIZE]
+            f.write(chunk)
+            sha.update(chunk)
+    os.replace(temp_path, path)
+    return PublishedFile(name, path, sha.hexdigest(), len(data), True)
+
+def publish_translation(source_path: str, output_dir: str, extensions: Sequence[str] = CONTAINER_EXTENSIONS,
+                        backup_dir: Optional[str] = None, validate: bool = True) -> List[PublishedFile]:
+    """Writes every distribution format of one translation and returns them in extension order."""
+    stem = SOURCE_PATTERN.match(os.path.basename(source_path)).group(1).upper()
+    content = read_content(source_path)
+    if validate:
+        # Catch a broken source before it replaces a good release
+        json.loads(content)
+    encoded = encode_containers(content, extensions)
+    return [_write_hashed(os.path.join(output_dir, stem + extension), encoded[extension.lower()], backup_dir)
+            for extension in extensions]
+
+def _publish_one(args) -> List[PublishedFile]:
+    return publish_translation(*args)
+
+def seed_hash_cache(published: List[PublishedFile], cache_path: str = HASH_CACHE_FILENAME):
+    """Records the hashes computed while writing, so hash_files/update_manifest skip these files."""
+    cache = HashCache(cache_path).load()
+    for item in published:
+        key = os.path.abspath(item.Path)
+        cache.store(key, os.stat(key), item.Hash256)
+    cache.save()
+
+def publish(source_dir: str, output_dir: str = ".", extensions: Sequence[str] = CONTAINER_EXTENSIONS,
+            backup_dir: Optional[str] = None, max_workers: Optional[int] = None,
+            manifest_filename: Optional[str] = MANIFEST_FILENAME,
+            delta_filename: Optional[str] = MANIFEST_DELTA_FILENAME,
+            cache_path: Optional[str] = HASH_CACHE_FILENAME) -> List[PublishedFile]:
+    """
+    Publishes every translation found in source_dir into output_dir, in parallel across files,
+    then updates the manifest of output_dir (skipped when manifest_filename is None).
+    With backup_dir, an artifact about to be replaced by different bytes is copied there first.
+    """
+    sources = find_sources(source_dir)
+    if not sources:
+        print(f"No TRnnn.json/.gz/.zip sources found in {source_dir}")
+        return []
+    os.makedirs(output_dir, exist_ok=True)
+
+    jobs = [(path, output_dir, tuple(extensions), backup_dir) for path in sources]
+    with instrumentation.span("publish.translations", rows=len(jobs)) as span:
+        if len(jobs) > 1 and max_workers != 1:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(_publish_one, jobs))
+        else:
+            results = [_publish_one(job) for job in jobs]
+        published = [item for files in results for item in files]
+        span.set(files=len(published), changed=sum(item.Changed for item in published),
+                 bytes=sum(item.Size for item in published))
+
+    if cache_path:
+        seed_hash_cache(published, cache_path)
+    if manifest_filename:
+        with instrumentation.span("publish.manifest"):
+            update_manifest(output_dir, manifest_filename=manifest_filename, delta_filename=delta_filename,
+                            cache_path=cache_path)
+    return published
+
+if __name__ == "__main__":
+    # python publisher.py SOURCE_DIR [OUTPUT_DIR [BACKUP_DIR]]
+    if len(sys.argv) < 2:
+        print("usage: publisher.py SOURCE_DIR [OUTPUT_DIR [BACKUP_DIR]]")
+        sys.exit(2)
+    published = publish(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else ".",
+                        backup_dir=sys.argv[3] if len(sys.argv) > 3 else None)
+    for item in published:
+        print(f"  {item.FileName:<12} {item.Size:>10} bytes  {item.Hash256[:12]}  "
+              f"{'written' if item.Changed else 'unchanged'}")
+    print(f"{len(published)} artifact(s), {sum(item.Changed for item in published)} written.")
@@ -1,17 +1,36 @@
+import glob
 import hashlib
 import json
+import mmap
 import os
-from dataclasses import dataclass, asdict
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict, field
+from typing import Dict, List, Optional, Tuple
+
+import instrumentation
+
+# Files bigger than this are hashed through mmap, smaller ones with buffered reads
+MMAP_THRESHOLD = 4 * 1024 * 1024
+READ_BUFFER_SIZE = 1024 * 1024
+HASH_CACHE_FILENAME = ".rodam_hash_cache.json"
+MANIFEST_FILENAME = "rodam_manifest.json"
+MANIFEST_DELTA_FILENAME = "rodam_manifest_delta.json"
+PATCH_FIELDS = ("PatchFileName", "PatchBaseHash256", "PatchHash256")
 
 def calculate_sha256(file_path):
     """Calculates the SHA256 checksum of a file."""
     sha256_hash = hashlib.sha256()
     try:
         with open(file_path, "rb") as f:
-            # Read the file in chunks to avoid using too much memory
-            for byte_block in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(byte_block)
+            size = os.fstat(f.fileno()).st_size
+            if size >= MMAP_THRESHOLD:
+                # Let the OS page the file in; hashlib releases the GIL on large updates
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    sha256_hash.update(mapped)
+            else:
+                # Read the file in large chunks to avoid using too much memory
+                for byte_block in iter(lambda: f.read(READ_BUFFER_SIZE), b""):
+                    sha256_hash.update(byte_block)
         return sha256_hash.hexdigest()
     except FileNotFoundError:
         return None
@@ -19,50 +38,303 @@ def calculate_sha256(file_path):
         print(f"Error calculating hash for {file_path}: {e}")
         return None
 
+class HashCache:
+    """
+    Persistent stat cache for file hashes.
+    An entry is reused only while the file keeps the same size, mtime and inode.
+    """
+
+    def __init__(self, cache_path: str = HASH_CACHE_FILENAME):
+        self.cache_path = cache_path
+        self.entries: Dict[str, dict] = {}
+        self.dirty = False
+
+    @staticmethod
+    def _signature(st: os.stat_result) -> dict:
+        return {"Size": st.st_size, "MTimeNs": st.st_mtime_ns, "Inode": st.st_ino}
+
+    def load(self) -> 'HashCache':
+        if os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, "r", encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except Exception as e:
+                print(f"Ignoring unreadable hash cache {self.cache_path}: {e}")
+                self.entries = {}
+        return self
+
+    def save(self):
+        if not self.dirty:
+            return
+        temp_path = f"{self.cache_path}.tmp"
+        try:
+            with open(temp_path, "w", encoding='utf-8') as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            os.replace(temp_path, self.cache_path)
+            self.dirty = False
+        except Exception as e:
+            print(f"Error saving hash cache {self.cache_path}: {e}")
+
+    def lookup(self, path: str, st: os.stat_result) -> Optional[str]:
+        entry = self.entries.get(path)
+        if entry and all(entry.get(k) == v for k, v in self._signature(st).items()):
+            return entry.get("Hash256")
+        return None
+
+    def store(self, path: str, st: os.stat_result, checksum: str):
+        entry = self._signature(st)
+        entry["Hash256"] = checksum
+        self.entries[path] = entry
+        self.dirty = True
+
+@dataclass
+class HashReport:
+    """Result of hash_files: checksum per path plus cache statistics."""
+    hashes: Dict[str, Optional[str]] = field(default_factory=dict)
+    hashed: int = 0
+    cached: int = 0
+    failed: int = 0
+
+def hash_files(paths: List[str], cache_path: Optional[str] = HASH_CACHE_FILENAME,
+               max_workers: Optional[int] = None) -> HashReport:
+    """
+    Hashes several files in parallel across a process pool.
+    Files whose size, mtime and inode match the stat cache are not read again.
+    Pass cache_path=None to disable the persistent cache.
+    """
+    with instrumentation.span("manifest.hash", rows=len(paths)) as span:
+        report = _hash_files(paths, cache_path, max_workers)
+        span.set(hashed=report.hashed, cached=report.cached, failed=report.failed)
+    return report
+
+def _hash_files(paths: List[str], cache_path: Optional[str], max_workers: Optional[int]) -> HashReport:
+    report = HashReport()
+    cache = HashCache(cache_path).load() if cache_path else None
+
+    pending = []
+    for path in paths:
+        key = os.path.abspath(path)
+        try:
+            st = os.stat(key)
+        except OSError:
+            report.hashes[path] = None
+            report.failed += 1
+            continue
+        checksum = cache.lookup(key, st) if cache else None
+        if checksum:
+            report.hashes[path] = checksum
+            report.cached += 1
+        else:
+            pending.append((path, key, st))
+
+    if len(pending) > 1 and max_workers != 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            checksums = list(executor.map(calculate_sha256, [key for _, key, _ in pending]))
+    else:
+        checksums = [calculate_sha256(key) for _, key, _ in pending]
+
+    for (path, key, st), checksum in zip(pending, checksums):
+        report.hashes[path] = checksum
+        if checksum:
+            report.hashed += 1
+            if cache:
+                cache.store(key, st, checksum)
+        else:
+            report.failed += 1
+
+    if cache:
+        cache.save()
+    return report
+
 @dataclass
 class RodamManifestItem:
     FileName: str = ""
     FilePath: str = ""
     Optional: bool = False
     Hash256: str = ""
+    # Optional delta from a previous release (see translation_patch.py); omitted from the JSON when empty
+    PatchFileName: str = ""
+    PatchBaseHash256: str = ""
+    PatchHash256: str = ""
+
+    def key(self) -> Tuple[str, str]:
+        """Identity of the entry, independent of the path separator used when it was written."""
+        return (self.FilePath.replace("\\", "/").strip("/"), self.FileName)
+
+    def to_dict(self) -> dict:
+        """JSON form of the entry; the patch fields appear only when the entry has a patch."""
+        data = asdict(self)
+        if not self.PatchFileName:
+            for name in PATCH_FIELDS:
+                data.pop(name)
+        return data
+
+    def clear_patch(self):
+        self.PatchFileName = self.PatchBaseHash256 = self.PatchHash256 = ""
 
     @staticmethod
-    def save_to_manifest(items: List['RodamManifestItem']):
+    def load_from_manifest(input_filename: str = MANIFEST_FILENAME) -> List['RodamManifestItem']:
+        """Reads rodam_manifest.json back into RodamManifestItem objects (empty list if missing)."""
+        if not os.path.exists(input_filename):
+            return []
+        try:
+            with open(input_filename, "r", encoding='utf-8') as json_file:
+                data = json.load(json_file)
+            known = set(RodamManifestItem.__dataclass_fields__)
+            return [RodamManifestItem(**{k: v for k, v in entry.items() if k in known}) for entry in data]
+        except Exception as e:
+            print(f"Error reading manifest {input_filename}: {e}")
+            return []
+
+    @staticmethod
+    def save_to_manifest(items: List['RodamManifestItem'], output_filename: str = MANIFEST_FILENAME):
         """Serializes a list of RodamManifestItem objects to rodam_manifest.json."""
-        output_filename = "rodam_manifest.json"
         try:
             with open(output_filename, "w", encoding='utf-8') as json_file:
-                json.dump([asdict(item) for item in items], json_file, indent=4)
+                json.dump([item.to_dict() for item in items], json_file, indent=4)
             print(f"Successfully saved manifest to {output_filename}")
         except Exception as e:
             print(f"Error saving manifest to {output_filename}: {e}")
 
-def main():
-    # Files to process
-    items = [
-        RodamManifestItem(FileName="FormatTable.gz", FilePath=""),
-        RodamManifestItem(FileName="TR000.zip", FilePath=""),
-        RodamManifestItem(FileName="TR002.zip", FilePath=""),
-        RodamManifestItem(FileName="tub_modelo_meta.pkl", FilePath=os.path.join("semantic", "model",), Optional=True),
-        RodamManifestItem(FileName="tub_modelo.index", FilePath=os.path.join("semantic", "model"), Optional=True)
-    ]
-    
-    print("Calculating checksums and generating manifest...")
-    
-    for item in items:
-        # Construct full path
-        full_path = os.path.join(os.getcwd(), item.FilePath, item.FileName)
-        
-        checksum = calculate_sha256(full_path)
-        
-        if checksum:
-            print(f"{item.FileName}: {checksum}")
+@dataclass
+class ManifestRule:
+    """Glob rule used to discover manifest entries. The first rule matching a file wins."""
+    Pattern: str
+    FilePath: str = ""
+    Optional: bool = False
+
+# Files shipped to clients. Specific rules come before the generic ones.
+MANIFEST_RULES = [
+    ManifestRule("FormatTable.gz"),
+    ManifestRule("TR000.zip"),
+    ManifestRule("TR002.zip"),
+    ManifestRule("TR[0-9][0-9][0-9].zip", Optional=True),
+    ManifestRule("TR[0-9][0-9][0-9].gz", Optional=True),
+    ManifestRule("tubIndex_[0-9][0-9][0-9].gz", Optional=True),
+] + [
+    # Only what the search client loads; build caches (embeddings, query cache) stay out
+    ManifestRule(f"tub_modelo{suffix}", FilePath=os.path.join("semantic", "model"), Optional=True)
+    for suffix in (".index", "_meta.bin", "_meta.pkl", "_index.json", "_bm25.bin", "_filtros.bin")
+]
+
+@dataclass
+class ManifestDelta:
+    """Entries added, changed and removed by one update_manifest run."""
+    BaseHash256: str = ""
+    Hash256: str = ""
+    Added: List[RodamManifestItem] = field(default_factory=list)
+    Changed: List[RodamManifestItem] = field(default_factory=list)
+    Removed: List[RodamManifestItem] = field(default_factory=list)
+
+    def is_empty(self) -> bool:
+        return not (self.Added or self.Changed or self.Removed)
+
+    def save(self, output_filename: str = MANIFEST_DELTA_FILENAME):
+        """Writes the delta compactly; removed entries carry only their identity."""
+        data = {
+            "BaseHash256": self.BaseHash256,
+            "Hash256": self.Hash256,
+            "Added": [item.to_dict() for item in self.Added],
+            "Changed": [item.to_dict() for item in self.Changed],
+            "Removed": [{"FileName": item.FileName, "FilePath": item.FilePath} for item in self.Removed],
+        }
+        try:
+            with open(output_filename, "w", encoding='utf-8') as json_file:
+                json.dump(data, json_file, separators=(",", ":"))
+            print(f"Successfully saved manifest delta to {output_filename}")
+        except Exception as e:
+            print(f"Error saving manifest delta to {output_filename}: {e}")
+
+def discover_items(root: str, rules: List[ManifestRule] = MANIFEST_RULES) -> List[RodamManifestItem]:
+    """Scans root with the glob rules and returns one (unhashed) item per file found, in rule order."""
+    items = []
+    seen = set()
+    for rule in rules:
+        pattern = os.path.join(glob.escape(os.path.join(root, rule.FilePath)), rule.Pattern)
+        for full_path in sorted(glob.glob(pattern)):
+            if not os.path.isfile(full_path):
+                continue
+            item = RodamManifestItem(FileName=os.path.basename(full_path), FilePath=rule.FilePath,
+                                     Optional=rule.Optional)
+            if item.key() not in seen:
+                seen.add(item.key())
+                items.append(item)
+    return items
+
+def update_manifest(root: str, rules: List[ManifestRule] = MANIFEST_RULES,
+                    manifest_filename: str = MANIFEST_FILENAME,
+                    delta_filename: Optional[str] = MANIFEST_DELTA_FILENAME,
+                    cache_path: Optional[str] = HASH_CACHE_FILENAME) -> ManifestDelta:
+    """
+    Updates the manifest in place: existing entries keep their position and are only
+    touched when their hash or optional flag changed, files found by the rules are
+    appended, and entries whose file disappeared or that no rule matches any more (renamed or
+    retired artifacts) are dropped. An entry whose file exists but cannot be hashed is kept as is.
+    The manifest is rewritten only when something changed. The delta is written too, except that
+    an empty delta never overwrites the previous one (clients still need it to update).
+    """
+    manifest_path = os.path.join(root, manifest_filename)
+    previous = RodamManifestItem.load_from_manifest(manifest_path)
+    with instrumentation.span("manifest.discover") as span:
+        discovered = {item.key(): item for item in discover_items(root, rules)}
+        span.rows = len(discovered)
+
+    delta = ManifestDelta(BaseHash256=calculate_sha256(manifest_path) or "")
+    # The rules decide what is published: entries they no longer find leave the manifest
+    for item in previous:
+        if item.key() not in discovered:
+            if os.path.isfile(os.path.join(root, item.FilePath.replace("\\", os.sep), item.FileName)):
+                print(f"{item.FileName} ({item.FilePath or '.'}) no longer matches a manifest rule; removed.")
+            delta.Removed.append(item)
+    previous = [item for item in previous if item.key() in discovered]
+
+    previous_keys = {item.key() for item in previous}
+    candidates = previous + [item for key, item in discovered.items() if key not in previous_keys]
+    full_paths = [os.path.join(root, item.FilePath.replace("\\", os.sep), item.FileName) for item in candidates]
+    report = hash_files(full_paths, cache_path=cache_path)
+
+    items = []
+    for index, (item, full_path) in enumerate(zip(candidates, full_paths)):
+        checksum = report.hashes.get(full_path)
+        if not checksum:
+            if index < len(previous) and not os.path.isfile(full_path):
+                delta.Removed.append(item)
+                continue
+            print(f"Failed to calculate checksum for {item.FileName} (error at {full_path})")
+            if index < len(previous):
+                # Unreadable right now (permissions, lock, I/O): keep the published entry as it was
+                items.append(item)
+            continue
+        rule_item = discovered.get(item.key())
+        optional = rule_item.Optional if rule_item else item.Optional
+        if index >= len(previous):
             item.Hash256 = checksum
-        else:
-            print(f"Failed to calculate checksum for {item.FileName} (File not found or error at {full_path})")
+            delta.Added.append(item)
+        elif item.Hash256 != checksum or item.Optional != optional:
+            if item.Hash256 != checksum:
+                # A recorded patch produces the previous file, not this one
+                item.clear_patch()
+            item.Hash256 = checksum
+            item.Optional = optional
+            delta.Changed.append(item)
+        items.append(item)
 
-    # Save to Manifest
-    RodamManifestItem.save_to_manifest(items)
+    print(f"Hashed {report.hashed} file(s), {report.cached} from cache, {report.failed} failed.")
+    print(f"Manifest delta: {len(delta.Added)} added, {len(delta.Changed)} changed, {len(delta.Removed)} removed.")
+
+    if not delta.is_empty() or not os.path.exists(manifest_path):
+        RodamManifestItem.save_to_manifest(items, manifest_path)
+    delta.Hash256 = calculate_sha256(manifest_path) or ""
+    if delta_filename:
+        delta_path = os.path.join(root, delta_filename)
+        # An empty delta would replace the last real one that clients still need
+        if not delta.is_empty() or not os.path.exists(delta_path):
+            delta.save(delta_path)
+    return delta
+
+def main():
+    print("Scanning files and updating manifest...")
+    update_manifest(os.getcwd())
 
 if __name__ == "__main__":
     main()
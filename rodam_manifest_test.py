@@ -1,7 +1,17 @@
+import functools
+import hashlib
+import http.server
 import json
 import os
-from dataclasses import dataclass
-from typing import List
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
 
 # 1. Definição da Classe
 @dataclass
@@ -10,6 +20,10 @@ class RodamManifestItem:
     FilePath: str = ""
     Optional: bool = False
     Hash256: str = ""
+    # Patch opcional a partir da versão anterior (ausente no JSON quando não há patch)
+    PatchFileName: str = ""
+    PatchBaseHash256: str = ""
+    PatchHash256: str = ""
 
 def carregar_manifesto_local() -> List[RodamManifestItem]:
     """
@@ -30,7 +44,9 @@ def carregar_manifesto_local() -> List[RodamManifestItem]:
             
             # Converte a lista de dicionários para lista de objetos usando List Comprehension
             # O **item desempacota as chaves do json para os argumentos da classe
-            lista_itens = [RodamManifestItem(**item) for item in data]
+            # Campos desconhecidos (de versões mais novas do manifesto) são ignorados
+            campos = set(RodamManifestItem.__dataclass_fields__)
+            lista_itens = [RodamManifestItem(**{k: v for k, v in item.items() if k in campos}) for item in data]
             
             return lista_itens
 
@@ -41,6 +57,234 @@ def carregar_manifesto_local() -> List[RodamManifestItem]:
         print(f"ERRO inesperado: {e}")
         return []
 
+# 2. Verificação da instalação local contra o manifesto
+NOME_CACHE_VERIFICACAO = ".rodam_verificado.json"
+TAMANHO_BUFFER = 1024 * 1024
+# Segundos sem resposta do servidor (conexão ou leitura) antes de desistir do arquivo
+TEMPO_LIMITE_HTTP = 30
+# Intervalo mínimo entre gravações do cache durante a verificação (permite retomar se interrompida)
+INTERVALO_GRAVACAO_CACHE = 1.0
+
+def calcular_sha256(caminho: str) -> Optional[str]:
+    """Calcula o SHA256 de um arquivo local (None se não existir)."""
+    sha = hashlib.sha256()
+    try:
+        with open(caminho, "rb") as f:
+            for bloco in iter(lambda: f.read(TAMANHO_BUFFER), b""):
+                sha.update(bloco)
+        return sha.hexdigest()
+    except FileNotFoundError:
+        return None
+
+def calcular_sha256_url(url: str) -> Optional[str]:
+    """Calcula o SHA256 de um arquivo servido por HTTP, lendo em streaming (None se 404)."""
+    sha = hashlib.sha256()
+    try:
+        with urllib.request.urlopen(url, timeout=TEMPO_LIMITE_HTTP) as resposta:
+            for bloco in iter(lambda: resposta.read(TAMANHO_BUFFER), b""):
+                sha.update(bloco)
+        return sha.hexdigest()
+    except urllib.error.HTTPError as e:
+        if e.code == 404:
+            return None
+        raise
+
+class CacheVerificacao:
+    """
+    Estado de verificação persistido entre execuções.
+    Cada arquivo já verificado guarda tamanho, mtime, inode e o hash conferido;
+    enquanto esses dados não mudarem o arquivo não é lido de novo.
+    """
+
+    def __init__(self, caminho: str = NOME_CACHE_VERIFICACAO):
+        self.caminho = caminho
+        self.entradas: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._ultima_gravacao = 0.0
+
+    def carregar(self) -> 'CacheVerificacao':
+        try:
+            with open(self.caminho, "r", encoding="utf-8") as f:
+                self.entradas = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entradas = {}
+        return self
+
+    @staticmethod
+    def _assinatura(st: os.stat_result) -> dict:
+        return {"Size": st.st_size, "MTimeNs": st.st_mtime_ns, "Inode": st.st_ino}
+
+    def ja_verificado(self, chave: str, st: os.stat_result, hash_esperado: str) -> bool:
+        entrada = self.entradas.get(chave)
+        if not entrada or entrada.get("Hash256") != hash_esperado:
+            return False
+        return all(entrada.get(k) == v for k, v in self._assinatura(st).items())
+
+    def registrar(self, chave: str, st: os.stat_result, hash_calculado: str):
+        entrada = self._assinatura(st)
+        entrada["Hash256"] = hash_calculado
+        with self._lock:
+            self.entradas[chave] = entrada
+            # Grava parcialmente: uma verificação interrompida é retomada daqui
+            if time.monotonic() - self._ultima_gravacao >= INTERVALO_GRAVACAO_CACHE:
+                self._gravar()
+
+    def remover(self, chave: str):
+        with self._lock:
+            self.entradas.pop(chave, None)
+
+    def gravar(self):
+        with self._lock:
+            self._gravar()
+
+    def _gravar(self):
+        temporario = f"{self.caminho}.tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(self.entradas, f)
+        os.replace(temporario, self.caminho)
+        self._ultima_gravacao = time.monotonic()
+
+@dataclass
+class ResultadoVerificacao:
+    validos: List[RodamManifestItem] = field(default_factory=list)
+    divergentes: List[RodamManifestItem] = field(default_factory=list)
+    ausentes: List[RodamManifestItem] = field(default_factory=list)
+    # Itens que não puderam ser lidos (erro HTTP além de 404, rede, permissão)
+    falhas: List[RodamManifestItem] = field(default_factory=list)
+    calculados: int = 0
+    do_cache: int = 0
+    tempo: float = 0.0
+
+    def instalacao_ok(self) -> bool:
+        """Instalação válida: nada divergente, nenhuma falha de leitura e nenhum item obrigatório ausente."""
+        return not self.divergentes and not self.falhas and all(item.Optional for item in self.ausentes)
+
+def _caminho_relativo(item: RodamManifestItem) -> str:
+    # O manifesto pode ter sido gerado no Windows ("semantic\\model")
+    partes = [p for p in item.FilePath.replace("\\", "/").split("/") if p]
+    return "/".join(partes + [item.FileName])
+
+def verificar_instalacao(itens: List[RodamManifestItem], diretorio_base: str = ".",
+                         url_base: Optional[str] = None,
+                         caminho_cache: Optional[str] = NOME_CACHE_VERIFICACAO,
+                         max_workers: Optional[int] = None) -> ResultadoVerificacao:
+    """
+    Confere cada item do manifesto contra o Hash256 esperado, em paralelo.
+    Com url_base os arquivos são lidos por HTTP (sem cache); caso contrário do diretório local,
+    usando o cache de verificação para pular arquivos que não mudaram.
+    """
+    inicio = time.time()
+    resultado = ResultadoVerificacao()
+    cache = CacheVerificacao(caminho_cache).carregar() if caminho_cache and not url_base else None
+
+    pendentes: List[Tuple[RodamManifestItem, str, Optional[os.stat_result]]] = []
+    for item in itens:
+        relativo = _caminho_relativo(item)
+        if url_base:
+            pendentes.append((item, urllib.parse.urljoin(url_base.rstrip("/") + "/", relativo), None))
+            continue
+        caminho = os.path.abspath(os.path.join(diretorio_base, *relativo.split("/")))
+        try:
+            st = os.stat(caminho)
+        except OSError:
+            resultado.ausentes.append(item)
+            if cache:
+                cache.remover(caminho)
+            continue
+        if cache and cache.ja_verificado(caminho, st, item.Hash256):
+            resultado.validos.append(item)
+            resultado.do_cache += 1
+        else:
+            pendentes.append((item, caminho, st))
+
+    calcular = calcular_sha256_url if url_base else calcular_sha256
+    if pendentes:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futuros = {executor.submit(calcular, origem): (item, origem, st) for item, origem, st in pendentes}
+            for futuro in as_completed(futuros):
+                item, origem, st = futuros[futuro]
+                try:
+                    hash_calculado = futuro.result()
+                except (urllib.error.URLError, OSError) as e:
+                    # Erro de rede (inclusive tempo esgotado, socket.timeout) ou de permissão:
+                    # o item falha, a verificação continua
+                    print(f"Não foi possível verificar {_caminho_relativo(item)}: {e}")
+                    resultado.falhas.append(item)
+                    if cache:
+                        cache.remover(origem)
+                    continue
+                if hash_calculado is None:
+                    resultado.ausentes.append(item)
+                    continue
+                resultado.calculados += 1
+                if hash_calculado == item.Hash256:
+                    resultado.validos.append(item)
+                    if cache:
+                        cache.registrar(origem, st, hash_calculado)
+                else:
+                    resultado.divergentes.append(item)
+                    if cache:
+                        cache.remover(origem)
+
+    if cache:
+        cache.gravar()
+    resultado.tempo = time.time() - inicio
+    return resultado
+
+def atualizar_por_patch(item: RodamManifestItem, url_base: str, diretorio_base: str = ".") -> bool:
+    """
+    Atualiza um arquivo local aplicando o patch do manifesto em vez de baixar o arquivo inteiro.
+    url_base é o endereço da publicação (o mesmo de verificar_instalacao); o patch é buscado lá.
+    Só é tentado se o arquivo local é exatamente a versão base do patch; o resultado é conferido
+    contra o Hash256 do item. Retorna False quando não há patch aplicável (baixe o arquivo inteiro).
+    """
+    from translation_patch import apply_patch
+
+    if not item.PatchFileName or not url_base:
+        return False
+    relativo = _caminho_relativo(item)
+    caminho = os.path.abspath(os.path.join(diretorio_base, *relativo.split("/")))
+    if calcular_sha256(caminho) != item.PatchBaseHash256:
+        return False
+
+    # O patch fica ao lado do arquivo que ele produz
+    relativo_patch = "/".join(relativo.split("/")[:-1] + [item.PatchFileName])
+    url_patch = urllib.parse.urljoin(url_base.rstrip("/") + "/", relativo_patch)
+    caminho_patch = f"{caminho}.patch.tmp"
+    try:
+        sha = hashlib.sha256()
+        with urllib.request.urlopen(url_patch, timeout=TEMPO_LIMITE_HTTP) as resposta, open(caminho_patch, "wb") as f:
+            for bloco in iter(lambda: resposta.read(TAMANHO_BUFFER), b""):
+                sha.update(bloco)
+                f.write(bloco)
+        if sha.hexdigest() != item.PatchHash256:
+            print(f"Patch corrompido: {url_patch}")
+            return False
+        apply_patch(caminho, caminho_patch, caminho, expected_hash=item.Hash256)
+        return True
+    except (OSError, ValueError, zlib.error) as e:
+        # URLError, timeouts e conexões derrubadas são OSError, assim como disco cheio ao gravar
+        print(f"Não foi possível aplicar o patch de {relativo}: {e}")
+        return False
+    finally:
+        if os.path.exists(caminho_patch):
+            os.remove(caminho_patch)
+
+class _HandlerSilencioso(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def iniciar_servidor_local(diretorio: str = ".", porta: int = 0) -> Tuple[http.server.ThreadingHTTPServer, str]:
+    """
+    Sobe um servidor HTTP local (em thread) servindo os artefatos do diretório.
+    Serve como substituto do servidor de distribuição para testar a verificação por HTTP.
+    Retorna o servidor (chame shutdown() ao terminar) e a URL base.
+    """
+    handler = functools.partial(_HandlerSilencioso, directory=os.path.abspath(diretorio))
+    servidor = http.server.ThreadingHTTPServer(("127.0.0.1", porta), handler)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}/"
+
 # --- Bloco de Execução Principal ---
 if __name__ == "__main__":
     
@@ -56,5 +300,18 @@ if __name__ == "__main__":
         
         for item in resultado:
             print(f"{item.FileName:<25} | {item.Hash256[:12]}... | {item.Optional} ! {item.FilePath}")
+
+        # 3. Verifica a instalação local contra o manifesto
+        verificacao = verificar_instalacao(resultado)
+        print(f"\nVerificação: {len(verificacao.validos)} válidos, {len(verificacao.divergentes)} divergentes, "
+              f"{len(verificacao.ausentes)} ausentes, {len(verificacao.falhas)} com falha "
+              f"({verificacao.calculados} calculados, "
+              f"{verificacao.do_cache} do cache) em {verificacao.tempo:.3f}s")
+        for item in verificacao.divergentes:
+            print(f"  DIVERGENTE: {_caminho_relativo(item)}")
+        for item in verificacao.falhas:
+            print(f"  FALHA: {_caminho_relativo(item)}")
+        for item in verificacao.ausentes:
+            print(f"  AUSENTE{' (opcional)' if item.Optional else ''}: {_caminho_relativo(item)}")
     else:
         print("\nNenhum item processado. Verifique se o arquivo 'rodam_manifest.json' existe.")
@@ -0,0 +1,13 @@
+"""
+Põe a raiz do repositório no sys.path, para os scripts desta pasta importarem
+instrumentation, rodam_manifest, translation_stream, paragraph_store...
+
+Importado antes desses módulos: `import _raiz` ou `from _raiz import RAIZ`.
+"""
+import os
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
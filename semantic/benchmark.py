@@ -0,0 +1,306 @@
+"""
+Benchmark offline e reproduzível de todo o pipeline de conteúdo.
+
+Roda sobre os dados do repositório, sem rede e sem o SentenceTransformer (os embeddings vêm
+do codificador determinístico de motor_embeddings), e grava um JSON com as métricas de cada
+estágio: hash do manifesto, descompressão/parsing das traduções, os estágios CSV antigos
+(indexa -> limpar_csv -> filtrar_tub_index) e o pipeline_indice, throughput de embeddings,
+construção dos índices FAISS, latência de consulta (p50/p99) e recall@k contra o Flat.
+
+O modo comparar confronta dois JSON e aponta regressões. A direção de cada métrica vem do nome:
+    *_s, *_ms         menor é melhor (tempos)
+    *_por_s, recall   maior é melhor (throughput, qualidade)
+    demais            informativas (contagens), só exibidas
+Cada tempo é a mediana de --repeticoes execuções.
+
+Uso:
+    python benchmark.py executar --saida base.json [--repeticoes 3] [--limite 20000]
+    python benchmark.py comparar base.json atual.json [--tolerancia 0.10]
+"""
+import argparse
+import contextlib
+import csv
+import gzip
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from _raiz import RAIZ
+import filtrar_tub_index
+import indexa
+import limpar_csv
+import pipeline_indice
+from motor_embeddings import MODELO_DETERMINISTICO, MotorEmbeddings
+from servico_busca import percentis
+from rodam_manifest import MANIFEST_FILENAME, RodamManifestItem, calculate_sha256
+from translation_stream import iter_paragraphs, open_translation
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+VERSAO_FORMATO = 1
+TRADUCOES_PADRAO = ("TR000.gz", "TR044.gz")
+INDICES_PADRAO = (("Flat", {}), ("IVF256,Flat", {"nprobe": 16}), ("HNSW32", {"efSearch": 64}))
+TOP_K = 10
+N_CONSULTAS = 200
+SEMENTE = 42
+TOLERANCIA = 0.10
+TOLERANCIA_RECALL = 0.01
+# Tempos que mudam menos que isto (em segundos) nunca contam como regressão: é ruído de medição
+DIFERENCA_MINIMA_S = 0.002
+
+def medir(funcao, repeticoes):
+    """Executa funcao repeticoes vezes; devolve (último resultado, mediana dos tempos em segundos)."""
+    tempos = []
+    resultado = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return resultado, statistics.median(tempos)
+
+@contextlib.contextmanager
+def _silencioso():
+    # Os scripts antigos imprimem o progresso; no benchmark isso só atrapalha
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+# --- Estágios: cada um devolve um dicionário de métricas ---
+
+def estagio_hash_manifesto(repeticoes):
+    itens = RodamManifestItem.load_from_manifest(os.path.join(RAIZ, MANIFEST_FILENAME))
+    caminhos = [os.path.join(RAIZ, item.FilePath.replace("\\", os.sep), item.FileName) for item in itens]
+    caminhos = [c for c in caminhos if os.path.isfile(c)]
+    total = sum(os.path.getsize(c) for c in caminhos)
+    _, tempo = medir(lambda: [calculate_sha256(c) for c in caminhos], repeticoes)
+    return {"arquivos": len(caminhos), "bytes": total, "tempo_s": tempo,
+            "mb_por_s": total / 1e6 / tempo if tempo > 0 else 0.0}
+
+def estagio_traducoes(repeticoes, traducoes=TRADUCOES_PADRAO):
+    metricas = {}
+    for nome in traducoes:
+        caminho = os.path.join(RAIZ, nome)
+        if not os.path.exists(caminho):
+            continue
+
+        def descomprimir():
+            with open_translation(caminho) as f:
+                return f.read()
+
+        conteudo, tempo_descompressao = medir(descomprimir, repeticoes)
+        _, tempo_json = medir(lambda: json.loads(conteudo), repeticoes)
+        paragrafos, tempo_streaming = medir(lambda: sum(1 for _ in iter_paragraphs(caminho)), repeticoes)
+        metricas[os.path.splitext(nome)[0]] = {
+            "bytes_json": len(conteudo), "paragrafos": paragrafos,
+            "descompressao_s": tempo_descompressao, "json_s": tempo_json, "streaming_s": tempo_streaming,
+            "mb_por_s": len(conteudo) / 1e6 / tempo_descompressao if tempo_descompressao > 0 else 0.0,
+        }
+    return metricas
+
+def estagio_csv(repeticoes, pasta_trabalho):
+    """Os três scripts CSV encadeados por arquivos e o pipeline_indice equivalente em streaming."""
+    caminho_json = os.path.join(pasta_trabalho, "tubIndex_000.json")
+    with gzip.open(os.path.join(RAIZ, "tubIndex_000.gz"), "rb") as origem, open(caminho_json, "wb") as destino:
+        shutil.copyfileobj(origem, destino)
+    terminacoes = os.path.join(PASTA, pipeline_indice.ARQUIVO_TERMINACOES)
+    bruto = os.path.join(pasta_trabalho, "tub_index.csv")
+    limpo = os.path.join(pasta_trabalho, "tub_index_limpo.csv")
+    final = os.path.join(pasta_trabalho, "tub_index_com_links.csv")
+
+    def limpar():
+        # limpar_csv trabalha com os nomes de arquivo globais do módulo
+        limpar_csv.arquivo_entrada, limpar_csv.arquivo_saida = bruto, limpo
+        limpar_csv.processar_csv()
+
+    with _silencioso():
+        _, tempo_indexa = medir(lambda: indexa.generate_csv_from_json(caminho_json, bruto, terminacoes), repeticoes)
+        _, tempo_limpar = medir(limpar, repeticoes)
+        _, tempo_filtrar = medir(lambda: filtrar_tub_index.filtrar_csv(limpo, final), repeticoes)
+        registros, tempo_pipeline = medir(
+            lambda: list(pipeline_indice.executar_pipeline(
+                os.path.join(RAIZ, "tubIndex_000.gz"), pipeline_indice.estagios_padrao(terminacoes))),
+            repeticoes)
+    with open(final, encoding="utf-8", newline="") as f:
+        linhas = sum(1 for _ in csv.DictReader(f))
+    metricas = {"linhas": linhas, "linhas_pipeline": len(registros), "indexa_s": tempo_indexa,
+                "limpar_csv_s": tempo_limpar, "filtrar_s": tempo_filtrar,
+                "scripts_s": tempo_indexa + tempo_limpar + tempo_filtrar, "pipeline_s": tempo_pipeline}
+    return metricas, [assunto for assunto, _ in registros]
+
+def estagio_embeddings(repeticoes, assuntos):
+    motor = MotorEmbeddings(MODELO_DETERMINISTICO, processos=1)
+    vetores, tempo = medir(lambda: motor.codificar(assuntos), repeticoes)
+    vetores /= np.maximum(np.linalg.norm(vetores, axis=1, keepdims=True), 1e-12)
+    return {"sentencas": len(assuntos), "dimensao": int(vetores.shape[1]), "tempo_s": tempo,
+            "sentencas_por_s": len(assuntos) / tempo if tempo > 0 else 0.0}, vetores
+
+def consultas_amostra(assuntos, n=N_CONSULTAS, semente=SEMENTE):
+    """Consultas determinísticas: as três primeiras palavras de assuntos sorteados com semente fixa."""
+    rng = np.random.default_rng(semente)
+    escolhidos = rng.choice(len(assuntos), size=min(n, len(assuntos)), replace=False)
+    return [" ".join(assuntos[i].split()[:3]) for i in sorted(escolhidos)]
+
+def estagio_faiss(repeticoes, vetores, consultas, indices=INDICES_PADRAO, k=TOP_K):
+    """Construção, latência por consulta (codificação + busca) e recall@k de cada índice contra o Flat."""
+    import faiss
+    from config_indice import aplicar_parametros_busca
+
+    faiss.omp_set_num_threads(1)
+    codificador = MotorEmbeddings(MODELO_DETERMINISTICO, processos=1)
+    vetores_consulta = codificador.codificar(consultas)
+    faiss.normalize_L2(vetores_consulta)
+
+    def construir(index_spec, parametros):
+        index = faiss.index_factory(vetores.shape[1], index_spec, faiss.METRIC_INNER_PRODUCT)
+        if not index.is_trained:
+            index.train(vetores)
+        index.add(vetores)
+        aplicar_parametros_busca(index, parametros)
+        return index
+
+    metricas = {}
+    esperado = None
+    for index_spec, parametros in indices:
+        index, tempo_construcao = medir(lambda: construir(index_spec, parametros), repeticoes)
+        latencias = []
+        for consulta in consultas:
+            inicio = time.perf_counter()
+            vetor = codificador.codificar([consulta])
+            faiss.normalize_L2(vetor)
+            index.search(vetor, k)
+            latencias.append((time.perf_counter() - inicio) * 1000)
+        _, obtido = index.search(vetores_consulta, k)
+        if esperado is None:
+            # O primeiro índice (Flat) é a referência exata
+            esperado = obtido
+        acertos = sum(len(set(e) & set(o)) for e, o in zip(esperado.tolist(), obtido.tolist()))
+        p = percentis(latencias, (50, 99))
+        metricas[index_spec] = {"parametros_busca": parametros, "construcao_s": tempo_construcao,
+                                "latencia_p50_ms": p["p50"], "latencia_p99_ms": p["p99"],
+                                "recall": acertos / (k * len(consultas))}
+    return metricas
+
+def executar(repeticoes=3, limite=None, traducoes=TRADUCOES_PADRAO):
+    """Roda todos os estágios e devolve o relatório (dicionário serializável em JSON)."""
+    import faiss
+
+    resultados = {}
+    inicio = time.perf_counter()
+    resultados["hash_manifesto"] = estagio_hash_manifesto(repeticoes)
+    resultados["traducoes"] = estagio_traducoes(repeticoes, traducoes)
+    with tempfile.TemporaryDirectory() as pasta_trabalho:
+        resultados["csv"], assuntos = estagio_csv(repeticoes, pasta_trabalho)
+    if limite:
+        assuntos = assuntos[:limite]
+    resultados["embeddings"], vetores = estagio_embeddings(repeticoes, assuntos)
+    resultados["faiss"] = estagio_faiss(repeticoes, vetores, consultas_amostra(assuntos))
+    return {
+        "versao": VERSAO_FORMATO,
+        "ambiente": {"python": platform.python_version(), "plataforma": platform.platform(),
+                     "processador": platform.processor() or platform.machine(), "nucleos": os.cpu_count(),
+                     "numpy": np.__version__, "faiss": getattr(faiss, "__version__", "")},
+        "parametros": {"repeticoes": repeticoes, "limite": limite, "traducoes": list(traducoes),
+                       "top_k": TOP_K, "consultas": N_CONSULTAS, "semente": SEMENTE,
+                       "modelo": MODELO_DETERMINISTICO},
+        "resultados": resultados,
+        "tempo_total_s": time.perf_counter() - inicio,
+    }
+
+# --- Comparação ---
+
+def _achatar(dados, prefixo=""):
+    """{'faiss': {'Flat': {'recall': 1.0}}} -> {'faiss/Flat/recall': 1.0}, só valores numéricos."""
+    saida = {}
+    for chave, valor in dados.items():
+        caminho = f"{prefixo}/{chave}" if prefixo else chave
+        if isinstance(valor, dict):
+            saida.update(_achatar(valor, caminho))
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            saida[caminho] = valor
+    return saida
+
+def direcao(metrica):
+    """-1: menor é melhor, 1: maior é melhor, 0: informativa."""
+    nome = metrica.rsplit("/", 1)[-1]
+    if nome.endswith("_por_s") or nome == "recall":
+        return 1
+    if nome.endswith("_s") or nome.endswith("_ms"):
+        return -1
+    return 0
+
+def comparar(base, atual, tolerancia=TOLERANCIA, tolerancia_recall=TOLERANCIA_RECALL):
+    """
+    Lista de (métrica, base, atual, variação relativa, regressão) para as métricas dos dois relatórios.
+    Tempos e throughput regridem quando pioram mais que tolerancia (relativa); recall quando cai
+    mais que tolerancia_recall (absoluta). Diferenças de tempo abaixo de DIFERENCA_MINIMA_S são ignoradas.
+    """
+    anteriores = _achatar(base.get("resultados", {}))
+    novos = _achatar(atual.get("resultados", {}))
+    linhas = []
+    for metrica in sorted(anteriores.keys() & novos.keys()):
+        antes, depois = anteriores[metrica], novos[metrica]
+        variacao = (depois - antes) / antes if antes else 0.0
+        sentido = direcao(metrica)
+        if metrica.endswith("recall"):
+            regressao = antes - depois > tolerancia_recall
+        else:
+            regressao = sentido != 0 and -sentido * variacao > tolerancia
+            if metrica.endswith("_s") and not metrica.endswith("_por_s"):
+                regressao = regressao and abs(depois - antes) >= DIFERENCA_MINIMA_S
+            elif metrica.endswith("_ms"):
+                regressao = regressao and abs(depois - antes) >= DIFERENCA_MINIMA_S * 1000
+        linhas.append((metrica, antes, depois, variacao, regressao))
+    return linhas
+
+def imprimir_comparacao(base, atual, linhas):
+    for secao in ("ambiente", "parametros"):
+        if base.get(secao) != atual.get(secao):
+            print(f"Aviso: '{secao}' difere entre as execuções; a comparação pode não ser justa.")
+    print(f"{'MÉTRICA':<44} | {'BASE':>12} | {'ATUAL':>12} | {'VARIAÇÃO':>9}")
+    print("-" * 86)
+    for metrica, antes, depois, variacao, regressao in linhas:
+        marca = "  REGRESSÃO" if regressao else ""
+        print(f"{metrica:<44} | {antes:>12.4g} | {depois:>12.4g} | {variacao:>+8.1%}{marca}")
+    total = sum(1 for linha in linhas if linha[4])
+    print(f"\n{total} regressão(ões) em {len(linhas)} métricas.")
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline do pipeline de conteúdo")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_executar = sub.add_parser("executar", help="roda o benchmark e grava o JSON")
+    p_executar.add_argument("--saida", default="benchmark.json")
+    p_executar.add_argument("--repeticoes", type=int, default=3)
+    p_executar.add_argument("--limite", type=int, default=None, help="máximo de assuntos nos estágios de embeddings/FAISS")
+    p_executar.add_argument("--traducoes", nargs="*", default=list(TRADUCOES_PADRAO))
+
+    p_comparar = sub.add_parser("comparar", help="compara dois JSON; sai com código 1 se houver regressão")
+    p_comparar.add_argument("base")
+    p_comparar.add_argument("atual")
+    p_comparar.add_argument("--tolerancia", type=float, default=TOLERANCIA)
+    p_comparar.add_argument("--tolerancia-recall", type=float, default=TOLERANCIA_RECALL)
+
+    args = parser.parse_args()
+    if args.comando == "executar":
+        relatorio = executar(args.repeticoes, args.limite, args.traducoes)
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(relatorio, f, indent=2, ensure_ascii=False)
+        print(json.dumps(relatorio["resultados"], indent=2, ensure_ascii=False))
+        print(f"Relatório gravado em {args.saida} ({relatorio['tempo_total_s']:.1f}s)")
+    else:
+        with open(args.base, encoding="utf-8") as f:
+            base = json.load(f)
+        with open(args.atual, encoding="utf-8") as f:
+            atual = json.load(f)
+        linhas = comparar(base, atual, args.tolerancia, args.tolerancia_recall)
+        sys.exit(1 if imprimir_comparacao(base, atual, linhas) else 0)
+
+if __name__ == "__main__":
+    main()
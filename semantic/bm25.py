@@ -0,0 +1,172 @@
+"""
+Índice invertido com pontuação BM25 sobre a coluna 'assunto' ({prefixo}_bm25.bin).
+
+Gerado pelo treinamento a partir dos mesmos metadados do índice FAISS: o documento i é a
+posição i dos metadados (= id do vetor), então os resultados das duas buscas podem ser
+fundidos diretamente. Posições removidas (None) não entram no índice.
+
+Layout (little endian):
+    cabeçalho   MAGIC, uint32 documentos, uint32 termos, uint32 total de postings, float32 tamanho médio
+    offsets     (termos + 1) x uint32: início das postings de cada termo
+    documentos  total x uint32 (ordenados dentro de cada termo)
+    frequencias total x uint16, alinhado a 4 bytes
+    tamanhos    documentos x uint16 (termos de cada documento), alinhado a 4 bytes
+    termos      UTF-8 dos termos em ordem, separados por '\\n'
+"""
+import os
+import re
+import struct
+from collections import defaultdict
+
+import numpy as np
+
+MAGIC = b"TUBBM251"
+CABECALHO = struct.Struct("<8sIIIf")
+
+# Parâmetros clássicos do BM25
+K1 = 1.2
+B = 0.75
+
+_PALAVRA = re.compile(r"\w+")
+
+def caminho_bm25(model_prefix):
+    return f"{model_prefix}_bm25.bin"
+
+def tokenizar(texto):
+    return _PALAVRA.findall(texto.lower())
+
+def _serializar_bm25(metadata):
+    """Constrói o índice invertido a partir da lista de (assunto, links), já no formato binário."""
+    postings = defaultdict(list)
+    tamanhos = np.zeros(len(metadata), dtype="<u2")
+    for doc, item in enumerate(metadata):
+        if item is None:
+            continue
+        tokens = tokenizar(item[0])
+        tamanhos[doc] = min(len(tokens), 0xFFFF)
+        contagem = defaultdict(int)
+        for token in tokens:
+            contagem[token] += 1
+        for token, frequencia in contagem.items():
+            postings[token].append((doc, min(frequencia, 0xFFFF)))
+
+    termos = sorted(postings)
+    offsets = np.zeros(len(termos) + 1, dtype="<u4")
+    offsets[1:] = np.cumsum([len(postings[t]) for t in termos])
+    total = int(offsets[-1])
+    documentos = np.fromiter((d for t in termos for d, _ in postings[t]), dtype="<u4", count=total)
+    frequencias = np.fromiter((f for t in termos for _, f in postings[t]), dtype="<u2", count=total)
+    vivos = np.count_nonzero(tamanhos)
+    medio = float(tamanhos.sum()) / vivos if vivos else 0.0
+
+    return b"".join((
+        CABECALHO.pack(MAGIC, len(metadata), len(termos), total, medio),
+        offsets.tobytes(),
+        documentos.tobytes(),
+        frequencias.tobytes(),
+        b"\0" * (-total * 2 % 4),
+        tamanhos.tobytes(),
+        b"\0" * (-len(metadata) * 2 % 4),
+        "\n".join(termos).encode("utf-8"),
+    ))
+
+def salvar_bm25(caminho, metadata):
+    """Constrói o índice invertido a partir da lista de (assunto, links) e grava no formato binário."""
+    temporario = f"{caminho}.tmp"
+    with open(temporario, "wb") as f:
+        f.write(_serializar_bm25(metadata))
+    os.replace(temporario, caminho)
+
+class IndiceBM25:
+    """Leitura por mmap do _bm25.bin; buscar() devolve os documentos mais bem pontuados."""
+
+    def __init__(self, caminho, dados=None):
+        """
+        :param caminho: arquivo _bm25.bin (lido por mmap)
+        :param dados: bytes no mesmo formato, já em memória; quando passados o arquivo não é lido
+        """
+        self.caminho = caminho
+        if dados is None:
+            self._mmap = np.memmap(caminho, dtype=np.uint8, mode="r")
+        else:
+            self._mmap = np.frombuffer(dados, dtype=np.uint8)
+        magic, self.documentos, n_termos, total, self.tamanho_medio = CABECALHO.unpack(
+            bytes(self._mmap[:CABECALHO.size]))
+        if magic != MAGIC:
+            raise ValueError(f"{caminho} não é um índice BM25")
+        pos = CABECALHO.size
+        self.offsets = self._mmap[pos:pos + 4 * (n_termos + 1)].view("<u4")
+        pos += 4 * (n_termos + 1)
+        self.docs = self._mmap[pos:pos + 4 * total].view("<u4")
+        pos += 4 * total
+        self.frequencias = self._mmap[pos:pos + 2 * total].view("<u2")
+        pos += 2 * total + (-total * 2 % 4)
+        self.tamanhos = self._mmap[pos:pos + 2 * self.documentos].view("<u2")
+        pos += 2 * self.documentos + (-self.documentos * 2 % 4)
+        termos = bytes(self._mmap[pos:]).decode("utf-8").split("\n") if n_termos else []
+        self.termos = {t: i for i, t in enumerate(termos)}
+        self.vivos = int(np.count_nonzero(self.tamanhos))
+        # Parte do denominador que depende só do documento, calculada uma vez
+        media = self.tamanho_medio or 1.0
+        self._normalizacao = (K1 * (1 - B + B * self.tamanhos.astype(np.float32) / media)).astype(np.float32)
+
+    def __len__(self):
+        return self.documentos
+
+    def pontuar(self, consulta):
+        """Vetor (documentos,) com a pontuação BM25 de cada documento para a consulta."""
+        pontuacao = np.zeros(self.documentos, dtype=np.float32)
+        for token in set(tokenizar(consulta)):
+            t = self.termos.get(token)
+            if t is None:
+                continue
+            inicio, fim = int(self.offsets[t]), int(self.offsets[t + 1])
+            docs = self.docs[inicio:fim]
+            tf = self.frequencias[inicio:fim].astype(np.float32)
+            df = fim - inicio
+            idf = np.log(1.0 + (self.vivos - df + 0.5) / (df + 0.5))
+            # Cada documento aparece uma vez por termo, então a soma com índice é segura
+            pontuacao[docs] += idf * tf * (K1 + 1) / (tf + self._normalizacao[docs])
+        return pontuacao
+
+    def buscar(self, consulta, top_k=5, permitidos=None):
+        """
+        Lista de (documento, pontuação) em ordem decrescente; só documentos com algum termo.
+        :param permitidos: vetor booleano (documentos,) que restringe o resultado (ver filtros.py)
+        """
+        pontuacao = self.pontuar(consulta)
+        if permitidos is not None:
+            pontuacao[~permitidos] = 0.0
+        candidatos = np.flatnonzero(pontuacao)
+        if len(candidatos) > top_k:
+            candidatos = candidatos[np.argpartition(-pontuacao[candidatos], top_k - 1)[:top_k]]
+        # Empate desfeito pela posição, para o resultado ser estável
+        ordem = np.lexsort((candidatos, -pontuacao[candidatos]))
+        return [(int(candidatos[i]), float(pontuacao[candidatos[i]])) for i in ordem]
+
+    def fechar(self):
+        self._mmap = None
+
+def carregar_bm25(model_prefix, metadata=None):
+    """
+    Índice BM25 do modelo. Se o _bm25.bin não existe (modelo treinado antes dele) e os
+    metadados foram passados, o índice é construído só em memória: o diretório do modelo
+    pode ser somente leitura e o arquivo é responsabilidade do treinamento.
+    """
+    caminho = caminho_bm25(model_prefix)
+    if not os.path.exists(caminho):
+        if metadata is None:
+            return None
+        return IndiceBM25(caminho, dados=_serializar_bm25(list(metadata)))
+    return IndiceBM25(caminho)
+
+def fundir_rrf(listas, k=60):
+    """
+    Reciprocal rank fusion: cada lista é uma sequência de documentos em ordem de relevância.
+    Devolve [(documento, pontuação)] ordenado pela soma de 1 / (k + posição).
+    """
+    pontuacao = defaultdict(float)
+    for lista in listas:
+        for posicao, doc in enumerate(lista, start=1):
+            pontuacao[doc] += 1.0 / (k + posicao)
+    return sorted(pontuacao.items(), key=lambda item: (-item[1], item[0]))
@@ -1,87 +1,387 @@
-import faiss
-import pickle
+import numpy as np
 import os
 import sys
+import threading
 import time
-from sentence_transformers import SentenceTransformer
+from concurrent.futures import ThreadPoolExecutor
+
+from bm25 import carregar_bm25, fundir_rrf
+from config_indice import aplicar_parametros_busca, carregar_config
+from filtros import carregar_filtros, chave_filtro, interpretar_filtro, preparar_indice
+from metadados import caminho_bin, caminho_pkl, carregar_metadados
+
+import _raiz  # noqa: F401
+import instrumentation
 
 # Caminho para o modelo treinado (mesmo prefixo usado no treinamento)
 MODEL_PREFIX = os.path.join("dados_modelo", "tub_modelo")
+MODEL_NAME = 'all-MiniLM-L6-v2'
+
+# Modos de busca: só FAISS, BM25 fundido com FAISS (RRF) ou só BM25 (sem carregar o modelo)
+MODO_SEMANTICO = "semantico"
+MODO_HIBRIDO = "hibrido"
+MODO_LEXICO = "lexico"
+MODOS = (MODO_SEMANTICO, MODO_HIBRIDO, MODO_LEXICO)
+# Quantos candidatos de cada lista entram na fusão do modo híbrido
+CANDIDATOS_HIBRIDO = 50
+
+# faiss e sentence_transformers são importados sob demanda: só o import do
+# sentence_transformers (torch) custa alguns segundos e nem toda busca precisa dele.
+faiss = None
+
+def _faiss():
+    global faiss
+    if faiss is None:
+        import faiss as modulo
+        faiss = modulo
+    return faiss
 
 class MotorBusca:
-    def __init__(self, model_prefix):
+    def __init__(self, model_prefix, cache=None, modo=MODO_SEMANTICO):
+        """
+        :param model_prefix: caminho base sem extensão (ex: 'dados_modelo/tub_modelo')
+        :param cache: CacheBusca opcional (ver cache_busca.py) para embeddings e resultados
+        :param modo: MODO_SEMANTICO, MODO_HIBRIDO ou MODO_LEXICO (este nunca carrega o modelo)
+        """
+        if modo not in MODOS:
+            raise ValueError(f"modo de busca desconhecido: {modo}")
+        self.model_prefix = model_prefix
+        self.modo = modo
         self.index_path = f"{model_prefix}.index"
-        self.meta_path = f"{model_prefix}_meta.pkl"
-        self.model = None
-        self.index = None
-        self.metadata = None
-
-    def carregar(self):
-        """Carrega os arquivos do modelo e inicializa a IA."""
-        if not os.path.exists(self.index_path) or not os.path.exists(self.meta_path):
-            print(f"Erro Crítico: Arquivos do modelo não encontrados em '{MODEL_PREFIX}'.")
-            print("Certifique-se de executar o script 'treinar_modelo.py' primeiro.")
-            return False
+        # Preferência pelo formato binário (mmap); o pickle fica como alternativa legada
+        self.meta_path = caminho_bin(model_prefix)
+        if not os.path.exists(self.meta_path):
+            self.meta_path = caminho_pkl(model_prefix)
+        self.cache = cache
+        self.perfil = {}
+        self.shards = {}
+        self._valores = {"model": None, "index": None, "metadata": None, "bm25": None}
+        self._futuros = {}
+        self._executor = None
+        self._inicio = None
+        self._filtros = None
+        self._trava_filtros = threading.Lock()
+
+    # model, index e metadata são carregados em threads; o acesso espera só pelo que precisa
+    def _obter(self, nome):
+        futuro = self._futuros.get(nome)
+        if futuro is not None:
+            futuro.result()
+        return self._valores[nome]
+
+    model = property(lambda self: self._obter("model"), lambda self, v: self._valores.__setitem__("model", v))
+    index = property(lambda self: self._obter("index"), lambda self, v: self._valores.__setitem__("index", v))
+    metadata = property(lambda self: self._obter("metadata"),
+                        lambda self, v: self._valores.__setitem__("metadata", v))
+    bm25 = property(lambda self: self._obter("bm25"), lambda self, v: self._valores.__setitem__("bm25", v))
 
-        print("--> Carregando Inteligência Artificial (SentenceTransformer)...")
+    def _medir(self, fase, funcao, *args):
+        inicio = time.perf_counter()
+        resultado = funcao(*args)
+        self.perfil[fase] = time.perf_counter() - inicio
+        instrumentation.record(f"search.load.{fase}", self.perfil[fase])
+        return resultado
+
+    def _carregar_modelo(self, aquecer):
         # Carrega o modelo de linguagem (transforma texto em números)
         # device='cpu' garante que rode em qualquer máquina
-        self.model = SentenceTransformer('all-MiniLM-L6-v2', device='cpu')
+        modulo = self._medir("import_sentence_transformers", __import__, "sentence_transformers")
+        self._valores["model"] = self._medir("modelo", lambda: modulo.SentenceTransformer(MODEL_NAME, device='cpu'))
+        if aquecer:
+            # A primeira chamada de encode inicializa o torch; melhor pagar isso antes do usuário
+            self._medir("aquecimento", self._valores["model"].encode, ["aquecimento"])
 
-        print("--> Carregando Índice de Busca Rápida (FAISS)...")
-        self.index = faiss.read_index(self.index_path)
+    def _carregar_indice(self):
+        self._medir("import_faiss", _faiss)
+        index = self._medir("indice", _faiss().read_index, self.index_path)
+        # Reaplica os parâmetros de busca (nprobe, efSearch...) escolhidos no treinamento
+        aplicar_parametros_busca(index, carregar_config(self.model_prefix)["parametros_busca"])
+        # Antes de publicar o índice: as buscas filtradas rodam em várias threads
+        preparar_indice(index)
+        self._valores["index"] = index
 
-        print("--> Carregando Metadados (Textos e Links)...")
-        with open(self.meta_path, "rb") as f:
-            self.metadata = pickle.load(f)
-            
-        print("--> Sistema Pronto!\n")
+    def _carregar_metadados(self):
+        self._valores["metadata"], self.meta_path = self._medir("metadados", carregar_metadados, self.model_prefix)
+
+    def _carregar_bm25(self):
+        # Modelos treinados antes do _bm25.bin: o índice é construído em memória a partir dos metadados
+        self._valores["bm25"] = self._medir("bm25", carregar_bm25, self.model_prefix, self.metadata)
+
+    @property
+    def filtros(self):
+        """Índice de filtros por paper/seção, aberto (ou construído) na primeira busca filtrada."""
+        if self._filtros is None:
+            with self._trava_filtros:
+                if self._filtros is None:
+                    self._filtros = self._medir("filtros", carregar_filtros, self.model_prefix, self.metadata)
+        return self._filtros
+
+    def _vincular_cache(self):
+        # Invalida o cache se o índice ou os metadados mudaram desde a última execução
+        arquivos = [self.meta_path] if self.modo == MODO_LEXICO else [self.index_path, self.meta_path]
+        self._medir("cache", self.cache.vincular, arquivos)
+
+    def carregar(self, aquecer=False, esperar=False):
+        """
+        Inicia o carregamento dos arquivos do modelo e da IA em segundo plano e retorna logo.
+        Cada busca espera apenas pelo que precisa (um resultado em cache não espera nada).
+        :param aquecer: roda um encode de aquecimento assim que o modelo carregar
+        :param esperar: bloqueia até tudo estar carregado (comportamento antigo)
+        """
+        precisa_indice = self.modo != MODO_LEXICO
+        if (precisa_indice and not os.path.exists(self.index_path)) or not os.path.exists(self.meta_path):
+            print(f"Erro Crítico: Arquivos do modelo não encontrados em '{self.model_prefix}'.")
+            print("Certifique-se de executar o script 'treinar_modelo.py' primeiro.")
+            return False
+
+        self._inicio = time.perf_counter()
+        self._executor = ThreadPoolExecutor(max_workers=5, thread_name_prefix="carregar")
+        # O modelo pode já estar carregando por causa de carregar_shards
+        modelo = self._futuros.get("model")
+        self._futuros = {"metadata": self._executor.submit(self._carregar_metadados)}
+        if precisa_indice:
+            self._futuros["model"] = modelo or self._executor.submit(self._carregar_modelo, aquecer)
+            self._futuros["index"] = self._executor.submit(self._carregar_indice)
+        if self.modo != MODO_SEMANTICO:
+            self._futuros["bm25"] = self._executor.submit(self._carregar_bm25)
+        if self.cache is not None:
+            self._futuros["cache"] = self._executor.submit(self._vincular_cache)
+        self._executor.shutdown(wait=False)
+
+        if esperar:
+            self.aguardar()
         return True
 
-    def buscar(self, query, top_k=5):
-        """Executa a busca e retorna os resultados formatados."""
+    def aguardar(self):
+        """Bloqueia até todos os artefatos estarem carregados (propaga erros de carregamento)."""
+        for futuro in self._futuros.values():
+            futuro.result()
+        if self._inicio is not None and "total" not in self.perfil:
+            self.perfil["total"] = time.perf_counter() - self._inicio
+
+    def relatorio_inicializacao(self):
+        """Tempos por fase do carregamento, em segundos."""
+        return "\n".join(f"  {fase:<30} {segundos:8.3f}s" for fase, segundos in self.perfil.items())
+
+    def buscar(self, query, top_k=5, filtro=None):
+        """
+        Executa a busca e retorna os resultados formatados.
+        :param filtro: restringe a papers/seções, ex: "120-196", "146:1", "parte 4" (ver filtros.py)
+        """
         if not query.strip():
             return []
 
+        resultados, estatisticas = self.buscar_lote([query], top_k, filtro=filtro)
+        return resultados[0], estatisticas["total"]
+
+    def _vetores(self, textos, batch_size=64):
+        """Embeddings normalizados das consultas: do cache ou numa única chamada de encode."""
+        vetores = [self.cache.obter_embedding(t) if self.cache is not None else None for t in textos]
+        faltando = [i for i, v in enumerate(vetores) if v is None]
+        if faltando:
+            novos = self.model.encode([textos[i] for i in faltando], batch_size=batch_size, convert_to_numpy=True)
+            novos = np.ascontiguousarray(novos, dtype=np.float32)
+            # Normalizar (para similaridade de cosseno)
+            _faiss().normalize_L2(novos)
+            for i, vetor in zip(faltando, novos):
+                vetores[i] = vetor
+                if self.cache is not None:
+                    self.cache.guardar_embedding(textos[i], vetor)
+        return np.ascontiguousarray(np.vstack(vetores), dtype=np.float32)
+
+    def carregar_shards(self, prefixos):
+        """
+        Carrega shards de parágrafos (ver shards_paragrafos.py) em paralelo.
+        Não exige o índice de assuntos; o modelo é carregado aqui se carregar() não foi chamado.
+        """
+        from shards_paragrafos import ShardParagrafos
+
+        if "model" not in self._futuros:
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="carregar")
+            self._futuros["model"] = executor.submit(self._carregar_modelo, False)
+            executor.shutdown(wait=False)
+        with ThreadPoolExecutor(max_workers=max(1, len(prefixos))) as executor:
+            for shard in executor.map(ShardParagrafos, prefixos):
+                self.shards[shard.nome] = shard
+        return list(self.shards)
+
+    def buscar_paragrafos(self, queries, top_k=5, shards=None, batch_size=64, filtro=None):
+        """
+        Busca parágrafos em um shard ou em vários ao mesmo tempo (uma thread por shard)
+        e funde os top-k pelo score. Os vetores das perguntas são calculados uma vez só.
+        :param shards: nomes dos shards (ex: ['TR000', 'TR007']); None = todos os carregados
+        :param filtro: restringe a papers/seções, como em buscar()
+        Retorna (lista de resultados por pergunta, estatísticas de tempo).
+        """
         start_time = time.time()
+        faixas = interpretar_filtro(filtro)
+        selecionados = [self.shards[nome] for nome in (shards or list(self.shards))]
+        resultados = [[] for _ in queries]
+        posicoes = [i for i, q in enumerate(queries) if q and q.strip()]
+        estatisticas = {"consultas": len(queries), "shards": len(selecionados),
+                        "codificacao": 0.0, "busca": 0.0, "montagem": 0.0, "total": 0.0}
+        if not posicoes or not selecionados:
+            estatisticas["total"] = time.time() - start_time
+            return resultados, estatisticas
+
+        vetores = self._vetores([queries[i] for i in posicoes], batch_size)
+        t_codificacao = time.time()
+
+        if len(selecionados) == 1:
+            respostas = [selecionados[0].buscar(vetores, top_k, faixas)]
+        else:
+            with ThreadPoolExecutor(max_workers=len(selecionados), thread_name_prefix="shard") as executor:
+                respostas = list(executor.map(lambda shard: shard.buscar(vetores, top_k, faixas), selecionados))
+        t_busca = time.time()
+
+        # Fusão: todas as colunas lado a lado, ordenadas pelo score em cada linha
+        scores = np.hstack([s for s, _ in respostas])
+        ids = np.hstack([i for _, i in respostas])
+        origem = np.repeat(np.arange(len(selecionados)), [s.shape[1] for s, _ in respostas])
+        scores = np.where(ids >= 0, scores, -np.inf)
+        melhores = np.argsort(-scores, axis=1, kind="stable")[:, :top_k]
+        for linha, i in enumerate(posicoes):
+            for rank, coluna in enumerate(melhores[linha].tolist(), start=1):
+                if ids[linha, coluna] < 0:
+                    break
+                shard = selecionados[origem[coluna]]
+                resultados[i].append(shard.resultado(rank, float(scores[linha, coluna]), int(ids[linha, coluna])))
+        t_montagem = time.time()
+
+        estatisticas["codificacao"] = t_codificacao - start_time
+        estatisticas["busca"] = t_busca - t_codificacao
+        estatisticas["montagem"] = t_montagem - t_busca
+        estatisticas["total"] = t_montagem - start_time
+        instrumentation.record("search.paragraphs", estatisticas["total"], rows=len(posicoes),
+                               shards=len(selecionados))
+        return resultados, estatisticas
+
+    def _resultado(self, rank, score, idx):
+        item = self.metadata[idx]
+        return {"rank": rank, "score": score, "assunto": item[0], "links": item[1]}
+
+    def buscar_lote(self, queries, top_k=5, batch_size=64, filtro=None):
+        """
+        Executa várias buscas de uma vez: uma única chamada de encode para todas as
+        perguntas e uma única busca FAISS com a matriz inteira. Nos modos híbrido e
+        lexical o BM25 responde primeiro; no lexical o modelo e o FAISS nem são usados.
+        Com filtro (mesmo para o lote todo) a restrição é aplicada dentro do FAISS e do BM25,
+        então cada pergunta ainda recebe top_k resultados quando o filtro tem candidatos.
+        Retorna (lista de resultados por pergunta, estatísticas de tempo compartilhadas).
+        """
+        faixas = interpretar_filtro(filtro)
+        # Caminho quente: com TUB_PROFILE o perfilador por amostragem registra as pilhas daqui
+        with instrumentation.profile("buscar_lote"):
+            resultados, estatisticas = self._buscar_lote(queries, top_k, batch_size, faixas)
+        if instrumentation.ENABLED:
+            # As fases já são medidas para as estatísticas; só são repassadas como spans
+            n = estatisticas["consultas"] - estatisticas["cache_resultados"]
+            for fase in ("lexico", "codificacao", "busca", "montagem"):
+                instrumentation.record(f"search.{fase}", estatisticas[fase], rows=n)
+            instrumentation.record("search", estatisticas["total"], rows=estatisticas["consultas"],
+                                   modo=self.modo, cache_hits=estatisticas["cache_resultados"])
+        return resultados, estatisticas
+
+    def _buscar_lote(self, queries, top_k, batch_size, faixas):
+        start_time = time.time()
+        resultados = [[] for _ in queries]
+        estatisticas = {"consultas": len(queries), "cache_resultados": 0,
+                        "lexico": 0.0, "codificacao": 0.0, "busca": 0.0, "montagem": 0.0, "total": 0.0}
+
+        # Perguntas vazias ficam com lista vazia e não vão para o modelo
+        posicoes = [i for i, q in enumerate(queries) if q and q.strip()]
 
-        # 1. Converter pergunta em vetor
-        vector = self.model.encode([query])
-        
-        # 2. Normalizar (para similaridade de cosseno)
-        faiss.normalize_L2(vector)
-        
-        # 3. Buscar no índice
-        scores, indices = self.index.search(vector, top_k)
-        
-        results = []
-        for i, idx in enumerate(indices[0]):
-            score = scores[0][i]
-            # O índice retornado pelo FAISS corresponde à posição na lista de metadados
-            if idx < len(self.metadata):
-                item = self.metadata[idx]
-                results.append({
-                    "rank": i + 1,
-                    "score": score,
-                    "assunto": item[0],
-                    "links": item[1]
-                })
-        
-        elapsed = time.time() - start_time
-        return results, elapsed
+        # 0. Resultados já conhecidos saem direto do cache
+        if "cache" in self._futuros:
+            self._futuros["cache"].result()
+        pendentes = []
+        for i in posicoes:
+            em_cache = (self.cache.obter_resultados(queries[i], top_k, self.modo, chave_filtro(faixas))
+                        if self.cache is not None else None)
+            if em_cache is not None:
+                resultados[i] = em_cache
+            else:
+                pendentes.append(i)
+        estatisticas["cache_resultados"] = len(posicoes) - len(pendentes)
+        if not pendentes:
+            estatisticas["total"] = time.time() - start_time
+            return resultados, estatisticas
+
+        # 1. Caminho lexical primeiro: não depende do modelo (que pode ainda estar carregando)
+        lexicos = {}
+        if self.modo != MODO_SEMANTICO:
+            candidatos = top_k if self.modo == MODO_LEXICO else max(top_k, CANDIDATOS_HIBRIDO)
+            permitidos = self.filtros.mascara(faixas) if faixas else None
+            lexicos = {i: self.bm25.buscar(queries[i], candidatos, permitidos) for i in pendentes}
+        t_lexico = time.time()
+        estatisticas["lexico"] = t_lexico - start_time
+
+        if self.modo == MODO_LEXICO:
+            for i in pendentes:
+                resultados[i] = [self._resultado(rank, score, doc)
+                                 for rank, (doc, score) in enumerate(lexicos[i], start=1)]
+            t_codificacao = t_busca = t_lexico
+        else:
+            # 2. Converter as perguntas em vetores: do cache ou numa única chamada de encode
+            vectors = self._vetores([queries[i] for i in pendentes], batch_size)
+            t_codificacao = time.time()
+
+            # 3. Buscar no índice com a matriz inteira
+            k_busca = top_k if self.modo == MODO_SEMANTICO else max(top_k, CANDIDATOS_HIBRIDO)
+            if faixas:
+                scores, indices = self.filtros.buscar(self.index, vectors, k_busca, faixas)
+            else:
+                scores, indices = self.index.search(vectors, k_busca)
+            t_busca = time.time()
+
+            # 4. Montar os resultados: a validação dos índices é feita na matriz toda
+            validos = (indices >= 0) & (indices < len(self.metadata))
+            if self.modo == MODO_SEMANTICO:
+                linhas, colunas = np.nonzero(validos)
+                ids = indices[linhas, colunas].tolist()
+                valores = scores[linhas, colunas].tolist()
+                for linha, coluna, idx, score in zip(linhas.tolist(), colunas.tolist(), ids, valores):
+                    resultados[pendentes[linha]].append(self._resultado(coluna + 1, score, idx))
+            else:
+                # Fusão por posição (RRF): as escalas de BM25 e cosseno não são comparáveis
+                for linha, i in enumerate(pendentes):
+                    semanticos = indices[linha][validos[linha]].tolist()
+                    fundidos = fundir_rrf([[doc for doc, _ in lexicos[i]], semanticos])[:top_k]
+                    resultados[i] = [self._resultado(rank, score, doc)
+                                     for rank, (doc, score) in enumerate(fundidos, start=1)]
+        if self.cache is not None:
+            for i in pendentes:
+                self.cache.guardar_resultados(queries[i], top_k, resultados[i], self.modo, chave_filtro(faixas))
+        t_montagem = time.time()
+        if "primeira_consulta" not in self.perfil and self._inicio is not None:
+            self.perfil["primeira_consulta"] = time.perf_counter() - self._inicio
+
+        estatisticas["codificacao"] = t_codificacao - t_lexico
+        estatisticas["busca"] = t_busca - t_codificacao
+        estatisticas["montagem"] = t_montagem - t_busca
+        estatisticas["total"] = t_montagem - start_time
+        return resultados, estatisticas
 
 def main():
     print("========================================================")
     print("       BUSCA SEMÂNTICA - INTERFACE INTERATIVA")
     print("========================================================")
 
-    buscador = MotorBusca(MODEL_PREFIX)
-    sucesso = buscador.carregar()
+    from cache_busca import CacheBusca
+    # Modo opcional na linha de comando: python buscar.py [semantico|hibrido|lexico]
+    modo = sys.argv[1] if len(sys.argv) > 1 else MODO_SEMANTICO
+    if modo not in MODOS:
+        print(f"Modo desconhecido: {modo} (use {', '.join(MODOS)})")
+        sys.exit(1)
+    buscador = MotorBusca(MODEL_PREFIX, cache=CacheBusca(caminho_disco=f"{MODEL_PREFIX}_cache.sqlite"), modo=modo)
+    # O carregamento segue em segundo plano enquanto o usuário digita a primeira pergunta
+    sucesso = buscador.carregar(aquecer=True)
 
     if not sucesso:
         sys.exit(1)
 
     print("Instruções: Digite sua pesquisa e tecle ENTER.")
+    print("            Digite 'perfil' para ver os tempos de inicialização.")
     print("            Digite 'sair' ou 'exit' para encerrar.\n")
 
     while True:
@@ -91,6 +391,10 @@ def main():
             if termo.lower() in ['sair', 'exit', 'quit']:
                 print("Encerrando...")
                 break
+
+            if termo.lower() == 'perfil':
+                print(buscador.relatorio_inicializacao())
+                continue
             
             if not termo:
                 continue
@@ -103,9 +407,13 @@ def main():
                 print("Nenhum resultado relevante encontrado.")
             else:
                 for res in resultados:
-                    # Formatação visual do score (Ex: 0.75 -> 75%)
-                    score_pct = res['score'] * 100
-                    print(f"#{res['rank']} [{score_pct:.1f}%] {res['assunto']}")
+                    if modo == MODO_SEMANTICO:
+                        # Formatação visual do score (Ex: 0.75 -> 75%)
+                        score_pct = res['score'] * 100
+                        print(f"#{res['rank']} [{score_pct:.1f}%] {res['assunto']}")
+                    else:
+                        # BM25 e RRF não são porcentagens
+                        print(f"#{res['rank']} [{res['score']:.3f}] {res['assunto']}")
                     print(f"      Link(s): {res['links']}")
                     print("-" * 40)
 
@@ -0,0 +1,168 @@
+"""
+Cache de dois níveis para o MotorBusca.
+
+Nível 1: LRU em memória (pergunta normalizada -> embedding e -> top-k de resultados).
+Nível 2: opcional, em disco (SQLite), para sobreviver a reinícios.
+Tudo é descartado automaticamente quando o hash do .index ou do _meta.pkl muda.
+"""
+import copy
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import _raiz  # noqa: F401
+from rodam_manifest import hash_files
+
+def normalizar_consulta(consulta):
+    """Minúsculas e espaços colapsados: 'Lucifer  Rebellion ' e 'lucifer rebellion' são a mesma consulta."""
+    return " ".join(consulta.lower().split())
+
+def _chave_resultados(consulta, top_k, modo, filtro=None):
+    # Sem modo (busca semântica) e sem filtro a chave é a mesma de antes; os demais ganham prefixo
+    chave = f"{top_k}|{normalizar_consulta(consulta)}"
+    if filtro:
+        chave = f"filtro={filtro}|{chave}"
+    return f"{modo}|{chave}" if modo and modo != "semantico" else chave
+
+def _impressao_stat(caminho):
+    try:
+        st = os.stat(caminho)
+    except OSError:
+        return ""
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+class _LRU:
+    def __init__(self, capacidade):
+        self.capacidade = capacidade
+        self.itens = OrderedDict()
+
+    def obter(self, chave):
+        valor = self.itens.get(chave)
+        if valor is not None:
+            self.itens.move_to_end(chave)
+        return valor
+
+    def guardar(self, chave, valor):
+        self.itens[chave] = valor
+        self.itens.move_to_end(chave)
+        while len(self.itens) > self.capacidade:
+            self.itens.popitem(last=False)
+
+    def limpar(self):
+        self.itens.clear()
+
+class CacheBusca:
+    def __init__(self, capacidade=2048, caminho_disco=None):
+        """
+        :param capacidade: número máximo de entradas de cada LRU em memória
+        :param caminho_disco: arquivo SQLite do segundo nível (None = só memória)
+        """
+        self.embeddings = _LRU(capacidade)
+        self.resultados = _LRU(capacidade)
+        self.caminho_disco = caminho_disco
+        self.impressao = ""
+        self._lock = threading.Lock()
+        self._db = None
+        self.contadores = {
+            "embedding": {"memoria": 0, "disco": 0, "falhas": 0},
+            "resultados": {"memoria": 0, "disco": 0, "falhas": 0},
+        }
+
+    def vincular(self, arquivos_modelo):
+        """
+        Associa o cache aos arquivos do modelo (.index e _meta.pkl).
+        Se o hash deles mudou desde a última execução, os dois níveis são esvaziados.
+        """
+        if self.caminho_disco:
+            relatorio = hash_files(list(arquivos_modelo), cache_path=f"{self.caminho_disco}.hashes.json",
+                                   max_workers=1)
+            impressao = "|".join(relatorio.hashes.get(a) or "" for a in arquivos_modelo)
+        else:
+            # Só memória: nada persiste entre execuções, basta (tamanho, mtime) para detectar troca do modelo
+            impressao = "|".join(_impressao_stat(a) for a in arquivos_modelo)
+
+        with self._lock:
+            if impressao != self.impressao:
+                self.embeddings.limpar()
+                self.resultados.limpar()
+            self.impressao = impressao
+            if self.caminho_disco:
+                self._abrir_disco()
+
+    def _abrir_disco(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.caminho_disco, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (consulta TEXT PRIMARY KEY, vetor BLOB)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS resultados (chave TEXT PRIMARY KEY, dados TEXT)")
+        linha = self._db.execute("SELECT valor FROM meta WHERE chave = 'impressao'").fetchone()
+        if not linha or linha[0] != self.impressao:
+            # Modelo diferente do que gerou o cache em disco: invalida tudo
+            self._db.execute("DELETE FROM embeddings")
+            self._db.execute("DELETE FROM resultados")
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('impressao', ?)", (self.impressao,))
+        self._db.commit()
+
+    def fechar(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def obter_embedding(self, consulta):
+        chave = normalizar_consulta(consulta)
+        with self._lock:
+            vetor = self.embeddings.obter(chave)
+            if vetor is not None:
+                self.contadores["embedding"]["memoria"] += 1
+                return vetor.copy()
+            if self._db is not None:
+                linha = self._db.execute("SELECT vetor FROM embeddings WHERE consulta = ?", (chave,)).fetchone()
+                if linha:
+                    vetor = np.frombuffer(linha[0], dtype=np.float32)
+                    self.embeddings.guardar(chave, vetor)
+                    self.contadores["embedding"]["disco"] += 1
+                    return vetor.copy()
+            self.contadores["embedding"]["falhas"] += 1
+            return None
+
+    def guardar_embedding(self, consulta, vetor):
+        chave = normalizar_consulta(consulta)
+        vetor = np.array(vetor, dtype=np.float32)
+        with self._lock:
+            self.embeddings.guardar(chave, vetor)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO embeddings VALUES (?, ?)", (chave, vetor.tobytes()))
+                self._db.commit()
+
+    def obter_resultados(self, consulta, top_k, modo=None, filtro=None):
+        chave = _chave_resultados(consulta, top_k, modo, filtro)
+        with self._lock:
+            resultados = self.resultados.obter(chave)
+            if resultados is not None:
+                self.contadores["resultados"]["memoria"] += 1
+                return copy.deepcopy(resultados)
+            if self._db is not None:
+                linha = self._db.execute("SELECT dados FROM resultados WHERE chave = ?", (chave,)).fetchone()
+                if linha:
+                    resultados = json.loads(linha[0])
+                    self.resultados.guardar(chave, resultados)
+                    self.contadores["resultados"]["disco"] += 1
+                    return copy.deepcopy(resultados)
+            self.contadores["resultados"]["falhas"] += 1
+            return None
+
+    def guardar_resultados(self, consulta, top_k, resultados, modo=None, filtro=None):
+        chave = _chave_resultados(consulta, top_k, modo, filtro)
+        # Guarda uma cópia: quem chamou pode reordenar ou alterar a lista devolvida
+        resultados = copy.deepcopy(resultados)
+        with self._lock:
+            self.resultados.guardar(chave, resultados)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO resultados VALUES (?, ?)",
+                                 (chave, json.dumps(resultados, ensure_ascii=False)))
+                self._db.commit()
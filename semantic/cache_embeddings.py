@@ -0,0 +1,62 @@
+"""
+Cache de embeddings endereçado por conteúdo.
+
+Cada vetor é guardado pela chave sha256(nome do modelo + texto), então um retreino só
+precisa codificar os textos novos ou alterados; o resto vem do SQLite.
+"""
+import hashlib
+import sqlite3
+
+import numpy as np
+
+def chave_embedding(model_name, texto):
+    return hashlib.sha256(f"{model_name}\0{texto}".encode("utf-8")).hexdigest()
+
+class CacheEmbeddings:
+    def __init__(self, caminho, model_name):
+        self.caminho = caminho
+        self.model_name = model_name
+        self.db = sqlite3.connect(caminho)
+        self.db.execute("CREATE TABLE IF NOT EXISTS embeddings (chave TEXT PRIMARY KEY, vetor BLOB)")
+        self.reaproveitados = 0
+        self.codificados = 0
+
+    def fechar(self):
+        self.db.close()
+
+    def obter(self, textos):
+        """Devolve {texto: vetor} para os textos já presentes no cache."""
+        encontrados = {}
+        chaves = {chave_embedding(self.model_name, t): t for t in set(textos)}
+        lista = list(chaves)
+        # Consulta em blocos para respeitar o limite de parâmetros do SQLite
+        for inicio in range(0, len(lista), 900):
+            bloco = lista[inicio:inicio + 900]
+            marcadores = ",".join("?" * len(bloco))
+            for chave, vetor in self.db.execute(
+                    f"SELECT chave, vetor FROM embeddings WHERE chave IN ({marcadores})", bloco):
+                encontrados[chaves[chave]] = np.frombuffer(vetor, dtype=np.float32)
+        return encontrados
+
+    def guardar(self, textos, vetores):
+        self.db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+                            [(chave_embedding(self.model_name, t), np.ascontiguousarray(v, dtype=np.float32).tobytes())
+                             for t, v in zip(textos, vetores)])
+        self.db.commit()
+
+    def codificar(self, textos, funcao_encode):
+        """
+        Matriz de embeddings na ordem de textos. Só os textos ausentes do cache são
+        passados para funcao_encode (lista de textos -> matriz float32 normalizada).
+        """
+        encontrados = self.obter(textos)
+        faltando = sorted({t for t in textos if t not in encontrados})
+        self.reaproveitados += len(set(textos)) - len(faltando)
+        if faltando:
+            novos = funcao_encode(faltando)
+            self.guardar(faltando, novos)
+            encontrados.update(zip(faltando, np.asarray(novos, dtype=np.float32)))
+            self.codificados += len(faltando)
+        if not textos:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.ascontiguousarray(np.vstack([encontrados[t] for t in textos]), dtype=np.float32)
@@ -0,0 +1,39 @@
+"""
+Configuração do índice FAISS salva ao lado do .index ({prefixo}_index.json).
+
+O treinamento grava qual tipo de índice foi construído (spec do index_factory) e os
+parâmetros de busca escolhidos (nprobe, efSearch, ...); o MotorBusca lê o mesmo arquivo
+para reaplicar esses parâmetros ao carregar o índice.
+"""
+import json
+import os
+
+# Índice exato, o comportamento original do treinamento
+SPEC_PADRAO = "Flat"
+
+def caminho_config(model_prefix):
+    return f"{model_prefix}_index.json"
+
+def salvar_config(model_prefix, index_spec, parametros_busca=None, **extras):
+    config = {"index_spec": index_spec, "parametros_busca": dict(parametros_busca or {})}
+    config.update(extras)
+    with open(caminho_config(model_prefix), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=4)
+    return config
+
+def carregar_config(model_prefix):
+    """Configuração salva pelo treinamento; índices antigos (sem o arquivo) são Flat sem parâmetros."""
+    caminho = caminho_config(model_prefix)
+    if not os.path.exists(caminho):
+        return {"index_spec": SPEC_PADRAO, "parametros_busca": {}}
+    with open(caminho, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def aplicar_parametros_busca(index, parametros_busca):
+    """Aplica nprobe/efSearch/... ao índice (funciona também com IDMap e wrappers)."""
+    if not parametros_busca:
+        return
+    import faiss
+    espaco = faiss.ParameterSpace()
+    for nome, valor in parametros_busca.items():
+        espaco.set_index_parameter(index, nome, valor)
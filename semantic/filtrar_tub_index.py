@@ -1,6 +1,9 @@
 import csv
 import os
 
+import _raiz  # noqa: F401
+import instrumentation
+
 def filtrar_csv(input_file, output_file):
     """
     Lê um arquivo CSV e remove as linhas que não possuem a segunda coluna preenchida (links).
@@ -11,7 +14,8 @@ def filtrar_csv(input_file, output_file):
     kept_count = 0
     
     try:
-        with open(input_file, mode='r', encoding='utf-8', newline='') as infile:
+        with instrumentation.span("filtrar.transform") as span, \
+                open(input_file, mode='r', encoding='utf-8', newline='') as infile:
             reader = csv.reader(infile)
             
             # Tenta ler o cabeçalho
@@ -31,6 +35,8 @@ def filtrar_csv(input_file, output_file):
                     removed_count += 1
                     # Opcional: imprimir linhas removidas para debug
                     # print(f"Linha {i} removida: {row}")
+            span.rows = kept_count + removed_count
+            span.set(kept=kept_count, removed=removed_count)
 
         # Salva o arquivo filtrado
         with open(output_file, mode='w', encoding='utf-8', newline='') as outfile:
@@ -0,0 +1,280 @@
+"""
+Filtros por paper/seção aplicados dentro da busca FAISS ({prefixo}_filtros.bin).
+
+No treinamento cada link de cada assunto vira uma entrada (chave, id), ordenada pela chave
+empacotada paper << 32 | section << 16 | paragraph. Um filtro ("120-196", "parte 4", "146:1")
+é uma lista de faixas de chaves; os ids de cada faixa são um trecho contíguo do arquivo
+(duas buscas binárias) e a união vira o bitmap de um faiss.IDSelectorBitmap. Assim a busca
+filtrada custa o mesmo que a normal e sempre devolve top_k resultados quando há candidatos.
+
+Layout (little endian):
+    cabeçalho   MAGIC, uint32 linhas (ids), uint32 entradas
+    chaves      entradas x uint64, ordenadas
+    ids         entradas x uint32
+"""
+import os
+import re
+import struct
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from metadados import MetadadosBin, interpretar_links
+
+MAGIC = b"TUBFLT01"
+CABECALHO = struct.Struct("<8sII")
+
+# As quatro partes do livro (o Prefácio é o paper 0)
+PARTES = {1: (1, 31), 2: (32, 56), 3: (57, 119), 4: (120, 196)}
+# Seleções até este tamanho são resolvidas por busca exata só nos vetores selecionados
+LIMITE_BUSCA_EXATA = 4096
+# Filtros recentes mantêm ids e bitmap prontos (consultas repetidas com o mesmo filtro)
+CAPACIDADE_FILTROS = 64
+# Maior valor de paper, seção ou parágrafo que cabe na chave empacotada
+LIMITE_CAMPO = 0xFFFF
+
+_PARTE = re.compile(r"^parte\s*([1-4])$")
+_FAIXA = re.compile(r"^(\d+)(?::(\d+))?(?:\s*-\s*(\d+)(?::(\d+))?)?$")
+
+def caminho_filtros(model_prefix):
+    return f"{model_prefix}_filtros.bin"
+
+def _chave(paper, section=0, paragraph=0):
+    return (paper << 32) | (section << 16) | paragraph
+
+def interpretar_filtro(filtro):
+    """
+    Faixas [início, fim) de chaves empacotadas, ordenadas; None quando não há filtro.
+    Aceita "146", "120-196", "146:1", "146:1-146:3", "parte 4" e combinações separadas
+    por vírgula, ou pares (paper_inicial, paper_final). ValueError se não entender.
+    """
+    if filtro is None or filtro == "" or filtro == []:
+        return None
+    if isinstance(filtro, str):
+        itens = [item.strip().lower() for item in filtro.split(",") if item.strip()]
+    elif isinstance(filtro, int):
+        itens = [(filtro, filtro)]
+    else:
+        itens = [tuple(item) if not isinstance(item, int) else (item, item) for item in filtro]
+
+    faixas = []
+    for item in itens:
+        if isinstance(item, tuple):
+            inicio, fim = item
+            if not 0 <= inicio <= fim <= LIMITE_CAMPO:
+                raise ValueError(f"filtro inválido: {item!r} (papers de 0 a {LIMITE_CAMPO})")
+            faixas.append((_chave(inicio), _chave(fim + 1)))
+            continue
+        parte = _PARTE.match(item)
+        if parte:
+            inicio, fim = PARTES[int(parte.group(1))]
+            faixas.append((_chave(inicio), _chave(fim + 1)))
+            continue
+        faixa = _FAIXA.match(item)
+        if not faixa:
+            raise ValueError(f"filtro inválido: {item!r} (use '146', '120-196', '146:1' ou 'parte 4')")
+        p1, s1, p2, s2 = (int(g) if g is not None else None for g in faixa.groups())
+        # Cada campo tem 16 bits na chave; valores maiores invadiriam o campo vizinho
+        if any(valor is not None and valor > LIMITE_CAMPO for valor in (p1, s1, p2, s2)):
+            raise ValueError(f"filtro inválido: {item!r} (valores até {LIMITE_CAMPO})")
+        if p2 is None:
+            p2, s2 = p1, s1
+        inicio = _chave(p1, s1 or 0)
+        # Soma em vez de empacotar: a seção 0xFFFF + 1 passa para o paper seguinte
+        fim = _chave(p2, s2) + (1 << 16) if s2 is not None else _chave(p2 + 1)
+        if fim <= inicio:
+            raise ValueError(f"filtro inválido: {item!r} (fim antes do início)")
+        faixas.append((inicio, fim))
+    return tuple(sorted(set(faixas)))
+
+def chave_filtro(faixas):
+    """Forma canônica das faixas, usada na chave do cache de resultados."""
+    return ",".join(f"{inicio:x}-{fim:x}" for inicio, fim in faixas) if faixas else ""
+
+def _montar_filtros(metadata):
+    """(linhas, chaves, ids) ordenados pela chave, a partir da lista de (assunto, links) ou de um MetadadosBin."""
+    if isinstance(metadata, MetadadosBin):
+        # As triplas já estão interpretadas no _meta.bin: tudo vetorizado
+        linhas = len(metadata)
+        offsets = np.frombuffer(metadata.off_triplas, dtype=np.uint32).astype(np.int64)
+        triplas = np.frombuffer(metadata.triplas, dtype=np.uint16).reshape(-1, 3).astype(np.uint64)
+        ids = np.repeat(np.arange(linhas, dtype=np.uint32), np.diff(offsets))
+        chaves = (triplas[:, 0] << np.uint64(32)) | (triplas[:, 1] << np.uint64(16)) | triplas[:, 2]
+    else:
+        linhas = len(metadata)
+        chaves, ids = [], []
+        for i, item in enumerate(metadata):
+            if item is None:
+                continue
+            for paper, section, paragraph in interpretar_links(item[1]):
+                chaves.append(_chave(paper, section, paragraph))
+                ids.append(i)
+        chaves = np.array(chaves, dtype=np.uint64)
+        ids = np.array(ids, dtype=np.uint32)
+    ordem = np.lexsort((ids, chaves))
+    return linhas, chaves[ordem].astype("<u8"), ids[ordem].astype("<u4")
+
+def salvar_filtros(caminho, metadata):
+    """Grava o índice de faixas a partir da lista de (assunto, links) — ou de um MetadadosBin."""
+    linhas, chaves, ids = _montar_filtros(metadata)
+    temporario = f"{caminho}.tmp"
+    with open(temporario, "wb") as f:
+        f.write(CABECALHO.pack(MAGIC, linhas, len(chaves)))
+        f.write(chaves.tobytes())
+        f.write(ids.tobytes())
+    os.replace(temporario, caminho)
+
+def _interno(index):
+    import faiss
+    return faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+
+def _parametros_busca(index, seletor, exaustivo=False):
+    """
+    SearchParameters com o seletor, do tipo que o índice (ou o índice dentro do IDMap) espera,
+    levando junto o nprobe/efSearch configurado, que os parâmetros da chamada substituem.
+    Com exaustivo o IVF percorre todas as listas (o seletor descarta os ids de fora).
+    """
+    import faiss
+
+    interno = _interno(index)
+    if isinstance(interno, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=seletor, nprobe=interno.nlist if exaustivo else interno.nprobe)
+    if isinstance(interno, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=seletor, efSearch=interno.hnsw.efSearch)
+    return faiss.SearchParameters(sel=seletor)
+
+def preparar_indice(index):
+    """
+    Deixa o índice pronto para as buscas filtradas; chamar no carregamento, antes de buscar.
+    O IVF só reconstrói vetores com o direct map (8 bytes por vetor): criá-lo durante uma busca
+    alteraria o índice enquanto outras threads o consultam. Com ids internos não sequenciais
+    (índices antigos que passaram por remove_ids) usa a tabela hash; se nem ela for possível,
+    fica sem direct map e as buscas filtradas vão pelo IDSelectorBitmap.
+    """
+    import faiss
+
+    interno = _interno(index)
+    if not isinstance(interno, faiss.IndexIVF) or interno.direct_map.type != faiss.DirectMap.NoMap:
+        return
+    try:
+        interno.make_direct_map()
+    except RuntimeError:
+        try:
+            interno.set_direct_map_type(faiss.DirectMap.Hashtable)
+        except RuntimeError as e:
+            print(f"Índice sem reconstrução de vetores ({e}); buscas filtradas usarão o bitmap.")
+
+def _reconstruir(index, ids):
+    """Vetores dos ids, ou None se o índice não guarda vetores reconstruíveis (ver preparar_indice)."""
+    try:
+        return index.reconstruct_batch(np.asarray(ids, dtype=np.int64))
+    except RuntimeError:
+        return None
+
+def buscar_em_ids(index, vetores, top_k, ids, linhas, bitmap=None):
+    """
+    index.search restrito aos ids (ordenados, únicos). Poucos ids: produto interno exato só
+    com os vetores deles (quando o índice permite reconstruí-los); senão um IDSelectorBitmap
+    dentro do FAISS. Devolve (scores, ids) como index.search, com -1 onde faltar candidato.
+    """
+    import faiss
+
+    n = len(vetores)
+    if len(ids) == 0:
+        return np.full((n, top_k), -np.inf, dtype=np.float32), np.full((n, top_k), -1, dtype=np.int64)
+    if len(ids) <= LIMITE_BUSCA_EXATA:
+        selecionados = _reconstruir(index, ids)
+        if selecionados is not None:
+            scores = vetores @ selecionados.T
+            k = min(top_k, len(ids))
+            melhores = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            ordem = np.argsort(-np.take_along_axis(scores, melhores, axis=1), axis=1, kind="stable")
+            melhores = np.take_along_axis(melhores, ordem, axis=1)
+            saida_scores = np.full((n, top_k), -np.inf, dtype=np.float32)
+            saida_ids = np.full((n, top_k), -1, dtype=np.int64)
+            saida_scores[:, :k] = np.take_along_axis(scores, melhores, axis=1)
+            saida_ids[:, :k] = np.asarray(ids, dtype=np.int64)[melhores]
+            return saida_scores, saida_ids
+
+    if bitmap is None:
+        mascara = np.zeros(linhas, dtype=bool)
+        mascara[ids] = True
+        bitmap = np.packbits(mascara, bitorder="little")
+    seletor = faiss.IDSelectorBitmap(linhas, faiss.swig_ptr(bitmap))
+    # O seletor e o bitmap precisam viver até o fim da busca
+    scores, encontrados = index.search(vetores, top_k, params=_parametros_busca(index, seletor))
+    curtas = np.flatnonzero((encontrados[:, -1] < 0) & (len(ids) >= top_k))
+    if len(curtas) and isinstance(_interno(index), faiss.IndexIVF):
+        # As listas sondadas tinham poucos selecionados: repete essas consultas em todas as listas
+        scores[curtas], encontrados[curtas] = index.search(
+            np.ascontiguousarray(vetores[curtas]), top_k, params=_parametros_busca(index, seletor, exaustivo=True))
+    return scores, encontrados
+
+class IndiceFiltros:
+    """Leitura por mmap do _filtros.bin, com os ids e bitmaps dos filtros recentes em cache."""
+
+    def __init__(self, caminho, dados=None):
+        """
+        :param caminho: arquivo _filtros.bin (lido por mmap)
+        :param dados: (linhas, chaves, ids) já montados em memória; quando passados o arquivo não é lido
+        """
+        self.caminho = caminho
+        if dados is not None:
+            self.linhas, self.chaves, self.ids = dados
+        else:
+            with open(caminho, "rb") as f:
+                magic, self.linhas, entradas = CABECALHO.unpack(f.read(CABECALHO.size))
+            if magic != MAGIC:
+                raise ValueError(f"{caminho} não é um índice de filtros")
+            self.chaves = np.memmap(caminho, dtype="<u8", mode="r", offset=CABECALHO.size, shape=(entradas,))
+            self.ids = np.memmap(caminho, dtype="<u4", mode="r", offset=CABECALHO.size + 8 * entradas,
+                                 shape=(entradas,))
+        self._recentes = OrderedDict()
+        self._trava = threading.Lock()
+
+    def selecao(self, faixas):
+        """(ids ordenados, bitmap) dos documentos com algum link nas faixas."""
+        chave = chave_filtro(faixas)
+        with self._trava:
+            if chave in self._recentes:
+                self._recentes.move_to_end(chave)
+                return self._recentes[chave]
+        limites = np.searchsorted(self.chaves, np.array(faixas, dtype=np.uint64).ravel()).reshape(-1, 2)
+        partes = [self.ids[inicio:fim] for inicio, fim in limites.tolist()]
+        ids = np.unique(np.concatenate(partes)).astype(np.int64) if partes else np.empty(0, dtype=np.int64)
+        mascara = np.zeros(self.linhas, dtype=bool)
+        mascara[ids] = True
+        selecao = (ids, mascara, np.packbits(mascara, bitorder="little"))
+        with self._trava:
+            self._recentes[chave] = selecao
+            while len(self._recentes) > CAPACIDADE_FILTROS:
+                self._recentes.popitem(last=False)
+        return selecao
+
+    def mascara(self, faixas):
+        """Vetor booleano (linhas,) com True nos documentos permitidos pelo filtro."""
+        return self.selecao(faixas)[1]
+
+    def buscar(self, index, vetores, top_k, faixas):
+        """index.search só entre os documentos do filtro."""
+        ids, _, bitmap = self.selecao(faixas)
+        return buscar_em_ids(index, vetores, top_k, ids, self.linhas, bitmap)
+
+    def fechar(self):
+        self.chaves = self.ids = None
+        self._recentes.clear()
+
+def carregar_filtros(model_prefix, metadata=None):
+    """
+    Índice de filtros do modelo. Se o _filtros.bin não existe (modelo treinado antes dele) e os
+    metadados foram passados, o índice é construído só em memória: o diretório do modelo pode
+    ser somente leitura e o arquivo é gerado pelo treinamento.
+    """
+    caminho = caminho_filtros(model_prefix)
+    if not os.path.exists(caminho):
+        if metadata is None:
+            return None
+        return IndiceFiltros(caminho, dados=_montar_filtros(
+            metadata if isinstance(metadata, MetadadosBin) else list(metadata)))
+    return IndiceFiltros(caminho)
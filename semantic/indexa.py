@@ -2,6 +2,9 @@ import json
 import csv
 import os
 
+import _raiz  # noqa: F401
+import instrumentation
+
 def create_faiss_index():
     import faiss
     import numpy as np
@@ -47,11 +50,12 @@ def generate_csv_from_json(json_path, csv_output_path, endings_path="endings_rep
         except Exception as e:
             print(f"Error reading endings file: {e}")
 
-    with open(json_path, 'r', encoding='utf-8') as f:
+    with instrumentation.span("indexa.parse"), open(json_path, 'r', encoding='utf-8') as f:
         data = json.load(f)
 
     row_count = 0
-    with open(csv_output_path, 'w', newline='', encoding='utf-8') as csvfile:
+    with instrumentation.span("indexa.transform") as span, \
+            open(csv_output_path, 'w', newline='', encoding='utf-8') as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(['assunto', 'links'])
 
@@ -91,6 +95,7 @@ def generate_csv_from_json(json_path, csv_output_path, endings_path="endings_rep
                     
                     writer.writerow([subject, links_str])
                     row_count += 1
+        span.rows = row_count
     
     print(f"CSV generated at {csv_output_path} with {row_count} rows.")
 
@@ -1,6 +1,9 @@
 import csv
 import re
 
+import _raiz  # noqa: F401
+import instrumentation
+
 # --- Configurações ---
 arquivo_entrada = 'tub_index.csv'  # Nome do seu arquivo original
 arquivo_saida = 'tub_index_limpo.csv' # Nome do arquivo que será criado
@@ -15,7 +18,8 @@ def processar_csv():
     print("Iniciando o processamento...")
     
     try:
-        with open(arquivo_entrada, mode='r', encoding='utf-8', newline='') as f_in, \
+        with instrumentation.span("limpar_csv.transform") as span, \
+             open(arquivo_entrada, mode='r', encoding='utf-8', newline='') as f_in, \
              open(arquivo_saida, mode='w', encoding='utf-8', newline='') as f_out:
             
             leitor = csv.reader(f_in, delimiter=delimitador)
@@ -38,6 +42,7 @@ def processar_csv():
                 # Escreve a linha completa (com as referências inalteradas) no novo arquivo
                 escritor.writerow(linha)
                 contador += 1
+            span.rows = contador
 
         print(f"Sucesso! {contador} linhas processadas.")
         print(f"Arquivo salvo como: {arquivo_saida}")
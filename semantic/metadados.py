@@ -0,0 +1,162 @@
+"""
+Formato binário dos metadados do modelo ({prefixo}_meta.bin), substituto do pickle.
+
+Abrir é só um mmap: nada é desserializado até que uma linha seja pedida, e o arquivo
+não executa código ao ser carregado (ao contrário do pickle baixado da internet).
+O arquivo entra no rodam_manifest.json pela regra "tub_modelo_meta.bin" e é conferido pelo Hash256.
+
+Layout (little endian):
+    cabeçalho   MAGIC, uint32 linhas, uint32 total de triplas
+    offsets     3 x (linhas + 1) x uint32: assuntos, links e triplas
+    triplas     total x 3 x uint16 (paper, section, paragraph) de cada link, já interpretados
+    vivos       linhas x uint8 (0 = posição removida no treino incremental), alinhado a 4 bytes
+    blobs       UTF-8 dos assuntos, depois UTF-8 dos links
+"""
+import mmap
+import os
+import pickle
+import re
+import struct
+import sys
+from array import array
+
+MAGIC = b"TUBMETA1"
+CABECALHO = struct.Struct("<8sII")
+
+_LINK = re.compile(r"(\d+):(\d+)\.(\d+)")
+
+def caminho_bin(model_prefix):
+    return f"{model_prefix}_meta.bin"
+
+def caminho_pkl(model_prefix):
+    return f"{model_prefix}_meta.pkl"
+
+def interpretar_links(links):
+    """'146:1.1 53:1.5' -> [(146, 1, 1), (53, 1, 5)]; textos que não são referências são ignorados."""
+    return [(int(p), int(s), int(n)) for p, s, n in _LINK.findall(links)]
+
+def _bytes_le(valores):
+    if sys.byteorder == "big":
+        valores = array(valores.typecode, valores)
+        valores.byteswap()
+    return valores.tobytes()
+
+def salvar_metadados_bin(caminho, metadata):
+    """Grava a lista de (assunto, links) — com None nas posições removidas — no formato binário."""
+    off_assuntos, off_links, off_triplas = array("I", [0]), array("I", [0]), array("I", [0])
+    triplas = array("H")
+    vivos = bytearray()
+    assuntos, links = [], []
+    for item in metadata:
+        assunto, link = item if item is not None else ("", "")
+        a, l = assunto.encode("utf-8"), link.encode("utf-8")
+        assuntos.append(a)
+        links.append(l)
+        off_assuntos.append(off_assuntos[-1] + len(a))
+        off_links.append(off_links[-1] + len(l))
+        for tripla in interpretar_links(link):
+            triplas.extend(tripla)
+        off_triplas.append(len(triplas) // 3)
+        vivos.append(0 if item is None else 1)
+
+    temporario = f"{caminho}.tmp"
+    with open(temporario, "wb") as f:
+        f.write(CABECALHO.pack(MAGIC, len(metadata), len(triplas) // 3))
+        f.write(_bytes_le(off_assuntos))
+        f.write(_bytes_le(off_links))
+        f.write(_bytes_le(off_triplas))
+        f.write(_bytes_le(triplas))
+        # Alinha 'vivos' e os blobs: as triplas têm 6 bytes por link
+        f.write(b"\0" * (-len(triplas) * 2 % 4))
+        f.write(vivos)
+        f.write(b"\0" * (-len(vivos) % 4))
+        f.writelines(assuntos)
+        f.writelines(links)
+    os.replace(temporario, caminho)
+
+class MetadadosBin:
+    """
+    Leitura por mmap do _meta.bin. Comporta-se como a lista do pickle:
+    metadata[i] -> (assunto, links), ou None se a posição foi removida.
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._arquivo = open(caminho, "rb")
+        self._mmap = mmap.mmap(self._arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.linhas, self.total_triplas = CABECALHO.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self.fechar()
+            raise ValueError(f"{caminho} não é um arquivo de metadados")
+
+        visao = memoryview(self._mmap)
+        pos = CABECALHO.size
+        tamanho_offsets = 4 * (self.linhas + 1)
+        secoes = []
+        for _ in range(3):
+            secoes.append(visao[pos:pos + tamanho_offsets])
+            pos += tamanho_offsets
+        fim_triplas = pos + 6 * self.total_triplas
+        secoes.append(visao[pos:fim_triplas])
+        pos = fim_triplas + (-self.total_triplas * 6 % 4)
+        if sys.byteorder == "little":
+            self.off_assuntos, self.off_links, self.off_triplas = (s.cast("I") for s in secoes[:3])
+            self.triplas = secoes[3].cast("H")
+        else:
+            convertidos = []
+            for secao, tipo in zip(secoes, "IIIH"):
+                valores = array(tipo, bytes(secao))
+                valores.byteswap()
+                convertidos.append(valores)
+            self.off_assuntos, self.off_links, self.off_triplas, self.triplas = convertidos
+        self.vivos = visao[pos:pos + self.linhas]
+        self._inicio_assuntos = pos + self.linhas + (-self.linhas % 4)
+        self._inicio_links = self._inicio_assuntos + self.off_assuntos[self.linhas]
+
+    def __len__(self):
+        return self.linhas
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.linhas
+        if not 0 <= i < self.linhas:
+            raise IndexError(i)
+        if not self.vivos[i]:
+            return None
+        assunto = self._mmap[self._inicio_assuntos + self.off_assuntos[i]:
+                             self._inicio_assuntos + self.off_assuntos[i + 1]].decode("utf-8")
+        links = self._mmap[self._inicio_links + self.off_links[i]:
+                           self._inicio_links + self.off_links[i + 1]].decode("utf-8")
+        return assunto, links
+
+    def __iter__(self):
+        for i in range(self.linhas):
+            yield self[i]
+
+    def links_de(self, i):
+        """Links da linha i já interpretados: lista de (paper, section, paragraph)."""
+        inicio, fim = self.off_triplas[i], self.off_triplas[i + 1]
+        t = self.triplas
+        return [(t[3 * k], t[3 * k + 1], t[3 * k + 2]) for k in range(inicio, fim)]
+
+    def fechar(self):
+        for nome in ("off_assuntos", "off_links", "off_triplas", "triplas", "vivos"):
+            visao = self.__dict__.pop(nome, None)
+            if isinstance(visao, memoryview):
+                visao.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._arquivo.close()
+
+def carregar_metadados(model_prefix):
+    """
+    Metadados do modelo: o _meta.bin (mmap) quando existe; senão o pickle legado.
+    Retorna (metadados, caminho usado) ou (None, None) se nenhum dos dois existir.
+    """
+    if os.path.exists(caminho_bin(model_prefix)):
+        return MetadadosBin(caminho_bin(model_prefix)), caminho_bin(model_prefix)
+    if os.path.exists(caminho_pkl(model_prefix)):
+        with open(caminho_pkl(model_prefix), "rb") as f:
+            return pickle.load(f), caminho_pkl(model_prefix)
+    return None, None
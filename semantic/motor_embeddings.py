@@ -0,0 +1,201 @@
+"""
+Motor de embeddings multi-processo para o treinamento.
+
+O corpus é ordenado por tamanho (lotes com textos parecidos desperdiçam menos padding),
+dividido em lotes de tamanho adaptativo e distribuído entre processos, cada um com seu
+próprio modelo e um número ajustado de threads. Os vetores voltam na ordem original.
+
+Com nome_modelo=MODELO_DETERMINISTICO é usado um codificador substituto, pequeno e
+determinístico, que permite medir o motor sem baixar o SentenceTransformer.
+"""
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+MODELO_DETERMINISTICO = "deterministico"
+
+# Orçamento de tokens (textos x maior texto do lote) usado para escolher o tamanho do lote
+TOKENS_POR_LOTE = 4096
+LOTE_MINIMO = 8
+LOTE_MAXIMO = 256
+
+class CodificadorDeterministico:
+    """
+    Substituto do SentenceTransformer para testes e benchmarks offline.
+    Cada palavra vira um vetor pseudoaleatório fixo (derivado do hash); o custo cresce com
+    textos x maior texto do lote, como num transformer com padding.
+    """
+
+    def __init__(self, dimensao=384):
+        self.dimensao = dimensao
+        self._vetores = {}
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimensao
+
+    def _vetor_palavra(self, palavra):
+        vetor = self._vetores.get(palavra)
+        if vetor is None:
+            semente = int.from_bytes(hashlib.sha256(palavra.encode("utf-8")).digest()[:8], "little")
+            vetor = np.random.default_rng(semente).standard_normal(self.dimensao).astype(np.float32)
+            self._vetores[palavra] = vetor
+        return vetor
+
+    def encode(self, textos, batch_size=64, convert_to_numpy=True, **kwargs):
+        saida = np.zeros((len(textos), self.dimensao), dtype=np.float32)
+        for inicio in range(0, len(textos), batch_size):
+            lote = textos[inicio:inicio + batch_size]
+            palavras = [t.lower().split() or [""] for t in lote]
+            maior = max(len(p) for p in palavras)
+            # Matriz com padding (lote x maior texto x dimensão), como a entrada de um transformer
+            tokens = np.zeros((len(lote), maior, self.dimensao), dtype=np.float32)
+            for i, lista in enumerate(palavras):
+                for j, palavra in enumerate(lista):
+                    tokens[i, j] = self._vetor_palavra(palavra)
+            saida[inicio:inicio + len(lote)] = tokens.sum(axis=1)
+        return saida
+
+def carregar_modelo(nome_modelo):
+    if nome_modelo == MODELO_DETERMINISTICO:
+        return CodificadorDeterministico()
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(nome_modelo, device='cpu')
+
+def estimar_tokens(texto):
+    # Aproximação barata: ~1 token a cada 4 caracteres, mais [CLS] e [SEP]
+    return len(texto) // 4 + 2
+
+def montar_lotes(textos, tokens_por_lote=TOKENS_POR_LOTE):
+    """
+    Ordena os índices por tamanho (decrescente) e agrupa em lotes cujo custo com padding
+    (quantidade x maior texto) cabe no orçamento. Retorna listas de índices.
+    """
+    ordem = sorted(range(len(textos)), key=lambda i: len(textos[i]), reverse=True)
+    lotes = []
+    atual = []
+    maior = 0
+    for i in ordem:
+        tokens = estimar_tokens(textos[i])
+        maior = max(maior, tokens)
+        if atual and (len(atual) >= LOTE_MAXIMO or
+                      (len(atual) >= LOTE_MINIMO and (len(atual) + 1) * maior > tokens_por_lote)):
+            lotes.append(atual)
+            atual = []
+            maior = tokens
+        atual.append(i)
+    if atual:
+        lotes.append(atual)
+    return lotes
+
+# --- Lado do processo trabalhador ---
+_modelo_trabalhador = None
+
+def _iniciar_trabalhador(nome_modelo, threads):
+    global _modelo_trabalhador
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["MKL_NUM_THREADS"] = str(threads)
+    if nome_modelo != MODELO_DETERMINISTICO:
+        import torch
+        torch.set_num_threads(threads)
+    _modelo_trabalhador = carregar_modelo(nome_modelo)
+
+def _codificar_com(modelo, lotes_textos):
+    """Codifica uma fatia (lista de lotes) e devolve os vetores empilhados na mesma ordem."""
+    vetores = [np.asarray(modelo.encode(lote, batch_size=len(lote), convert_to_numpy=True), dtype=np.float32)
+               for lote in lotes_textos]
+    return np.vstack(vetores)
+
+def _codificar_lotes(lotes_textos):
+    return _codificar_com(_modelo_trabalhador, lotes_textos)
+
+class MotorEmbeddings:
+    def __init__(self, nome_modelo, processos=None, threads_por_processo=None, tokens_por_lote=TOKENS_POR_LOTE):
+        """
+        :param processos: número de processos (padrão: metade dos núcleos)
+        :param threads_por_processo: threads de cada processo (padrão: núcleos / processos)
+        """
+        nucleos = os.cpu_count() or 1
+        self.nome_modelo = nome_modelo
+        self.processos = processos or max(1, nucleos // 2)
+        self.threads_por_processo = threads_por_processo or max(1, nucleos // self.processos)
+        self.tokens_por_lote = tokens_por_lote
+        self.ultimo_relatorio = {}
+        # Modelo do caminho de um processo só, carregado no processo atual sem mexer nas threads dele
+        self._modelo_local = None
+
+    def codificar(self, textos):
+        """Matriz (len(textos) x dimensão) float32, na ordem original dos textos."""
+        inicio = time.time()
+        textos = list(textos)
+        lotes = montar_lotes(textos, self.tokens_por_lote)
+
+        # Lotes distribuídos em rodízio: cada processo recebe textos longos e curtos
+        fatias = [lotes[p::self.processos] for p in range(self.processos)]
+        fatias = [f for f in fatias if f]
+
+        if not fatias:
+            resultados = []
+        elif len(fatias) == 1:
+            # Um processo só: codifica aqui mesmo, sem custo de subir o pool. O inicializador dos
+            # trabalhadores não roda aqui: ele fixaria OMP_NUM_THREADS e as threads do torch do chamador
+            if self._modelo_local is None:
+                self._modelo_local = carregar_modelo(self.nome_modelo)
+            resultados = [_codificar_com(self._modelo_local, [[textos[i] for i in lote] for lote in fatias[0]])]
+        else:
+            contexto = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=len(fatias), mp_context=contexto, initializer=_iniciar_trabalhador,
+                                     initargs=(self.nome_modelo, self.threads_por_processo)) as executor:
+                futuros = [executor.submit(_codificar_lotes, [[textos[i] for i in lote] for lote in fatia])
+                           for fatia in fatias]
+                resultados = [f.result() for f in futuros]
+
+        # Costura: devolve cada vetor à posição original do texto
+        saida = None
+        for fatia, vetores in zip(fatias, resultados):
+            indices = [i for lote in fatia for i in lote]
+            if saida is None:
+                saida = np.empty((len(textos), vetores.shape[1]), dtype=np.float32)
+            saida[indices] = vetores
+        if saida is None:
+            saida = np.empty((0, 0), dtype=np.float32)
+
+        segundos = time.time() - inicio
+        self.ultimo_relatorio = {
+            "sentencas": len(textos),
+            "segundos": segundos,
+            "sentencas_por_segundo": len(textos) / segundos if segundos > 0 else 0.0,
+            "processos": len(fatias),
+            "threads_por_processo": self.threads_por_processo,
+            "lotes": len(lotes),
+            "lote_medio": len(textos) / len(lotes) if lotes else 0.0,
+        }
+        return saida
+
+    def resumo(self):
+        r = self.ultimo_relatorio
+        return (f"{r.get('sentencas', 0)} sentenças em {r.get('segundos', 0):.2f}s "
+                f"({r.get('sentencas_por_segundo', 0):.0f} sent/s, {r.get('processos', 0)} processos x "
+                f"{r.get('threads_por_processo', 0)} threads, {r.get('lotes', 0)} lotes, "
+                f"lote médio {r.get('lote_medio', 0):.0f})")
+
+if __name__ == "__main__":
+    import csv
+
+    # Benchmark offline com o codificador determinístico sobre os assuntos do índice
+    with open('tub_index_com_links.csv', 'r', encoding='utf-8') as f:
+        assuntos = [row['assunto'] for row in csv.DictReader(f)]
+    nome = sys.argv[1] if len(sys.argv) > 1 else MODELO_DETERMINISTICO
+
+    referencia = None
+    for processos in sorted({1, 2, max(1, (os.cpu_count() or 1) // 2)}):
+        motor = MotorEmbeddings(nome, processos=processos)
+        vetores = motor.codificar(assuntos)
+        if referencia is None:
+            referencia = vetores
+        identicos = np.allclose(referencia, vetores, atol=1e-4)
+        print(f"processos={processos}: {motor.resumo()} | mesmo resultado: {identicos}")
@@ -0,0 +1,157 @@
+"""
+Pipeline único que substitui a sequência indexa -> limpar_csv -> filtrar_tub_index.
+
+Lê o tubIndex_000.gz em streaming e passa cada registro por estágios geradores
+(terminações especiais, unescape, parênteses, links vazios), sem arquivos intermediários.
+O resultado pode ser gravado no CSV final ou entregue direto ao treinamento.
+"""
+import csv
+import html
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+
+import _raiz  # noqa: F401
+import instrumentation
+from translation_stream import iter_array_items
+
+ARQUIVO_INDICE = os.path.join("..", "tubIndex_000.gz")
+ARQUIVO_TERMINACOES = "endings_report.txt"
+ARQUIVO_SAIDA = "tub_index_com_links.csv"
+
+def carregar_terminacoes(caminho=ARQUIVO_TERMINACOES):
+    """Lê as terminações especiais (mesmo comportamento de indexa.generate_csv_from_json)."""
+    terminacoes = {"of"}  # padrão se o arquivo não existir
+    if os.path.exists(caminho):
+        with open(caminho, 'r', encoding='utf-8') as f:
+            lidas = [linha.strip() for linha in f if linha.strip()]
+            if lidas:
+                terminacoes = set(lidas)
+    return terminacoes
+
+def ler_indice(caminho_json):
+    """Fonte: um registro por detalhe com DetailType >= 100."""
+    for item in iter_array_items(caminho_json):
+        titulo = item.get('Title', '')
+        for detalhe in item.get('Details', []):
+            if detalhe.get('DetailType', 0) >= 100:
+                yield {
+                    'titulo': titulo,
+                    'texto': detalhe.get('Text', '').replace(',', ''),
+                    'links': " ".join(detalhe.get('Links', [])),
+                }
+
+# --- Estágios: cada um recebe e devolve um iterador de registros ---
+
+def estagio_terminacoes(terminacoes):
+    """Monta o assunto: 'texto titulo' quando o texto termina numa terminação especial, senão 'titulo texto'."""
+    def estagio(registros):
+        for registro in registros:
+            palavras = registro['texto'].strip().split()
+            if palavras and palavras[-1] in terminacoes:
+                registro['assunto'] = f"{registro['texto']} {registro['titulo']}"
+            else:
+                registro['assunto'] = f"{registro['titulo']} {registro['texto']}"
+            yield registro
+    return estagio
+
+def estagio_unescape(registros):
+    """Decodifica entidades HTML e normaliza para minúsculas."""
+    for registro in registros:
+        registro['assunto'] = html.unescape(registro['assunto']).strip().lower()
+        yield registro
+
+_PARENTESES = re.compile(r'\s*\(.*?\)')
+
+def estagio_parenteses(registros):
+    """Remove trechos entre parênteses do assunto (limpar_csv.limpar_texto)."""
+    for registro in registros:
+        registro['assunto'] = _PARENTESES.sub('', registro['assunto']).strip()
+        yield registro
+
+def estagio_links_vazios(registros):
+    """Descarta registros sem links (filtrar_tub_index.filtrar_csv)."""
+    for registro in registros:
+        if registro['links'].strip():
+            yield registro
+
+def estagios_padrao(caminho_terminacoes=ARQUIVO_TERMINACOES):
+    """Estágios equivalentes aos três scripts antigos, na mesma ordem."""
+    return [
+        ("terminacoes", estagio_terminacoes(carregar_terminacoes(caminho_terminacoes))),
+        ("unescape", estagio_unescape),
+        ("parenteses", estagio_parenteses),
+        ("links_vazios", estagio_links_vazios),
+    ]
+
+class Contadores:
+    """Registros que entraram e saíram de cada estágio."""
+
+    def __init__(self):
+        self.estagios = OrderedDict()
+
+    def medir(self, nome, estagio, registros):
+        """Aplica o estágio contando os registros na entrada e na saída."""
+        contagem = self.estagios.setdefault(nome, {'entrada': 0, 'saida': 0})
+
+        def entrada():
+            for registro in registros:
+                contagem['entrada'] += 1
+                yield registro
+
+        def saida():
+            for registro in estagio(entrada()):
+                contagem['saida'] += 1
+                yield registro
+
+        return saida()
+
+    def resumo(self):
+        return "\n".join(f"  {nome:<14} entrada={c['entrada']:<7} saida={c['saida']}"
+                         for nome, c in self.estagios.items())
+
+def executar_pipeline(caminho_json=ARQUIVO_INDICE, estagios=None, contadores=None):
+    """
+    Encadeia fonte e estágios e devolve um gerador de tuplas (assunto, links).
+    Nada é lido até que o gerador seja consumido.
+    """
+    if estagios is None:
+        estagios = estagios_padrao()
+    # A leitura do .gz em streaming inclui descompressão e parsing
+    registros = instrumentation.iter_span("pipeline.read", ler_indice(caminho_json))
+    for nome, estagio in estagios:
+        if contadores is not None:
+            registros = contadores.medir(nome, estagio, registros)
+        else:
+            registros = estagio(registros)
+    return instrumentation.iter_span("pipeline.transform",
+                                     ((registro['assunto'], registro['links']) for registro in registros))
+
+def gravar_csv(registros, caminho_saida=ARQUIVO_SAIDA):
+    """Grava os registros no formato do tub_index_com_links.csv e devolve o total de linhas."""
+    total = 0
+    with open(caminho_saida, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['assunto', 'links'])
+        for registro in registros:
+            writer.writerow(registro)
+            total += 1
+    return total
+
+if __name__ == "__main__":
+    inicio = time.time()
+    contadores = Contadores()
+    registros = executar_pipeline(ARQUIVO_INDICE, contadores=contadores)
+
+    if "--treinar" in sys.argv:
+        # Envia os registros direto para o treinamento, sem CSV intermediário
+        from training import treinar_de_registros
+        treinar_de_registros(registros, 'model/tub_modelo')
+    else:
+        total = gravar_csv(registros, ARQUIVO_SAIDA)
+        print(f"{total} linhas gravadas em {ARQUIVO_SAIDA}")
+
+    print(f"Pipeline concluído em {time.time() - inicio:.2f}s")
+    print(contadores.resumo())
@@ -0,0 +1,341 @@
+"""
+Serviço HTTP/JSON local (asyncio) em volta do MotorBusca, com micro-lotes dinâmicos.
+
+Requisições concorrentes entram numa fila; o coletor junta as que chegarem dentro da
+janela de latência (ou até o tamanho máximo do lote) e executa um único buscar_lote
+numa thread de trabalho. Enquanto um lote roda, o próximo já vai sendo formado.
+
+Rotas:
+    POST /buscar     {"query": "...", "top_k": 5, "filtro": "120-196"} -> {"resultados": [...], "latencia_ms": ...}
+    GET  /metricas   profundidade da fila (incluindo lotes em execução), lotes, p50/p95/p99 de latência
+    GET  /saude      {"ok": true}
+
+Uso:
+    python servico_busca.py servir --porta 8765
+    python servico_busca.py carga --porta 8765 --total 2000 --concorrencia 64
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from filtros import interpretar_filtro
+
+JANELA_MS = 5.0
+LOTE_MAXIMO = 64
+# O lote roda com o maior top_k dos seus pedidos: um valor enorme pesaria para todos eles
+TOP_K_MAXIMO = 100
+AMOSTRAS_LATENCIA = 10000
+
+def percentis(valores, pontos=(50, 95, 99)):
+    """Percentis (nearest-rank) de uma sequência; zeros se estiver vazia."""
+    ordenados = sorted(valores)
+    if not ordenados:
+        return {f"p{p}": 0.0 for p in pontos}
+    return {f"p{p}": ordenados[min(len(ordenados) - 1, max(0, -(-p * len(ordenados) // 100) - 1))]
+            for p in pontos}
+
+class ServicoParado(RuntimeError):
+    """A consulta ainda esperava na fila (ou num lote em formação) quando o serviço parou."""
+
+class ColetorMicroLotes:
+    def __init__(self, motor, janela_ms=JANELA_MS, lote_maximo=LOTE_MAXIMO, threads=1):
+        self.motor = motor
+        self.janela = janela_ms / 1000.0
+        self.lote_maximo = lote_maximo
+        self.fila = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="buscar_lote")
+        self._tarefa = None
+        self._parado = False
+        # Lote em formação dentro da janela: já saiu da fila mas ainda não foi despachado
+        self._lote = []
+        # Lotes despachados ainda em execução (o laço só guarda referência fraca às tarefas)
+        self._em_andamento = set()
+        self.consultas_em_andamento = 0
+        self.latencias_ms = deque(maxlen=AMOSTRAS_LATENCIA)
+        self.tamanhos_lote = deque(maxlen=AMOSTRAS_LATENCIA)
+        self.total_consultas = 0
+        self.total_lotes = 0
+
+    def iniciar(self):
+        self._tarefa = asyncio.get_running_loop().create_task(self._coletar())
+
+    async def parar(self):
+        self._parado = True
+        if self._tarefa:
+            self._tarefa.cancel()
+            await asyncio.gather(self._tarefa, return_exceptions=True)
+        # Quem ainda não entrou num lote despachado recebe erro em vez de esperar para sempre
+        pendentes = self._lote
+        self._lote = []
+        while not self.fila.empty():
+            pendentes.append(self.fila.get_nowait())
+        for item in pendentes:
+            if not item[2].done():
+                item[2].set_exception(ServicoParado("serviço encerrado antes de a consulta ser executada"))
+        # Os lotes já despachados terminam e respondem antes de o executor fechar
+        if self._em_andamento:
+            await asyncio.gather(*self._em_andamento, return_exceptions=True)
+        self._executor.shutdown(wait=False)
+
+    async def buscar(self, query, top_k=5, filtro=None):
+        """Enfileira uma consulta e espera o resultado do lote em que ela entrar."""
+        if self._parado:
+            raise ServicoParado("serviço encerrado")
+        futuro = asyncio.get_running_loop().create_future()
+        await self.fila.put((query, top_k, futuro, time.perf_counter(), filtro))
+        return await futuro
+
+    async def _coletar(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._lote = lote = [await self.fila.get()]
+            limite = loop.time() + self.janela
+            while len(lote) < self.lote_maximo:
+                restante = limite - loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(await asyncio.wait_for(self.fila.get(), restante))
+                except asyncio.TimeoutError:
+                    break
+            # O lote roda na thread de trabalho; o laço volta a coletar imediatamente
+            self._lote = []
+            self.consultas_em_andamento += len(lote)
+            tarefa = loop.create_task(self._executar(lote))
+            self._em_andamento.add(tarefa)
+            tarefa.add_done_callback(self._em_andamento.discard)
+
+    def _buscar_grupos(self, lote):
+        """Um buscar_lote por filtro distinto (o filtro vale para o lote inteiro); resultados na ordem do lote."""
+        grupos = {}
+        for posicao, item in enumerate(lote):
+            grupos.setdefault(item[4], []).append(posicao)
+        resultados = [None] * len(lote)
+        for filtro, posicoes in grupos.items():
+            top_k = max(lote[p][1] for p in posicoes)
+            respostas, _ = self.motor.buscar_lote([lote[p][0] for p in posicoes], top_k, filtro=filtro)
+            for p, resposta in zip(posicoes, respostas):
+                resultados[p] = resposta
+        return resultados
+
+    async def _executar(self, lote):
+        loop = asyncio.get_running_loop()
+        try:
+            resultados = await loop.run_in_executor(self._executor, self._buscar_grupos, lote)
+        except Exception as e:
+            for item in lote:
+                if not item[2].done():
+                    item[2].set_exception(e)
+            return
+        finally:
+            self.consultas_em_andamento -= len(lote)
+        agora = time.perf_counter()
+        self.total_lotes += 1
+        self.total_consultas += len(lote)
+        self.tamanhos_lote.append(len(lote))
+        for (query, k, futuro, inicio, _), resultado in zip(lote, resultados):
+            self.latencias_ms.append((agora - inicio) * 1000)
+            if not futuro.done():
+                futuro.set_result(resultado[:k])
+
+    def metricas(self):
+        dados = {
+            # Consultas ainda sem resposta: as que esperam na fila e as dos lotes em execução
+            "fila": self.fila.qsize() + self.consultas_em_andamento,
+            "em_andamento": self.consultas_em_andamento,
+            "lotes_em_andamento": len(self._em_andamento),
+            "consultas": self.total_consultas,
+            "lotes": self.total_lotes,
+            "lote_medio": sum(self.tamanhos_lote) / len(self.tamanhos_lote) if self.tamanhos_lote else 0.0,
+            "janela_ms": self.janela * 1000,
+            "lote_maximo": self.lote_maximo,
+        }
+        dados.update({f"latencia_{k}_ms": v for k, v in percentis(self.latencias_ms).items()})
+        return dados
+
+# --- HTTP mínimo sobre asyncio.start_server ---
+
+async def _ler_requisicao(reader):
+    linha = await reader.readline()
+    if not linha:
+        return None
+    metodo, caminho, _ = linha.decode("latin-1").split(" ", 2)
+    cabecalhos = {}
+    while True:
+        linha = await reader.readline()
+        if linha in (b"\r\n", b"\n", b""):
+            break
+        nome, _, valor = linha.decode("latin-1").partition(":")
+        cabecalhos[nome.strip().lower()] = valor.strip()
+    tamanho = int(cabecalhos.get("content-length", 0))
+    corpo = await reader.readexactly(tamanho) if tamanho else b""
+    return metodo, caminho, cabecalhos, corpo
+
+def _resposta(status, dados, manter_conexao):
+    corpo = json.dumps(dados, ensure_ascii=False).encode("utf-8")
+    textos = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error",
+              503: "Service Unavailable"}
+    cabecalho = (f"HTTP/1.1 {status} {textos.get(status, '')}\r\n"
+                 f"Content-Type: application/json; charset=utf-8\r\n"
+                 f"Content-Length: {len(corpo)}\r\n"
+                 f"Connection: {'keep-alive' if manter_conexao else 'close'}\r\n\r\n")
+    return cabecalho.encode("latin-1") + corpo
+
+class ServicoBusca:
+    def __init__(self, motor, host="127.0.0.1", porta=8765, janela_ms=JANELA_MS, lote_maximo=LOTE_MAXIMO):
+        self.host = host
+        self.porta = porta
+        self.coletor = ColetorMicroLotes(motor, janela_ms, lote_maximo)
+        self.servidor = None
+        # Conexões abertas: as keep-alive ociosas são fechadas no parar()
+        self._conexoes = set()
+
+    async def iniciar(self):
+        self.coletor.iniciar()
+        self.servidor = await asyncio.start_server(self._atender, self.host, self.porta)
+        self.porta = self.servidor.sockets[0].getsockname()[1]
+        return self
+
+    async def parar(self):
+        self.servidor.close()
+        # Primeiro responde (ou falha com 503) tudo o que está pendente, depois fecha as conexões:
+        # desde o Python 3.12 wait_closed() espera por elas
+        await self.coletor.parar()
+        for writer in list(self._conexoes):
+            writer.close()
+        await self.servidor.wait_closed()
+
+    async def _atender(self, reader, writer):
+        self._conexoes.add(writer)
+        try:
+            while True:
+                requisicao = await _ler_requisicao(reader)
+                if requisicao is None:
+                    break
+                metodo, caminho, cabecalhos, corpo = requisicao
+                manter = cabecalhos.get("connection", "keep-alive").lower() != "close"
+                status, dados = await self._rotear(metodo, caminho, corpo)
+                writer.write(_resposta(status, dados, manter))
+                await writer.drain()
+                if not manter:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self._conexoes.discard(writer)
+            writer.close()
+
+    async def _rotear(self, metodo, caminho, corpo):
+        if metodo == "GET" and caminho == "/saude":
+            return 200, {"ok": True}
+        if metodo == "GET" and caminho == "/metricas":
+            return 200, self.coletor.metricas()
+        if metodo == "POST" and caminho == "/buscar":
+            try:
+                pedido = json.loads(corpo or b"{}")
+                query = str(pedido["query"])
+                top_k = int(pedido.get("top_k", 5))
+                if not 1 <= top_k <= TOP_K_MAXIMO:
+                    return 400, {"erro": f"top_k deve estar entre 1 e {TOP_K_MAXIMO}"}
+                filtro = pedido.get("filtro") or None
+                if filtro is not None:
+                    if not isinstance(filtro, str):
+                        raise TypeError("filtro deve ser texto")
+                    # Valida já aqui: um filtro inválido não deve derrubar o lote inteiro
+                    interpretar_filtro(filtro)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                return 400, {"erro": "corpo esperado: {\"query\": \"...\", \"top_k\": 5, \"filtro\": \"120-196\"}"}
+            inicio = time.perf_counter()
+            try:
+                resultados = await self.coletor.buscar(query, top_k, filtro)
+            except ServicoParado as e:
+                return 503, {"erro": str(e)}
+            except Exception as e:
+                return 500, {"erro": str(e)}
+            return 200, {"resultados": resultados, "latencia_ms": (time.perf_counter() - inicio) * 1000}
+        return 404, {"erro": f"rota desconhecida: {metodo} {caminho}"}
+
+# --- Gerador de carga ---
+
+async def gerar_carga(host, porta, consultas, total=1000, concorrencia=32, top_k=5):
+    """
+    Dispara 'total' requisições /buscar com 'concorrencia' conexões keep-alive simultâneas.
+    Retorna vazão e percentis de latência vistos pelo cliente.
+    """
+    latencias = []
+    erros = 0
+    proxima = iter(range(total))
+
+    async def cliente():
+        nonlocal erros
+        reader, writer = await asyncio.open_connection(host, porta)
+        try:
+            for n in proxima:
+                corpo = json.dumps({"query": consultas[n % len(consultas)], "top_k": top_k}).encode("utf-8")
+                pedido = (f"POST /buscar HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                          f"Content-Length: {len(corpo)}\r\n\r\n").encode("latin-1") + corpo
+                inicio = time.perf_counter()
+                writer.write(pedido)
+                await writer.drain()
+                linha = await reader.readline()
+                tamanho = 0
+                while True:
+                    cabecalho = await reader.readline()
+                    if cabecalho in (b"\r\n", b""):
+                        break
+                    if cabecalho.lower().startswith(b"content-length:"):
+                        tamanho = int(cabecalho.split(b":")[1])
+                await reader.readexactly(tamanho)
+                latencias.append((time.perf_counter() - inicio) * 1000)
+                if b" 200 " not in linha:
+                    erros += 1
+        finally:
+            writer.close()
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(cliente() for _ in range(concorrencia)))
+    segundos = time.perf_counter() - inicio
+    relatorio = {"requisicoes": len(latencias), "erros": erros, "segundos": segundos,
+                 "requisicoes_por_segundo": len(latencias) / segundos if segundos else 0.0}
+    relatorio.update({f"latencia_{k}_ms": v for k, v in percentis(latencias).items()})
+    return relatorio
+
+async def _servir(args):
+    from buscar import MODEL_PREFIX, MotorBusca
+    from cache_busca import CacheBusca
+
+    motor = MotorBusca(args.prefixo or MODEL_PREFIX, cache=CacheBusca())
+    if not motor.carregar(aquecer=True):
+        return
+    servico = await ServicoBusca(motor, args.host, args.porta, args.janela_ms, args.lote_maximo).iniciar()
+    print(f"Serviço de busca em http://{servico.host}:{servico.porta} "
+          f"(janela {args.janela_ms}ms, lote máximo {args.lote_maximo})")
+    async with servico.servidor:
+        await servico.servidor.serve_forever()
+
+async def _carga(args):
+    import csv
+    with open(args.consultas, 'r', encoding='utf-8') as f:
+        consultas = [row['assunto'] for row in csv.DictReader(f)]
+    relatorio = await gerar_carga(args.host, args.porta, consultas, args.total, args.concorrencia)
+    print(json.dumps(relatorio, indent=4))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serviço local de busca semântica com micro-lotes")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    servir = sub.add_parser("servir")
+    servir.add_argument("--prefixo", default=None)
+    servir.add_argument("--janela-ms", type=float, default=JANELA_MS)
+    servir.add_argument("--lote-maximo", type=int, default=LOTE_MAXIMO)
+    carga = sub.add_parser("carga")
+    carga.add_argument("--consultas", default="tub_index_com_links.csv")
+    carga.add_argument("--total", type=int, default=1000)
+    carga.add_argument("--concorrencia", type=int, default=32)
+    for p in (servir, carga):
+        p.add_argument("--host", default="127.0.0.1")
+        p.add_argument("--porta", type=int, default=8765)
+    args = parser.parse_args()
+    asyncio.run(_servir(args) if args.comando == "servir" else _carga(args))
@@ -0,0 +1,130 @@
+"""
+Shards de parágrafos: um índice FAISS por tradução (TR*.gz), com os parágrafos do livro.
+
+Cada shard tem o .index, o {prefixo}_index.json (tipo "paragrafos", tradução, idioma) e o
+{prefixo}_chaves.bin: a chave empacotada (paper << 32 | section << 16 | paragraph) de cada
+id do índice, lida por mmap. Os resultados voltam a Paper/Section/ParagraphNo sem reler o JSON;
+o texto vem do .pstore da tradução quando ele existe (ver paragraph_store.py).
+
+Layout do _chaves.bin (little endian):
+    cabeçalho   MAGIC, uint32 quantidade, uint32 por_secao (0/1)
+    chaves      quantidade x uint64
+"""
+import bisect
+import os
+import re
+import struct
+
+import numpy as np
+
+from config_indice import aplicar_parametros_busca, carregar_config
+from filtros import buscar_em_ids, preparar_indice
+
+from _raiz import RAIZ
+from paragraph_store import STORE_EXTENSION, ParagraphStore, format_reference, pack_key, unpack_key
+from translation_stream import iter_paragraphs, read_header
+
+MAGIC = b"TUBCHV01"
+CABECALHO = struct.Struct("<8sII")
+TIPO_PARAGRAFOS = "paragrafos"
+PASTA_SHARDS = os.path.join("dados_modelo", "paragrafos")
+
+_MARCACAO = re.compile(r"<[^>]*>")
+
+def caminho_chaves(prefixo):
+    return f"{prefixo}_chaves.bin"
+
+def prefixo_shard(traducao, pasta=PASTA_SHARDS):
+    """'TR000.gz' -> 'dados_modelo/paragrafos/TR000'"""
+    return os.path.join(pasta, os.path.splitext(os.path.basename(traducao))[0])
+
+def ler_trechos(traducao, por_secao=False):
+    """
+    Trechos da tradução como (chave, texto), sem marcação HTML e sem textos vazios.
+    Com por_secao os parágrafos de cada seção são unidos num trecho só, com a chave do
+    primeiro parágrafo (o modelo trunca textos longos, então o início da seção pesa mais).
+    """
+    trechos = []
+    secao_atual = None
+    for registro in iter_paragraphs(traducao):
+        texto = " ".join(_MARCACAO.sub(" ", registro.Text).split())
+        if not texto:
+            continue
+        chave = pack_key(registro.Paper, registro.Section, registro.ParagraphNo)
+        if por_secao and secao_atual == (registro.Paper, registro.Section):
+            trechos[-1] = (trechos[-1][0], f"{trechos[-1][1]} {texto}")
+            continue
+        secao_atual = (registro.Paper, registro.Section)
+        trechos.append((chave, texto))
+    return trechos
+
+def idioma_traducao(traducao):
+    return read_header(traducao).get("LanguageID")
+
+def salvar_chaves(prefixo, chaves, por_secao=False):
+    temporario = f"{caminho_chaves(prefixo)}.tmp"
+    with open(temporario, "wb") as f:
+        f.write(CABECALHO.pack(MAGIC, len(chaves), int(por_secao)))
+        f.write(np.asarray(chaves, dtype="<u8").tobytes())
+    os.replace(temporario, caminho_chaves(prefixo))
+
+class ShardParagrafos:
+    """Um shard carregado: índice FAISS, chaves por id e, se houver, o .pstore com os textos."""
+
+    def __init__(self, prefixo):
+        import faiss
+
+        self.prefixo = prefixo
+        self.nome = os.path.basename(prefixo)
+        self.config = carregar_config(prefixo)
+        self.index = faiss.read_index(f"{prefixo}.index")
+        aplicar_parametros_busca(self.index, self.config.get("parametros_busca"))
+        preparar_indice(self.index)
+
+        with open(caminho_chaves(prefixo), "rb") as f:
+            magic, quantidade, por_secao = CABECALHO.unpack(f.read(CABECALHO.size))
+        if magic != MAGIC:
+            raise ValueError(f"{caminho_chaves(prefixo)} não é um arquivo de chaves")
+        self.por_secao = bool(por_secao)
+        self.chaves = np.memmap(caminho_chaves(prefixo), dtype="<u8", mode="r",
+                                offset=CABECALHO.size, shape=(quantidade,))
+        self.idioma = self.config.get("idioma")
+
+        self.store = None
+        traducao = self.config.get("traducao")
+        if traducao:
+            # As traduções ficam na raiz do repositório, ao lado do .pstore compilado
+            caminho_store = os.path.join(RAIZ, os.path.splitext(traducao)[0] + STORE_EXTENSION)
+            if os.path.exists(caminho_store):
+                self.store = ParagraphStore(caminho_store)
+
+    def buscar(self, vetores, top_k, faixas=None):
+        """(scores, ids) do FAISS para a matriz de consultas, opcionalmente só nas faixas de chaves."""
+        if not faixas:
+            return self.index.search(vetores, top_k)
+        permitidos = np.zeros(len(self.chaves), dtype=bool)
+        for inicio, fim in faixas:
+            permitidos |= (self.chaves >= inicio) & (self.chaves < fim)
+        return buscar_em_ids(self.index, vetores, top_k, np.flatnonzero(permitidos), len(self.chaves))
+
+    def resultado(self, rank, score, idx):
+        chave = int(self.chaves[idx])
+        paper, section, paragraph = unpack_key(chave)
+        item = {"rank": rank, "score": score, "shard": self.nome, "idioma": self.idioma,
+                "referencia": format_reference(chave), "paper": paper, "section": section,
+                "paragraph": paragraph, "trecho": "secao" if self.por_secao else "paragrafo"}
+        if self.store is not None:
+            item["texto"] = self._texto_secao(paper, section) if self.por_secao else self.store.get(chave)
+        return item
+
+    def _texto_secao(self, paper, section):
+        """Todos os parágrafos da seção (o vetor do trecho foi calculado sobre eles), um por linha."""
+        inicio = bisect.bisect_left(self.store.keys, pack_key(paper, section, 0))
+        fim = bisect.bisect_left(self.store.keys, pack_key(paper, section + 1, 0), inicio)
+        return "\n".join(texto for texto in map(self.store.text_at, range(inicio, fim)) if texto)
+
+    def fechar(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+        self.chaves = None
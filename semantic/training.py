@@ -4,6 +4,16 @@ import os
 import pickle
 import time
 
+from cache_embeddings import CacheEmbeddings
+from motor_embeddings import MotorEmbeddings
+from config_indice import SPEC_PADRAO, aplicar_parametros_busca, carregar_config, salvar_config
+from bm25 import caminho_bm25, salvar_bm25
+from filtros import caminho_filtros, salvar_filtros
+from metadados import caminho_bin, carregar_metadados, salvar_metadados_bin
+from shards_paragrafos import TIPO_PARAGRAFOS, idioma_traducao, ler_trechos, prefixo_shard, salvar_chaves
+import _raiz  # noqa: F401
+import instrumentation
+
 # Tenta importar as bibliotecas necessárias
 try:
     import faiss
@@ -16,10 +26,21 @@ except ImportError as e:
     print("pip install sentence-transformers faiss-cpu numpy")
     sys.exit(1)
 
-def treinar_modelo(csv_input, model_output_prefix):
+# 'all-MiniLM-L6-v2' é ideal para CPU: rápido e com boa acurácia para inglês.
+# Se o conteúdo fosse muito misturado ou puramente português, 'paraphrase-multilingual-MiniLM-L12-v2' seria uma alternativa.
+MODEL_NAME = 'all-MiniLM-L6-v2'
+
+# Acima desta fração de posições removidas nos metadados o índice é reconstruído (compactado)
+LIMITE_COMPACTACAO = 0.25
+
+def treinar_modelo(csv_input, model_output_prefix, index_spec=SPEC_PADRAO, parametros_busca=None, processos=None):
     """
     Treina (indexa) os dados do CSV para busca semântica.
     Usa apenas CPU conforme solicitado.
+    :param index_spec: tipo de índice no formato do faiss.index_factory
+                       (ex: "Flat", "IVF256,Flat", "HNSW32", "IVF256,PQ16")
+    :param parametros_busca: parâmetros de busca salvos com o índice (ex: {"nprobe": 16})
+    :param processos: processos do motor de embeddings (padrão: metade dos núcleos)
     """
     print(f"--- Iniciando Treinamento (Indexação) ---")
     print(f"Arquivo entrada: {csv_input}")
@@ -33,63 +54,260 @@ def treinar_modelo(csv_input, model_output_prefix):
         return
 
     print("Lendo arquivo CSV...")
-    with open(csv_input, 'r', encoding='utf-8') as f:
+    with instrumentation.span("training.read") as span, open(csv_input, 'r', encoding='utf-8') as f:
         reader = csv.DictReader(f)
         for row in reader:
             if 'assunto' in row and 'links' in row:
                 assuntos.append(row['assunto'])
                 links.append(row['links'])
+        span.rows = len(assuntos)
     
     print(f"Total de registros carregados: {len(assuntos)}")
+    _gerar_indice(assuntos, links, model_output_prefix, index_spec, parametros_busca, processos)
+
+def treinar_de_registros(registros, model_output_prefix, index_spec=SPEC_PADRAO, parametros_busca=None,
+                         processos=None):
+    """
+    Treina a partir de um iterável de tuplas (assunto, links), por exemplo
+    o gerador de pipeline_indice.executar_pipeline, sem passar por CSV.
+    """
+    print("--- Iniciando Treinamento (Indexação) a partir do pipeline ---")
+    assuntos = []
+    links = []
+    for assunto, link in registros:
+        assuntos.append(assunto)
+        links.append(link)
+    print(f"Total de registros recebidos: {len(assuntos)}")
+    _gerar_indice(assuntos, links, model_output_prefix, index_spec, parametros_busca, processos)
+
+def criar_indice(embeddings, index_spec=SPEC_PADRAO, parametros_busca=None, ids=None):
+    """
+    Cria o índice FAISS descrito por index_spec (produto interno) e adiciona os vetores.
+    Índices que precisam de treino (IVF, PQ) são treinados com os próprios vetores.
+    Com ids o índice é envolvido num IndexIDMap2, permitindo adicionar e remover por id.
+    """
+    dimension = embeddings.shape[1]
+    index = faiss.index_factory(dimension, index_spec, faiss.METRIC_INNER_PRODUCT)
+    if ids is not None:
+        index = faiss.IndexIDMap2(index)
+    if not index.is_trained:
+        print(f"Treinando índice {index_spec} com {len(embeddings)} vetores...")
+        index.train(embeddings)
+    if ids is not None:
+        index.add_with_ids(embeddings, np.asarray(ids, dtype=np.int64))
+    else:
+        index.add(embeddings)
+    aplicar_parametros_busca(index, parametros_busca)
+    return index
+
+def _funcao_encode(processos=None):
+    """
+    Função de encode que só sobe o motor de embeddings (e carrega o SentenceTransformer)
+    se algum texto precisar ser codificado.
+    """
+    def encode(textos):
+        motor = MotorEmbeddings(MODEL_NAME, processos=processos)
+        print(f"Gerando embeddings de {len(textos)} textos novos ou alterados "
+              f"({MODEL_NAME}, CPU, {motor.processos} processos x {motor.threads_por_processo} threads)...")
+        with instrumentation.span("training.encode", rows=len(textos), processes=motor.processos):
+            vetores = motor.codificar(textos)
+        print(f"Embeddings: {motor.resumo()}")
+        # Normalizamos os vetores para usar 'Inner Product' (IP) como Similaridade de Cosseno
+        faiss.normalize_L2(vetores)
+        return vetores
+
+    return encode
 
-    # 2. Carregar o Modelo de IA
-    # 'all-MiniLM-L6-v2' é ideal para CPU: rápido e com boa acurácia para inglês.
-    # Se o conteúdo fosse muito misturado ou puramente português, 'paraphrase-multilingual-MiniLM-L12-v2' seria uma alternativa.
-    model_name = 'all-MiniLM-L6-v2'
-    print(f"Carregando modelo SentenceTransformer: {model_name} (Dispositivo: CPU)...")
-    model = SentenceTransformer(model_name, device='cpu')
+def _eh_ivf(index):
+    interno = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    return isinstance(interno, faiss.IndexIVF)
 
-    # 3. Gerar Embeddings (Vetores)
-    print("Gerando embeddings (pode demorar alguns minutos dependendo do tamanho)...")
+def _ids_sequenciais(index):
+    """False para um IVF cujos ids internos têm buracos (treinado antes desta verificação)."""
+    if not _eh_ivf(index):
+        return True
+    interno = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    try:
+        interno.make_direct_map()
+    except RuntimeError:
+        return False
+    interno.set_direct_map_type(faiss.DirectMap.NoMap)
+    return True
+
+def _atualizar_incremental(index, metadata, assuntos, links, cache, encode):
+    """
+    Aplica ao índice existente só a diferença entre os metadados salvos e os novos registros.
+    Cada id do índice é a posição do registro em metadata; registros removidos viram None
+    (a posição nunca é reutilizada) e os novos são acrescentados no final.
+    Retorna False se o índice não suporta a operação (ex: remoção em HNSW).
+    """
+    # Ids atuais por registro (um mesmo registro pode aparecer mais de uma vez)
+    atuais = {}
+    for idx, item in enumerate(metadata):
+        if item is not None:
+            atuais.setdefault(tuple(item), []).append(idx)
+
+    novos = []
+    for registro in zip(assuntos, links):
+        ids = atuais.get(registro)
+        if ids:
+            ids.pop()
+        else:
+            novos.append(registro)
+    removidos = sorted(idx for ids in atuais.values() for idx in ids)
+
+    print(f"Atualização incremental: {len(novos)} novos, {len(removidos)} removidos.")
+    if removidos and _eh_ivf(index):
+        # No IVF dentro do IndexIDMap2, remove_ids não renumera os ids internos: o mapa de ids
+        # desalinha e o direct map das buscas filtradas deixa de ser possível
+        print("Índice IVF não suporta remoção com ids sequenciais; reconstruindo.")
+        return False
+    try:
+        if removidos:
+            index.remove_ids(np.asarray(removidos, dtype=np.int64))
+    except RuntimeError as e:
+        print(f"Índice não suporta remoção ({e}); reconstruindo.")
+        return False
+    for idx in removidos:
+        metadata[idx] = None
+
+    if novos:
+        embeddings = cache.codificar([assunto for assunto, _ in novos], encode)
+        ids = np.arange(len(metadata), len(metadata) + len(novos), dtype=np.int64)
+        index.add_with_ids(embeddings, ids)
+        metadata.extend(novos)
+    return True
+
+def _carregar_existente(model_output_prefix, index_spec):
+    """Índice e metadados de um treino anterior compatível (mesmo modelo, spec e com ids), ou None."""
+    index_file = f"{model_output_prefix}.index"
+    config = carregar_config(model_output_prefix)
+    if not os.path.exists(index_file):
+        return None
+    if config.get("modelo") != MODEL_NAME or config.get("index_spec") != index_spec or not config.get("ids"):
+        return None
+    metadata, _ = carregar_metadados(model_output_prefix)
+    if metadata is None:
+        return None
+    index = faiss.read_index(index_file)
+    if not _ids_sequenciais(index):
+        print("Índice IVF com ids internos fora de sequência; reconstruindo.")
+        if hasattr(metadata, "fechar"):
+            metadata.fechar()
+        return None
+    # Cópia em lista: o treino incremental altera as posições
+    lista = list(metadata)
+    if hasattr(metadata, "fechar"):
+        metadata.fechar()
+    return index, lista
+
+def _gerar_indice(assuntos, links, model_output_prefix, index_spec=SPEC_PADRAO, parametros_busca=None,
+                  processos=None):
+    """
+    Gera embeddings, cria (ou atualiza) o índice FAISS e salva índice + metadados.
+    Os embeddings vêm do cache endereçado por conteúdo; só textos novos são codificados.
+    Se já existe um índice compatível, apenas as linhas novas/removidas são aplicadas nele.
+    """
+    # Criamos a pasta do modelo se não existir
+    os.makedirs(os.path.dirname(model_output_prefix), exist_ok=True)
+    cache = CacheEmbeddings(f"{model_output_prefix}_embeddings.sqlite", MODEL_NAME)
+    encode = _funcao_encode(processos)
     start_time = time.time()
-    
-    # show_progress_bar=True mostra uma barra se tqdm estiver instalado
-    embeddings = model.encode(assuntos, batch_size=64, show_progress_bar=True, convert_to_numpy=True)
-    
-    end_time = time.time()
-    print(f"Embeddings gerados em {end_time - start_time:.2f} segundos.")
 
-    # 4. Criar Índice FAISS
-    # Normalizamos os vetores para usar 'Inner Product' (IP) como Similaridade de Cosseno
-    print("Normalizando vetores e criando índice FAISS...")
-    faiss.normalize_L2(embeddings)
-    
-    dimension = embeddings.shape[1]
-    # IndexFlatIP é exato e usa produto interno. Com vetores normalizados = Cosseno.
-    index = faiss.IndexFlatIP(dimension) 
-    index.add(embeddings)
-    
-    print(f"Índice criado com {index.ntotal} vetores.")
+    index = None
+    existente = _carregar_existente(model_output_prefix, index_spec)
+    if existente:
+        index, metadata = existente
+        if not _atualizar_incremental(index, metadata, assuntos, links, cache, encode):
+            index = None
+        elif metadata.count(None) > LIMITE_COMPACTACAO * len(metadata):
+            print("Muitas posições removidas; compactando o índice.")
+            index = None
+
+    if index is None:
+        # 3. Gerar Embeddings (Vetores) - do cache quando possível
+        print("Gerando embeddings (pode demorar alguns minutos dependendo do tamanho)...")
+        embeddings = cache.codificar(assuntos, encode)
+
+        # 4. Criar Índice FAISS
+        # "Flat" (IndexFlatIP) é exato e usa produto interno. Com vetores normalizados = Cosseno.
+        # IVF/HNSW/PQ trocam um pouco de recall por memória e latência (ver avaliar_indices).
+        print("Criando índice FAISS...")
+        with instrumentation.span("training.index_build", rows=len(assuntos), index_spec=index_spec):
+            index = criar_indice(embeddings, index_spec, parametros_busca, ids=np.arange(len(assuntos)))
+        metadata = list(zip(assuntos, links))
+
+    end_time = time.time()
+    print(f"Embeddings: {cache.codificados} codificados, {cache.reaproveitados} do cache "
+          f"({end_time - start_time:.2f} segundos).")
+    print(f"Índice {index_spec} com {index.ntotal} vetores.")
+    cache.fechar()
 
     # 5. Salvar Modelo (Índice + Metadados)
-    # Criamos uma pasta 'models' se não existir
-    os.makedirs(os.path.dirname(model_output_prefix), exist_ok=True)
-    
+    inicio_gravacao = time.perf_counter()
     index_file = f"{model_output_prefix}.index"
     meta_file = f"{model_output_prefix}_meta.pkl"
     
     print(f"Salvando índice em: {index_file}")
     faiss.write_index(index, index_file)
+    # A configuração fica ao lado do índice para o MotorBusca reaplicar os parâmetros de busca
+    salvar_config(model_output_prefix, index_spec, parametros_busca,
+                  modelo=MODEL_NAME, dimensao=int(index.d), total=int(index.ntotal), ids=True)
     
-    print(f"Salvando metadados em: {meta_file}")
+    # Salvando (assunto, link) para poder mostrar o texto original na busca.
+    # A posição na lista é o id no índice; registros removidos ficam como None.
+    print(f"Salvando metadados em: {caminho_bin(model_output_prefix)}")
+    salvar_metadados_bin(caminho_bin(model_output_prefix), metadata)
+    # Índice invertido BM25 sobre os mesmos assuntos (busca híbrida e lexical no MotorBusca)
+    print(f"Salvando índice BM25 em: {caminho_bm25(model_output_prefix)}")
+    salvar_bm25(caminho_bm25(model_output_prefix), metadata)
+    # Links já interpretados por paper/seção, para as buscas filtradas dentro do FAISS
+    print(f"Salvando índice de filtros em: {caminho_filtros(model_output_prefix)}")
+    salvar_filtros(caminho_filtros(model_output_prefix), metadata)
+    # O pickle continua sendo gravado para clientes que ainda não leem o formato binário
+    print(f"Salvando metadados (legado) em: {meta_file}")
     with open(meta_file, "wb") as f:
-        # Salvamos a lista de links (e assuntos, se quiser recuperar o texto original)
-        # Salvando (assunto, link) para poder mostrar o texto original na busca
-        metadata = list(zip(assuntos, links))
         pickle.dump(metadata, f)
+    instrumentation.record("training.save", time.perf_counter() - inicio_gravacao, rows=len(metadata))
 
     print("--- Treinamento Concluído com Sucesso ---")
 
+def treinar_paragrafos(traducao, prefixo_saida=None, por_secao=False, index_spec=SPEC_PADRAO,
+                       parametros_busca=None, processos=None):
+    """
+    Segundo modo de indexação: embeddings dos parágrafos de uma tradução (TR*.gz),
+    gravados como um shard próprio (ver shards_paragrafos.py). Um shard por idioma.
+    :param por_secao: um trecho por seção em vez de um por parágrafo
+    """
+    prefixo_saida = prefixo_saida or prefixo_shard(traducao)
+    print(f"--- Indexando parágrafos de {traducao} em {prefixo_saida} ---")
+    with instrumentation.span("training.read", traducao=os.path.basename(traducao)) as span:
+        trechos = ler_trechos(traducao, por_secao)
+        span.rows = len(trechos)
+    print(f"Total de trechos: {len(trechos)} ({'seções' if por_secao else 'parágrafos'})")
+    if not trechos:
+        print("Nenhum parágrafo encontrado; shard não gerado.")
+        return None
+
+    os.makedirs(os.path.dirname(prefixo_saida) or ".", exist_ok=True)
+    cache = CacheEmbeddings(f"{prefixo_saida}_embeddings.sqlite", MODEL_NAME)
+    start_time = time.time()
+    embeddings = cache.codificar([texto for _, texto in trechos], _funcao_encode(processos))
+    print(f"Embeddings: {cache.codificados} codificados, {cache.reaproveitados} do cache "
+          f"({time.time() - start_time:.2f} segundos).")
+    cache.fechar()
+
+    with instrumentation.span("training.index_build", rows=len(trechos), index_spec=index_spec):
+        index = criar_indice(embeddings, index_spec, parametros_busca)
+    faiss.write_index(index, f"{prefixo_saida}.index")
+    # O id de cada vetor é a posição em _chaves.bin
+    salvar_chaves(prefixo_saida, [chave for chave, _ in trechos], por_secao)
+    salvar_config(prefixo_saida, index_spec, parametros_busca, tipo=TIPO_PARAGRAFOS,
+                  traducao=os.path.basename(traducao), idioma=idioma_traducao(traducao), por_secao=por_secao,
+                  modelo=MODEL_NAME, dimensao=int(index.d), total=int(index.ntotal))
+    print(f"Shard {prefixo_saida} com {index.ntotal} vetores.")
+    return prefixo_saida
+
 def testar_modelo(query, model_output_prefix, top_k=5):
     """
     Função simples para testar o modelo treinado.
@@ -97,21 +315,23 @@ def testar_modelo(query, model_output_prefix, top_k=5):
     print(f"\n--- Testando Modelo com query: '{query}' ---")
     
     index_file = f"{model_output_prefix}.index"
-    meta_file = f"{model_output_prefix}_meta.pkl"
     
-    if not os.path.exists(index_file) or not os.path.exists(meta_file):
+    if not os.path.exists(index_file):
         print("Arquivos do modelo não encontrados. Treine primeiro.")
         return
 
     # Carregar índice
     index = faiss.read_index(index_file)
+    aplicar_parametros_busca(index, carregar_config(model_output_prefix)["parametros_busca"])
     
-    # Carregar metadados
-    with open(meta_file, "rb") as f:
-        metadata = pickle.load(f) # lista de (assunto, links)
+    # Carregar metadados (lista de (assunto, links); _meta.bin ou pickle legado)
+    metadata, _ = carregar_metadados(model_output_prefix)
+    if metadata is None:
+        print("Arquivos do modelo não encontrados. Treine primeiro.")
+        return
         
     # Carregar modelo para codificar a query
-    model = SentenceTransformer('all-MiniLM-L6-v2', device='cpu')
+    model = SentenceTransformer(MODEL_NAME, device='cpu')
     
     # Buscar
     query_vector = model.encode([query])
@@ -127,11 +347,87 @@ def testar_modelo(query, model_output_prefix, top_k=5):
         item = metadata[idx]
         print(f"{i+1}. Score: {score:.4f} | Assunto: {item[0]} | Link: {item[1]}")
 
+def avaliar_indices(embeddings, configuracoes, k=10, n_consultas=500, semente=42):
+    """
+    Compara tipos de índice contra a busca exata (Flat): recall@k e latência.
+    As consultas são linhas do corpus separadas antes de construir os índices: se ficassem
+    nele, cada consulta acharia a si mesma e o recall sairia inflado (sobretudo IVF e PQ).
+    :param embeddings: vetores normalizados (float32) do corpus
+    :param configuracoes: lista de (index_spec, parametros_busca), ex: [("IVF256,Flat", {"nprobe": 16})]
+    :return: lista de dicionários, um por configuração (a primeira linha é o Flat de referência)
+    """
+    rng = np.random.default_rng(semente)
+    # No máximo metade do corpus vira consulta, para sobrar o que indexar
+    amostra = rng.choice(len(embeddings), size=min(n_consultas, len(embeddings) // 2), replace=False)
+    consultas = np.ascontiguousarray(embeddings[amostra])
+    separados = np.zeros(len(embeddings), dtype=bool)
+    separados[amostra] = True
+    embeddings = np.ascontiguousarray(embeddings[~separados])
+
+    def medir(index):
+        inicio = time.perf_counter()
+        _, I = index.search(consultas, k)
+        return I, (time.perf_counter() - inicio) * 1000 / len(consultas)
+
+    inicio = time.perf_counter()
+    referencia = criar_indice(embeddings, "Flat")
+    tempo_ref = time.perf_counter() - inicio
+    esperado, latencia_ref = medir(referencia)
+    relatorio = [{"index_spec": "Flat", "parametros_busca": {}, "recall": 1.0,
+                  "latencia_ms": latencia_ref, "construcao_s": tempo_ref}]
+
+    for index_spec, parametros in configuracoes:
+        inicio = time.perf_counter()
+        index = criar_indice(embeddings, index_spec, parametros)
+        tempo_construcao = time.perf_counter() - inicio
+        obtido, latencia = medir(index)
+        acertos = sum(len(set(e) & set(o)) for e, o in zip(esperado.tolist(), obtido.tolist()))
+        relatorio.append({"index_spec": index_spec, "parametros_busca": dict(parametros or {}),
+                          "recall": acertos / (k * len(consultas)), "latencia_ms": latencia,
+                          "construcao_s": tempo_construcao})
+
+    print(f"\n{'ÍNDICE':<18} | {'PARÂMETROS':<16} | {f'RECALL@{k}':>9} | {'LATÊNCIA':>10} | {'CONSTRUÇÃO':>10}")
+    print("-" * 75)
+    for linha in relatorio:
+        parametros = ",".join(f"{n}={v}" for n, v in linha["parametros_busca"].items())
+        print(f"{linha['index_spec']:<18} | {parametros:<16} | {linha['recall']:>9.3f} | "
+              f"{linha['latencia_ms']:>8.3f}ms | {linha['construcao_s']:>9.2f}s")
+    return relatorio
+
+def relatorio_recall(model_output_prefix, configuracoes, k=10, n_consultas=500):
+    """Roda avaliar_indices com os vetores de um índice Flat já treinado (sem recodificar o corpus)."""
+    salvo = faiss.read_index(f"{model_output_prefix}.index")
+    # Com IndexIDMap2 os vetores ficam no índice interno, em posições contíguas
+    index = faiss.downcast_index(salvo.index) if isinstance(salvo, faiss.IndexIDMap2) else salvo
+    try:
+        embeddings = index.reconstruct_n(0, index.ntotal)
+    except RuntimeError:
+        print("O índice salvo não permite reconstruir os vetores; treine com index_spec='Flat' para avaliar.")
+        return []
+    return avaliar_indices(np.ascontiguousarray(embeddings, dtype=np.float32), configuracoes, k, n_consultas)
+
 if __name__ == "__main__":
     arquivo_entrada = 'tub_index_com_links.csv'
     # Define onde salvar os modelos (ex: pasta 'dados_modelo')
     prefixo_saida = 'model/tub_modelo'
     
+    if "--avaliar" in sys.argv:
+        # Relatório recall@k x latência de algumas opções contra o Flat atual
+        relatorio_recall(prefixo_saida, [
+            ("IVF256,Flat", {"nprobe": 8}),
+            ("IVF256,Flat", {"nprobe": 32}),
+            ("HNSW32", {"efSearch": 32}),
+            ("HNSW32", {"efSearch": 128}),
+            ("IVF256,PQ32", {"nprobe": 32}),
+        ])
+        sys.exit(0)
+
+    if "--paragrafos" in sys.argv:
+        # python training.py --paragrafos ../TR000.gz ../TR007.gz [--por-secao]
+        for traducao in [a for a in sys.argv[1:] if not a.startswith("--")]:
+            treinar_paragrafos(traducao, por_secao="--por-secao" in sys.argv)
+        sys.exit(0)
+
     # Executa o treinamento
     treinar_modelo(arquivo_entrada, prefixo_saida)
     
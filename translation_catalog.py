@@ -0,0 +1,289 @@
+import glob
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import zlib
+from typing import Dict, List, NamedTuple, Optional
+
+from rodam_manifest import HASH_CACHE_FILENAME, MANIFEST_FILENAME, RodamManifestItem, hash_files
+
+# AvailableTranslations.json split into a small header index and one TOC block per language,
+# so listing the languages reads only the header and a table of contents is one slice.
+#
+# Layout (little endian):
+#   header   MAGIC, uint32 index length, uint32 language count
+#   index    UTF-8 JSON: {"SourceHash256", "Languages": [entry, ...]}; each entry holds the scalar
+#            fields of the language, its TR files with their hashes, and TocOffset/TocLength/TocCount
+#   tocs     one zlib-compressed JSON TocData list per language, at the offsets given in the index
+MAGIC = b"TUBCAT01"
+HEADER = struct.Struct("<8sII")
+SOURCE_FILENAME = "AvailableTranslations.json"
+CATALOG_FILENAME = "AvailableTranslations.cat"
+TRANSLATION_EXTENSIONS = (".gz", ".zip")
+
+_TRANSLATION_FILE = re.compile(r"^TR(\d{3})\.(gz|zip)$")
+
+class CatalogFile(NamedTuple):
+    FileName: str
+    Hash256: str
+    # Hash recorded in rodam_manifest.json ("" when the file is not in the manifest)
+    ManifestHash256: str
+
+class CatalogIssue(NamedTuple):
+    Kind: str
+    LanguageID: Optional[int]
+    FileName: str
+    Detail: str
+
+def translation_filename(language_id: int, extension: str) -> str:
+    return f"TR{language_id:03d}{extension}"
+
+def _manifest_hashes(root: str, manifest_filename: str) -> Dict[str, str]:
+    """Hash256 of the TR files in the manifest, by file name (they live at the root)."""
+    items = RodamManifestItem.load_from_manifest(os.path.join(root, manifest_filename))
+    return {item.FileName: item.Hash256 for item in items
+            if _TRANSLATION_FILE.match(item.FileName) and not item.key()[0]}
+
+def build_catalog(source_path: str = SOURCE_FILENAME, output_path: Optional[str] = None,
+                  root: Optional[str] = None, manifest_filename: str = MANIFEST_FILENAME,
+                  cache_path: Optional[str] = HASH_CACHE_FILENAME) -> str:
+    """
+    Writes the catalog for source_path (default output: same name with .cat) and returns its path.
+    The TR files of each language found under root (default: the source's directory) are hashed
+    through the manifest hash cache and stored next to the hash the manifest expects.
+    """
+    root = root if root is not None else (os.path.dirname(source_path) or ".")
+    output_path = output_path or os.path.splitext(source_path)[0] + ".cat"
+    with open(source_path, "rb") as f:
+        source = f.read()
+    languages = json.loads(source)["AvailableTranslations"]
+
+    manifest = _manifest_hashes(root, manifest_filename)
+    paths = {}
+    for language in languages:
+        for extension in TRANSLATION_EXTENSIONS:
+            name = translation_filename(language["LanguageID"], extension)
+            if os.path.isfile(os.path.join(root, name)):
+                paths[name] = os.path.join(root, name)
+    if cache_path and not os.path.isabs(cache_path):
+        cache_path = os.path.join(root, cache_path)
+    hashes = hash_files(list(paths.values()), cache_path=cache_path).hashes if paths else {}
+
+    entries, blocks = [], []
+    offset = 0
+    for language in languages:
+        toc = language.get("TocData") or []
+        block = zlib.compress(json.dumps(toc, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 9)
+        entry = {key: value for key, value in language.items() if key != "TocData"}
+        entry["Files"] = [CatalogFile(name, hashes.get(paths[name]) or "", manifest.get(name, ""))._asdict()
+                          for name in (translation_filename(language["LanguageID"], extension)
+                                       for extension in TRANSLATION_EXTENSIONS) if name in paths]
+        entry["TocOffset"] = offset
+        entry["TocLength"] = len(block)
+        entry["TocCount"] = len(toc)
+        entries.append(entry)
+        blocks.append(block)
+        offset += len(block)
+
+    index = json.dumps({"SourceHash256": hashlib.sha256(source).hexdigest(), "Languages": entries},
+                       ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    temp_path = f"{output_path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(index), len(entries)))
+        f.write(index)
+        for block in blocks:
+            f.write(block)
+    os.replace(temp_path, output_path)
+    return output_path
+
+class TranslationCatalog:
+    """
+    Catalog reader: the constructor parses only the header index; TOC blocks are
+    decompressed from the memory mapped file when a language's TOC is first asked for.
+    """
+
+    def __init__(self, path: str = CATALOG_FILENAME):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_length, count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a translation catalog")
+        index = json.loads(self._mmap[HEADER.size:HEADER.size + index_length].decode("utf-8"))
+        self.source_hash = index["SourceHash256"]
+        self._entries: Dict[int, dict] = {entry["LanguageID"]: entry for entry in index["Languages"]}
+        if len(self._entries) != count:
+            self.close()
+            raise ValueError(f"{path} has {len(self._entries)} languages, header says {count}")
+        self._toc_start = HEADER.size + index_length
+        self._tocs: Dict[int, List[dict]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, language_id: int) -> bool:
+        return language_id in self._entries
+
+    def __enter__(self) -> 'TranslationCatalog':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def languages(self) -> List[int]:
+        """Language ids in the order of AvailableTranslations.json."""
+        return list(self._entries)
+
+    def header(self, language_id: int) -> dict:
+        """Scalar fields of one language (Description, Version, TIN, ...) plus its Files; no TOC."""
+        return self._entries[language_id]
+
+    def files(self, language_id: int) -> List[CatalogFile]:
+        return [CatalogFile(**item) for item in self._entries[language_id]["Files"]]
+
+    def toc(self, language_id: int) -> List[dict]:
+        """The TocData list of one language, read and decompressed on first use."""
+        toc = self._tocs.get(language_id)
+        if toc is None:
+            entry = self._entries[language_id]
+            start = self._toc_start + entry["TocOffset"]
+            toc = json.loads(zlib.decompress(self._mmap[start:start + entry["TocLength"]]).decode("utf-8"))
+            self._tocs[language_id] = toc
+        return toc
+
+    def available_translations(self) -> dict:
+        """The original AvailableTranslations.json document, rebuilt from the catalog."""
+        languages = []
+        for language_id, entry in self._entries.items():
+            language = {key: value for key, value in entry.items()
+                        if key not in ("Files", "TocOffset", "TocLength", "TocCount")}
+            language["TocData"] = self.toc(language_id) if entry["TocCount"] else None
+            languages.append(language)
+        return {"AvailableTranslations": languages}
+
+    def verify(self, root: Optional[str] = None, manifest_filename: str = MANIFEST_FILENAME,
+               source_path: Optional[str] = None,
+               cache_path: Optional[str] = HASH_CACHE_FILENAME) -> List[CatalogIssue]:
+        """
+        Cross-checks the catalog against the TR files under root (hashed through the manifest
+        hash cache), rodam_manifest.json and, when given, the source JSON.
+        An empty list means everything agrees.
+        """
+        root = root if root is not None else (os.path.dirname(self.path) or ".")
+        issues = []
+        if source_path is not None:
+            with open(source_path, "rb") as f:
+                if hashlib.sha256(f.read()).hexdigest() != self.source_hash:
+                    issues.append(CatalogIssue("stale", None, os.path.basename(source_path),
+                                               "catalog was built from another version of the source"))
+
+        manifest = _manifest_hashes(root, manifest_filename)
+        present = {}
+        for language_id in self._entries:
+            for item in self.files(language_id):
+                path = os.path.join(root, item.FileName)
+                if os.path.isfile(path):
+                    present[item.FileName] = path
+        if cache_path and not os.path.isabs(cache_path):
+            cache_path = os.path.join(root, cache_path)
+        on_disk = hash_files(list(present.values()), cache_path=cache_path).hashes if present else {}
+
+        listed = set()
+        for language_id, entry in self._entries.items():
+            files = self.files(language_id)
+            if not files:
+                issues.append(CatalogIssue("no-files", language_id, "", "no TR file for this language"))
+            for item in files:
+                listed.add(item.FileName)
+                if item.FileName not in present:
+                    issues.append(CatalogIssue("missing", language_id, item.FileName, "file not found"))
+                    continue
+                actual = on_disk.get(present[item.FileName]) or ""
+                if actual != item.Hash256:
+                    issues.append(CatalogIssue("hash", language_id, item.FileName,
+                                               f"catalog {item.Hash256[:12]}, file {actual[:12] or 'unreadable'}"))
+                if item.FileName in manifest and manifest[item.FileName] != actual:
+                    issues.append(CatalogIssue("hash", language_id, item.FileName,
+                                               f"file {actual[:12] or 'unreadable'}, manifest {manifest[item.FileName][:12]}"))
+            for extension in TRANSLATION_EXTENSIONS:
+                name = translation_filename(language_id, extension)
+                if name not in listed and os.path.isfile(os.path.join(root, name)):
+                    issues.append(CatalogIssue("unlisted", language_id, name, "file added after the catalog was built"))
+                    listed.add(name)
+
+        for path in sorted(glob.glob(os.path.join(glob.escape(root), "TR[0-9][0-9][0-9].*"))):
+            name = os.path.basename(path)
+            if _TRANSLATION_FILE.match(name) and name not in listed:
+                issues.append(CatalogIssue("orphan", int(name[2:5]), name, "TR file with no catalog entry"))
+        for name in sorted(set(manifest) - listed):
+            issues.append(CatalogIssue("manifest", int(name[2:5]), name, "manifest entry not in the catalog"))
+        return issues
+
+def load_catalog(source_path: str = SOURCE_FILENAME, catalog_path: Optional[str] = None) -> TranslationCatalog:
+    """The catalog of source_path, rebuilt first when it is missing or older than the source."""
+    catalog_path = catalog_path or os.path.splitext(source_path)[0] + ".cat"
+    if not os.path.exists(catalog_path) or os.path.getmtime(catalog_path) < os.path.getmtime(source_path):
+        build_catalog(source_path, catalog_path)
+    try:
+        return TranslationCatalog(catalog_path)
+    except ValueError:
+        build_catalog(source_path, catalog_path)
+        return TranslationCatalog(catalog_path)
+
+def self_check(source_path: str = SOURCE_FILENAME) -> int:
+    """
+    Round trip of the catalog format: builds a scratch catalog for source_path and checks the
+    document it rebuilds equals the source JSON, and that every header and TOC reads back
+    through the lazy accessors. Raises ValueError on a mismatch; returns the language count.
+    """
+    with open(source_path, "rb") as f:
+        source = json.loads(f.read())
+    root = os.path.dirname(source_path) or "."
+    with tempfile.TemporaryDirectory() as work:
+        catalog_path = build_catalog(source_path, os.path.join(work, CATALOG_FILENAME), root=root, cache_path=None)
+        with TranslationCatalog(catalog_path) as catalog:
+            if catalog.available_translations() != source:
+                raise ValueError(f"{source_path}: catalog does not rebuild the source document")
+            for language in source["AvailableTranslations"]:
+                language_id = language["LanguageID"]
+                if catalog.header(language_id)["Description"] != language["Description"]:
+                    raise ValueError(f"{source_path}: header of language {language_id} does not round trip")
+                if catalog.toc(language_id) != (language.get("TocData") or []):
+                    raise ValueError(f"{source_path}: TOC of language {language_id} does not round trip")
+            return len(catalog)
+
+if __name__ == "__main__":
+    # python translation_catalog.py [AvailableTranslations.json]   build, list and cross-check
+    # python translation_catalog.py check [AvailableTranslations.json]   format round trip self-check
+    if sys.argv[1:2] == ["check"]:
+        source = sys.argv[2] if len(sys.argv) > 2 else SOURCE_FILENAME
+        print(f"{source}: round trip ok, {self_check(source)} languages")
+        sys.exit(0)
+    source = sys.argv[1] if len(sys.argv) > 1 else SOURCE_FILENAME
+    catalog_path = build_catalog(source)
+    with TranslationCatalog(catalog_path) as catalog:
+        index_size = catalog._toc_start
+        print(f"{catalog_path}: {len(catalog)} languages, header {index_size} bytes, "
+              f"file {os.path.getsize(catalog_path)} bytes (source {os.path.getsize(source)} bytes)")
+        for language_id in catalog.languages():
+            entry = catalog.header(language_id)
+            files = ", ".join(item.FileName for item in catalog.files(language_id)) or "-"
+            print(f"  {language_id:>4} {entry['Description']:<24} v{entry['Version']} {entry['TIN'] or '-':<32} "
+                  f"{entry['TocCount']} toc entries; {files}")
+        issues = catalog.verify(source_path=source)
+        for issue in issues:
+            language = "" if issue.LanguageID is None else f" TR{issue.LanguageID:03d}"
+            print(f"  {issue.Kind.upper()}{language} {issue.FileName}: {issue.Detail}")
+        print("Catalog consistent." if not issues else f"{len(issues)} issue(s).")
@@ -0,0 +1,361 @@
+import difflib
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import zipfile
+import zlib
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from rodam_manifest import (MANIFEST_DELTA_FILENAME, MANIFEST_FILENAME, RodamManifestItem, calculate_sha256,
+                            update_manifest)
+from translation_stream import ZIP_MEMBER_NAME
+
+# Paragraph-level delta between two releases of a translation (TRnnn.gz / TRnnn.zip).
+#
+# The delta works on the decompressed JSON, cut into chunks that start at each paragraph
+# object, so a revised paragraph costs roughly its own text. Chunks are matched by hash:
+# runs of unchanged chunks become COPY ops over the old content, the rest INSERT ops.
+# The applier rebuilds the content, checks its hash, and recompresses it with the
+# deterministic container writer below, so the file matches the manifest Hash256 as long
+# as the release was written by the same writer (make_patch normalizes it when needed).
+#
+# Patch file: MAGIC followed by a zlib stream of
+#   header   32-byte sha256 of the old content, 32-byte sha256 of the new content,
+#            uint64 new content length
+#   ops      varint op (0 = COPY, 1 = INSERT); COPY: varint offset, varint length;
+#            INSERT: varint length, bytes
+PATCH_MAGIC = b"TUBPAT01"
+PATCH_HEADER = struct.Struct("<32s32sQ")
+PATCH_EXTENSION = ".tpatch"
+OP_COPY = 0
+OP_INSERT = 1
+
+# Deterministic containers: same content, same bytes. Both containers wrap the same raw
+# deflate stream, so it is compressed once however many containers are written.
+GZIP_LEVEL = 9
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+CONTAINER_EXTENSIONS = (".gz", ".zip")
+# ID1 ID2, deflate, no flags, mtime 0, XFL 2 (best compression), OS 255 (unknown)
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xff"
+ZIP_LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+ZIP_CENTRAL_HEADER = struct.Struct("<4sHHHHHHIIIHHHHHII")
+ZIP_END_RECORD = struct.Struct("<4sHHHHIIH")
+ZIP_VERSION = 20
+ZIP_EXTERNAL_ATTR = 0o600 << 16
+
+# Start of every object inside an array: paragraphs whatever their key order, and TOC entries
+_PARAGRAPH_START = re.compile(rb'[\[,]\s*(\{)')
+
+class PatchReport(NamedTuple):
+    PatchPath: str
+    BaseHash256: str
+    Hash256: str
+    PatchHash256: str
+    PatchSize: int
+    FileSize: int
+    Copied: int
+    Inserted: int
+    Normalized: bool
+
+def read_content(path: str) -> bytes:
+    """Decompressed JSON of a translation (.gz, .zip with translation.json, or plain .json)."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".gz":
+        with gzip.open(path, "rb") as f:
+            return f.read()
+    if extension == ".zip":
+        with zipfile.ZipFile(path) as archive:
+            names = archive.namelist()
+            return archive.read(ZIP_MEMBER_NAME if ZIP_MEMBER_NAME in names else names[0])
+    with open(path, "rb") as f:
+        return f.read()
+
+def _zip_bytes(content: bytes, deflated: bytes, crc: int) -> bytes:
+    """Single-member zip (translation.json) around an already deflated stream, laid out as zipfile writes it."""
+    if len(content) >= 2 ** 32 or len(deflated) >= 2 ** 32:
+        raise ValueError("translation too large for a zip without zip64")
+    year, month, day, hour, minute, second = ZIP_DATE_TIME
+    dos_time = hour << 11 | minute << 5 | second // 2
+    dos_date = (year - 1980) << 9 | month << 5 | day
+    name = ZIP_MEMBER_NAME.encode("ascii")
+    local = ZIP_LOCAL_HEADER.pack(b"PK\x03\x04", ZIP_VERSION, 0, zipfile.ZIP_DEFLATED, dos_time, dos_date,
+                                  crc, len(deflated), len(content), len(name), 0) + name
+    central = ZIP_CENTRAL_HEADER.pack(b"PK\x01\x02", ZIP_VERSION, ZIP_VERSION, 0, zipfile.ZIP_DEFLATED, dos_time,
+                                      dos_date, crc, len(deflated), len(content), len(name), 0, 0, 0, 0,
+                                      ZIP_EXTERNAL_ATTR, 0) + name
+    end = ZIP_END_RECORD.pack(b"PK\x05\x06", 0, 0, 1, 1, len(central), len(local) + len(deflated), 0)
+    return b"".join((local, deflated, central, end))
+
+def encode_containers(content: bytes, extensions: Iterable[str] = CONTAINER_EXTENSIONS) -> Dict[str, bytes]:
+    """
+    File bytes of content for each extension (.gz, .zip with translation.json, anything else raw),
+    all built from a single deflate pass. Equal content always gives identical bytes.
+    """
+    extensions = [extension.lower() for extension in extensions]
+    deflated, crc = b"", 0
+    if any(extension in CONTAINER_EXTENSIONS for extension in extensions):
+        deflated = zlib.compress(content, GZIP_LEVEL, wbits=-zlib.MAX_WBITS)
+        crc = zlib.crc32(content)
+    encoded = {}
+    for extension in extensions:
+        if extension == ".gz":
+            encoded[extension] = b"".join((GZIP_HEADER, deflated, struct.pack("<II", crc, len(content) & 0xFFFFFFFF)))
+        elif extension == ".zip":
+            encoded[extension] = _zip_bytes(content, deflated, crc)
+        else:
+            encoded[extension] = content
+    return encoded
+
+def container_bytes(path: str, content: bytes) -> bytes:
+    """The file bytes for content in the container given by path's extension, always identical for equal content."""
+    extension = os.path.splitext(path)[1].lower()
+    return encode_containers(content, (extension,))[extension]
+
+def write_container(path: str, content: bytes) -> str:
+    """Writes content deterministically (see container_bytes) and returns the file's sha256."""
+    data = container_bytes(path, content)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+    return hashlib.sha256(data).hexdigest()
+
+def paragraph_chunks(content: bytes) -> List[Tuple[int, int]]:
+    """(start, end) byte spans covering content, cut at the start of every paragraph (array element) object."""
+    starts = [0] + [m.start(1) for m in _PARAGRAPH_START.finditer(content)]
+    return list(zip(starts, starts[1:] + [len(content)]))
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def _read_varint(data: bytes, position: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+def diff_content(old: bytes, new: bytes) -> List[tuple]:
+    """
+    Ops turning old into new: (OP_COPY, offset, length) copies old[offset:offset + length],
+    (OP_INSERT, 0, data) inserts data.
+    """
+    old_chunks = paragraph_chunks(old)
+    new_chunks = paragraph_chunks(new)
+    old_hashes = [hashlib.sha256(old[s:e]).digest() for s, e in old_chunks]
+    new_hashes = [hashlib.sha256(new[s:e]).digest() for s, e in new_chunks]
+
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            start, end = old_chunks[i1][0], old_chunks[i2 - 1][1]
+            ops.append((OP_COPY, start, end - start))
+        elif j2 > j1:
+            # Changed or inserted paragraphs; deletions need no op at all
+            ops.append((OP_INSERT, 0, new[new_chunks[j1][0]:new_chunks[j2 - 1][1]]))
+    return ops
+
+def make_patch(old_path: str, new_path: str, patch_path: Optional[str] = None, normalize: bool = True) -> PatchReport:
+    """
+    Writes the patch from old_path to new_path and returns its report.
+    With normalize, new_path is rewritten with the deterministic container writer when
+    its bytes differ (same content), so the applier can reproduce it exactly.
+    """
+    old = read_content(old_path)
+    new = read_content(new_path)
+    base_hash = calculate_sha256(old_path)
+
+    normalized = False
+    if normalize:
+        expected = container_bytes(new_path, new)
+        with open(new_path, "rb") as f:
+            current = f.read()
+        if current != expected:
+            write_container(new_path, new)
+            normalized = True
+    target_hash = calculate_sha256(new_path)
+
+    ops = diff_content(old, new)
+    body = bytearray(PATCH_HEADER.pack(hashlib.sha256(old).digest(), hashlib.sha256(new).digest(), len(new)))
+    copied = inserted = 0
+    for op, offset, data in ops:
+        body += _varint(op)
+        if op == OP_COPY:
+            body += _varint(offset) + _varint(data)
+            copied += data
+        else:
+            body += _varint(len(data)) + data
+            inserted += len(data)
+
+    if patch_path is None:
+        patch_path = f"{new_path}.{base_hash[:12]}{PATCH_EXTENSION}"
+    temp_path = f"{patch_path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(PATCH_MAGIC)
+        f.write(zlib.compress(bytes(body), 9))
+    os.replace(temp_path, patch_path)
+    return PatchReport(patch_path, base_hash, target_hash, calculate_sha256(patch_path), os.path.getsize(patch_path),
+                       os.path.getsize(new_path), copied, inserted, normalized)
+
+def apply_patch(old_path: str, patch_path: str, output_path: Optional[str] = None,
+                expected_hash: Optional[str] = None) -> str:
+    """
+    Rebuilds the new release from old_path and the patch, verifying the content hash and,
+    when given, the full-file hash (the manifest Hash256). Raises ValueError on any mismatch
+    without touching output_path (default: old_path, replaced in place). Returns the file hash.
+    """
+    with open(patch_path, "rb") as f:
+        data = f.read()
+    if not data.startswith(PATCH_MAGIC):
+        raise ValueError(f"{patch_path} is not a translation patch")
+    body = zlib.decompress(data[len(PATCH_MAGIC):])
+    old_digest, new_digest, new_length = PATCH_HEADER.unpack_from(body, 0)
+
+    old = read_content(old_path)
+    if hashlib.sha256(old).digest() != old_digest:
+        raise ValueError(f"{patch_path} does not apply to {old_path}")
+
+    pieces = []
+    position = PATCH_HEADER.size
+    while position < len(body):
+        op, position = _read_varint(body, position)
+        if op == OP_COPY:
+            offset, position = _read_varint(body, position)
+            length, position = _read_varint(body, position)
+            pieces.append(old[offset:offset + length])
+        elif op == OP_INSERT:
+            length, position = _read_varint(body, position)
+            pieces.append(body[position:position + length])
+            position += length
+        else:
+            raise ValueError(f"{patch_path}: unknown patch op {op}")
+    new = b"".join(pieces)
+    if len(new) != new_length or hashlib.sha256(new).digest() != new_digest:
+        raise ValueError(f"{patch_path}: rebuilt content does not match the patch")
+
+    output_path = output_path or old_path
+    file_bytes = container_bytes(output_path, new)
+    file_hash = hashlib.sha256(file_bytes).hexdigest()
+    if expected_hash and file_hash != expected_hash:
+        raise ValueError(f"{output_path}: rebuilt file hash {file_hash} does not match {expected_hash}")
+    temp_path = f"{output_path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(file_bytes)
+    os.replace(temp_path, output_path)
+    return file_hash
+
+def record_patches(root: str, reports: List[PatchReport], manifest_filename: str = MANIFEST_FILENAME) -> int:
+    """
+    Stores each patch in the manifest entry of the file it produces (matched by Hash256)
+    and returns how many entries were updated.
+    """
+    manifest_path = os.path.join(root, manifest_filename)
+    items = RodamManifestItem.load_from_manifest(manifest_path)
+    by_hash = {item.Hash256: item for item in items}
+    updated = 0
+    for report in reports:
+        item = by_hash.get(report.Hash256)
+        if item is None:
+            print(f"No manifest entry for {report.PatchPath} (target {report.Hash256[:12]})")
+            continue
+        item.PatchFileName = os.path.basename(report.PatchPath)
+        item.PatchBaseHash256 = report.BaseHash256
+        item.PatchHash256 = report.PatchHash256
+        updated += 1
+    if updated:
+        RodamManifestItem.save_to_manifest(items, manifest_path)
+    return updated
+
+def release(previous_dir: str, root: str = ".", pattern: str = r"TR\d{3}\.(gz|zip)$") -> List[PatchReport]:
+    """
+    Publishes patches for every translation that changed since the release in previous_dir:
+    makes the patches, updates the manifest with the new hashes and records the patches.
+    The manifest delta is written last, so it carries the patch fields and the final manifest hash.
+    """
+    reports = []
+    for name in sorted(os.listdir(root)):
+        old_path = os.path.join(previous_dir, name)
+        new_path = os.path.join(root, name)
+        if not re.match(pattern, name) or not os.path.isfile(old_path):
+            continue
+        if calculate_sha256(old_path) == calculate_sha256(new_path):
+            continue
+        report = make_patch(old_path, new_path)
+        reports.append(report)
+        print(f"{name}: patch {report.PatchSize} bytes for a {report.FileSize} byte file "
+              f"({report.Inserted} bytes inserted{', release normalized' if report.Normalized else ''})")
+    delta = update_manifest(root, delta_filename=None)
+    if record_patches(root, reports):
+        manifest_path = os.path.join(root, MANIFEST_FILENAME)
+        patched = {item.key(): item for item in RodamManifestItem.load_from_manifest(manifest_path)}
+        delta.Changed = [patched.get(item.key(), item) for item in delta.Changed]
+        delta.Hash256 = calculate_sha256(manifest_path) or ""
+    delta.save(os.path.join(root, MANIFEST_DELTA_FILENAME))
+    return reports
+
+def self_check(translation_path: str) -> PatchReport:
+    """
+    Round trip of the patch format on a real translation: revises one paragraph, patches the
+    original into the revision and checks the applier rebuilds the revised file byte for byte.
+    Raises ValueError when it does not; run it after any change to the patch or container code.
+    """
+    content = read_content(translation_path)
+    paragraphs = [(start, end) for start, end in paragraph_chunks(content) if b'"Text": "' in content[start:end]]
+    if not paragraphs:
+        raise ValueError(f"{translation_path}: no paragraph text to revise")
+    start, end = paragraphs[len(paragraphs) // 2]
+    chunk = content[start:end]
+    revised = content[:start] + chunk.replace(b'"Text": "', b'"Text": "(revised) ', 1) + content[end:]
+
+    extension = os.path.splitext(translation_path)[1]
+    with tempfile.TemporaryDirectory() as work:
+        old_path = os.path.join(work, f"old{extension}")
+        new_path = os.path.join(work, f"new{extension}")
+        rebuilt_path = os.path.join(work, f"rebuilt{extension}")
+        shutil.copyfile(translation_path, old_path)
+        write_container(new_path, revised)
+        report = make_patch(old_path, new_path)
+        apply_patch(old_path, report.PatchPath, rebuilt_path, expected_hash=report.Hash256)
+        with open(new_path, "rb") as expected, open(rebuilt_path, "rb") as rebuilt:
+            if expected.read() != rebuilt.read():
+                raise ValueError(f"{translation_path}: patched file differs from the revised release")
+    if report.Inserted >= len(revised) // 2:
+        raise ValueError(f"{translation_path}: one revised paragraph inserted {report.Inserted} bytes")
+    return report
+
+if __name__ == "__main__":
+    # python translation_patch.py <previous release dir>            patches + manifest for the current dir
+    # python translation_patch.py make OLD NEW [PATCH]               one patch
+    # python translation_patch.py apply OLD PATCH [OUTPUT [HASH]]    rebuild a release
+    # python translation_patch.py check TRnnn.gz [TRnnn.zip ...]      format round trip self-check
+    if len(sys.argv) >= 4 and sys.argv[1] == "make":
+        print(make_patch(sys.argv[2], sys.argv[3], sys.argv[4] if len(sys.argv) > 4 else None))
+    elif len(sys.argv) >= 4 and sys.argv[1] == "apply":
+        print(apply_patch(sys.argv[2], sys.argv[3], sys.argv[4] if len(sys.argv) > 4 else None,
+                          sys.argv[5] if len(sys.argv) > 5 else None))
+    elif len(sys.argv) >= 3 and sys.argv[1] == "check":
+        for path in sys.argv[2:]:
+            report = self_check(path)
+            print(f"{path}: round trip ok, patch {report.PatchSize} bytes, {report.Inserted} bytes inserted")
+    elif len(sys.argv) == 2:
+        release(sys.argv[1])
+    else:
+        print("usage: translation_patch.py <previous release dir> | make OLD NEW [PATCH] | "
+              "apply OLD PATCH [OUTPUT [HASH]] | check TRnnn.gz ...")
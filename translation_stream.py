@@ -0,0 +1,241 @@
+import gzip
+import io
+import json
+import os
+import re
+import zipfile
+from collections import namedtuple
+from typing import Iterator, Optional
+
+# One paragraph of a TR*.gz translation file
+ParagraphRecord = namedtuple("ParagraphRecord", ["Paper", "Section", "ParagraphNo", "Text", "Format"])
+
+READ_CHUNK_SIZE = 64 * 1024
+ZIP_MEMBER_NAME = "translation.json"
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_STRUCTURAL = re.compile(r'["{}\[\]]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+# An object without nested containers (a paragraph), matched in one pass by the regex engine
+_FLAT_OBJECT = re.compile(r'\{[^"{}\[\]]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"{}\[\]]*)*\}')
+
+class JsonStreamReader:
+    """
+    Minimal pull parser over a text stream.
+    Only a window of the document is kept in memory: containers are walked key by key
+    (or element by element) and small values are decoded with json's raw_decode.
+    """
+
+    def __init__(self, stream, chunk_size: int = READ_CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        """Reads one more chunk, dropping what was already consumed. False at end of stream."""
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> Optional[str]:
+        """Skips whitespace and returns the next character without consuming it (None at the end)."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return None
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' but found {found!r}")
+        self.pos += 1
+
+    def read_value(self):
+        """Decodes the next value. Meant for scalars and small containers."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buf, self.pos)
+                # A number touching the end of the buffer may continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def skip_value(self):
+        """Skips the next value without building Python objects for it."""
+        first = self.peek()
+        if first not in ("{", "["):
+            self.read_value()
+            return
+        if first == "{":
+            match = _FLAT_OBJECT.match(self.buf, self.pos)
+            if match:
+                self.pos = match.end()
+                return
+        depth = 0
+        while True:
+            match = _STRUCTURAL.search(self.buf, self.pos)
+            if not match:
+                self.pos = len(self.buf)
+                if not self._fill():
+                    raise ValueError("Unexpected end of JSON document")
+                continue
+            self.pos = match.end()
+            char = match.group()
+            if char == '"':
+                self._skip_string_body()
+            elif char in "{[":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def _skip_string_body(self):
+        while True:
+            match = _STRING_SPECIAL.search(self.buf, self.pos)
+            if not match or match.end() >= len(self.buf) and match.group() == "\\":
+                if not self._fill():
+                    raise ValueError("Unterminated JSON string")
+                continue
+            if match.group() == '"':
+                self.pos = match.end()
+                return
+            self.pos = match.end() + 1  # escaped character
+
+    def iter_object(self) -> Iterator[str]:
+        """
+        Walks an object: yields each key with the reader positioned on its value.
+        The caller must consume the value (read_value, skip_value or a nested walk).
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+    def iter_array(self) -> Iterator[int]:
+        """Walks an array: yields each index with the reader positioned on the element to consume."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("]")
+            return
+
+def open_translation(path: str):
+    """Opens a translation (.gz, .zip with translation.json, or plain .json) as a text stream."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8-sig")
+    if extension == ".zip":
+        archive = zipfile.ZipFile(path)
+        names = archive.namelist()
+        member = ZIP_MEMBER_NAME if ZIP_MEMBER_NAME in names else names[0]
+        return io.TextIOWrapper(archive.open(member), encoding="utf-8-sig")
+    return open(path, "r", encoding="utf-8-sig")
+
+def read_header(path: str) -> dict:
+    """Returns the translation's top-level fields (LanguageID, Description, ...), stopping at Papers."""
+    header = {}
+    with open_translation(path) as stream:
+        reader = JsonStreamReader(stream)
+        for key in reader.iter_object():
+            if key == "Papers":
+                break
+            header[key] = reader.read_value()
+    return header
+
+def iter_array_items(path: str) -> Iterator:
+    """Streams the elements of a document whose top level is an array (e.g. tubIndex_000.gz)."""
+    with open_translation(path) as stream:
+        reader = JsonStreamReader(stream)
+        for _ in reader.iter_array():
+            yield reader.read_value()
+
+def iter_object_array(path: str, member: str) -> Iterator:
+    """Streams the elements of the array stored under member in a top-level object (e.g. FormatTable.gz)."""
+    with open_translation(path) as stream:
+        reader = JsonStreamReader(stream)
+        for key in reader.iter_object():
+            if key != member:
+                reader.skip_value()
+                continue
+            for _ in reader.iter_array():
+                yield reader.read_value()
+            return
+
+def iter_paragraphs(path: str, start_paper: int = 0, end_paper: Optional[int] = None) -> Iterator[ParagraphRecord]:
+    """
+    Streams the paragraphs of a translation file in constant memory.
+    Papers before start_paper are skipped without decoding their paragraphs, and reading
+    stops after end_paper (inclusive) when it is given.
+    """
+    with open_translation(path) as stream:
+        reader = JsonStreamReader(stream)
+        for key in reader.iter_object():
+            if key != "Papers":
+                reader.skip_value()
+                continue
+            for _ in reader.iter_array():
+                for paper_key in reader.iter_object():
+                    if paper_key != "Paragraphs":
+                        reader.skip_value()
+                        continue
+                    skipping = False
+                    for _ in reader.iter_array():
+                        if skipping:
+                            reader.skip_value()
+                            continue
+                        paragraph = reader.read_value()
+                        paper = paragraph.get("Paper", 0)
+                        if paper < start_paper:
+                            # Fast path: the rest of this paper is skipped without decoding it
+                            skipping = True
+                            continue
+                        if end_paper is not None and paper > end_paper:
+                            return
+                        yield ParagraphRecord(paper, paragraph.get("Section", 0), paragraph.get("ParagraphNo", 0),
+                                              paragraph.get("Text", ""), paragraph.get("Format", 0))
+            return
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    for file_name in sys.argv[1:] or ["TR000.gz"]:
+        start_time = time.time()
+        count = 0
+        for record in iter_paragraphs(file_name):
+            count += 1
+        print(f"{file_name}: {count} paragraphs in {time.time() - start_time:.2f}s")